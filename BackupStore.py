@@ -0,0 +1,382 @@
+import hashlib
+import json
+import logging
+import os
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, ClassVar, Iterator, Optional
+
+from FileLock import FileLock
+from ScreeningLoader import ScreeningLoader
+from UserPreferences import UserPreferences
+
+
+@dataclass
+class BackupStore:
+    """Point-in-time, deduplicated backups of the local data folders.
+
+    A snapshot copies the history folder (read under the history lock, so
+    the CSV, its meta file and its change log are consistent) and the
+    preferences folder into `target_dir`:
+
+        target_dir/chunks/ab/ab12…     zlib-compressed blocks named by SHA-256
+        target_dir/snapshots/<id>.json file list with sizes, hashes and chunk ids
+
+    Files are cut into content-defined chunks at line boundaries, so a
+    block only changes where the data changed: appending rows or editing
+    a few records stores a handful of new chunks, and the rest is shared
+    with earlier snapshots. Restores check every chunk and file hash before
+    any live file is replaced, and hold one chunk in memory at a time.
+
+    Attributes:
+        target_dir: Backup folder (a local directory, created if missing).
+        screening: History store to back up or restore.
+        preferences: Preferences store to back up or restore.
+    """
+
+    CHUNKS_DIRNAME: ClassVar[str] = "chunks"
+    LOCK_FILENAME: ClassVar[str] = "backup.lock"
+    SNAPSHOTS_DIRNAME: ClassVar[str] = "snapshots"
+    # Lock and temporary files are never part of a snapshot
+    SKIPPED_SUFFIXES: ClassVar[tuple[str, ...]] = (".lock", ".tmp")
+    MIN_CHUNK_BYTES: ClassVar[int] = 16 * 1024
+    MAX_CHUNK_BYTES: ClassVar[int] = 1024 * 1024
+    # A line whose CRC has these low bits at 0 ends a chunk (~1 line in 512)
+    BOUNDARY_MASK: ClassVar[int] = 0x1FF
+    COMPRESSION_LEVEL: ClassVar[int] = 6
+
+    target_dir: Path
+    screening: ScreeningLoader
+    preferences: UserPreferences
+
+    _lock: Optional[FileLock] = field(init=False, default=None, repr=False)
+
+    def __post_init__(self) -> None:
+        """Create the backup folders."""
+        self.target_dir = Path(self.target_dir)
+        (self.target_dir / self.CHUNKS_DIRNAME).mkdir(parents=True, exist_ok=True)
+        (self.target_dir / self.SNAPSHOTS_DIRNAME).mkdir(parents=True, exist_ok=True)
+        # Serializes backups, restores and pruning on the same target
+        self._lock = FileLock(self.target_dir / self.LOCK_FILENAME, timeout=600.0)
+
+    @property
+    def logger(self) -> logging.Logger:
+        """Shared application logger."""
+        return self.screening.logger
+
+    def _sources(self) -> dict[str, Path]:
+        """Map the folder name used in snapshots to the live folder."""
+        return {
+            self.screening.save_dir.name: self.screening.save_dir,
+            self.preferences.save_dir.name: self.preferences.save_dir,
+        }
+
+    @classmethod
+    def split_chunks(cls, data: bytes) -> list[bytes]:
+        """Cut `data` into content-defined chunks.
+
+        A chunk ends after a line whose CRC-32 matches BOUNDARY_MASK once it
+        holds at least MIN_CHUNK_BYTES, or at MAX_CHUNK_BYTES for long lines
+        or binary data. Boundaries only depend on nearby lines, so an insert
+        or a deletion leaves the chunks around it unchanged.
+        """
+        chunks = []
+        start = position = 0
+        size = len(data)
+
+        while position < size:
+            newline = data.find(b"\n", position, start + cls.MAX_CHUNK_BYTES)
+            if newline == -1:
+                end = min(start + cls.MAX_CHUNK_BYTES, size)
+                if end < size:
+                    chunks.append(data[start:end])
+                    start = end
+                position = end
+                continue
+
+            line_start, position = position, newline + 1
+            if position - start >= cls.MIN_CHUNK_BYTES and not zlib.crc32(data[line_start:position]) & cls.BOUNDARY_MASK:
+                chunks.append(data[start:position])
+                start = position
+
+        if start < size:
+            chunks.append(data[start:])
+
+        return chunks
+
+    def _chunk_path(self, digest: str) -> Path:
+        """Return the file holding the chunk with SHA-256 `digest`."""
+        return self.target_dir / self.CHUNKS_DIRNAME / digest[:2] / digest
+
+    def _read_folder(self, folder: str, path: Path, files: dict[str, bytes]) -> None:
+        """Read the files of one folder into `files`, keyed by '<folder>/<name>'."""
+        for file_path in sorted(path.iterdir()):
+            if file_path.is_file() and not file_path.name.endswith(self.SKIPPED_SUFFIXES):
+                files[f"{folder}/{file_path.name}"] = file_path.read_bytes()
+
+    def _read_sources(self) -> tuple[dict[str, bytes], int]:
+        """Read every file to back up.
+
+        The history folder is read under the history lock, so no write can
+        happen halfway through.
+
+        Returns:
+            The file contents keyed by '<folder>/<name>', and the history
+            version they hold.
+        """
+        files: dict[str, bytes] = {}
+        for folder, path in self._sources().items():
+            if path == self.screening.save_dir:
+                with self.screening.lock:
+                    self._read_folder(folder, path, files)
+                    version = self.screening.read_meta()["version"]
+            else:
+                self._read_folder(folder, path, files)
+
+        return files, version
+
+    def snapshot(self, label: Optional[str] = None) -> dict[str, Any]:
+        """Take a snapshot of the history and preferences folders.
+
+        Only chunks not already present in `target_dir` are written. The
+        snapshot file is written last (atomically), so an interrupted backup
+        leaves no partial snapshot behind.
+
+        Args:
+            label: Optional free-text note stored with the snapshot.
+
+        Returns:
+            The snapshot manifest (id, files and write statistics).
+        """
+        with self._lock:
+            return self._snapshot_unlocked(label)
+
+    def _snapshot_unlocked(self, label: Optional[str]) -> dict[str, Any]:
+        """Body of snapshot, called with the backup lock held."""
+        created = datetime.now(timezone.utc)
+        snapshot_id = created.strftime("%Y%m%dT%H%M%S%fZ")
+        stats = {"files": 0, "bytes": 0, "chunks": 0, "new_chunks": 0, "stored_bytes": 0}
+        files = {}
+        contents, version = self._read_sources()
+
+        for name, data in contents.items():
+            digests = []
+            for chunk in self.split_chunks(data):
+                digest = hashlib.sha256(chunk).hexdigest()
+                digests.append(digest)
+                stats["chunks"] += 1
+
+                chunk_path = self._chunk_path(digest)
+                if chunk_path.exists():
+                    continue
+                compressed = zlib.compress(chunk, self.COMPRESSION_LEVEL)
+                chunk_path.parent.mkdir(exist_ok=True)
+                UserPreferences.atomic_write(chunk_path, lambda tmp_path: tmp_path.write_bytes(compressed))
+                stats["new_chunks"] += 1
+                stats["stored_bytes"] += len(compressed)
+
+            files[name] = {"size": len(data), "sha256": hashlib.sha256(data).hexdigest(), "chunks": digests}
+            stats["files"] += 1
+            stats["bytes"] += len(data)
+
+        manifest = {
+            "id": snapshot_id,
+            "created": created.isoformat(),
+            "label": label,
+            "history_version": version,
+            "files": files,
+            "stats": stats,
+        }
+
+        def write(tmp_path: Path) -> None:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(manifest, file, ensure_ascii=False, indent=1)
+
+        UserPreferences.atomic_write(self.target_dir / self.SNAPSHOTS_DIRNAME / f"{snapshot_id}.json", write)
+        self.logger.info(
+            "Backup %s: %d file(s), %d/%d new chunk(s), %d byte(s) stored.",
+            snapshot_id, stats["files"], stats["new_chunks"], stats["chunks"], stats["stored_bytes"],
+        )
+
+        return manifest
+
+    def list_snapshots(self) -> list[dict[str, Any]]:
+        """Return all snapshot manifests, oldest first."""
+        manifests = []
+        for path in sorted((self.target_dir / self.SNAPSHOTS_DIRNAME).glob("*.json")):
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    manifests.append(json.load(file))
+            except json.JSONDecodeError:
+                self.logger.warning("Ignoring unreadable backup manifest %s.", path)
+
+        return manifests
+
+    def load_snapshot(self, snapshot_id: Optional[str] = None) -> dict[str, Any]:
+        """Return one snapshot manifest (the latest if `snapshot_id` is None).
+
+        Raises:
+            FileNotFoundError: If the snapshot does not exist.
+        """
+        if snapshot_id is None:
+            manifests = self.list_snapshots()
+            if not manifests:
+                raise FileNotFoundError(f"No backup in {self.target_dir}.")
+            return manifests[-1]
+
+        with open(self.target_dir / self.SNAPSHOTS_DIRNAME / f"{snapshot_id}.json", "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def iter_file(self, entry: dict[str, Any]) -> Iterator[bytes]:
+        """Rebuild one file of a snapshot chunk by chunk, checking every hash.
+
+        The file hash is checked once its last chunk was yielded, so callers
+        must not use the content before the iteration completes.
+
+        Raises:
+            ValueError: If a chunk or the file does not match its hash.
+            FileNotFoundError: If a chunk is missing.
+        """
+        file_hash = hashlib.sha256()
+        size = 0
+        for digest in entry["chunks"]:
+            chunk = zlib.decompress(self._chunk_path(digest).read_bytes())
+            if hashlib.sha256(chunk).hexdigest() != digest:
+                raise ValueError(f"Corrupted backup chunk {digest}.")
+            file_hash.update(chunk)
+            size += len(chunk)
+            yield chunk
+
+        if size != entry["size"] or file_hash.hexdigest() != entry["sha256"]:
+            raise ValueError("Restored file does not match its checksum.")
+
+    @classmethod
+    def _file_sha256(cls, path: Path) -> str:
+        """Return the SHA-256 of a file, read block by block."""
+        file_hash = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(cls.MAX_CHUNK_BYTES), b""):
+                file_hash.update(block)
+
+        return file_hash.hexdigest()
+
+    def verify(self, snapshot_id: Optional[str] = None) -> list[str]:
+        """Check that a snapshot can be restored.
+
+        Returns:
+            Problems found (empty if every file rebuilds with the right hash).
+        """
+        with self._lock:
+            manifest = self.load_snapshot(snapshot_id)
+            problems = []
+            for name, entry in manifest["files"].items():
+                try:
+                    for _ in self.iter_file(entry):
+                        pass
+                except (OSError, ValueError, zlib.error) as error:
+                    problems.append(f"{name}: {error}")
+
+        return problems
+
+    def restore(self, snapshot_id: Optional[str] = None, into: Optional[Path] = None) -> dict[str, Any]:
+        """Restore a snapshot (the latest if `snapshot_id` is None).
+
+        Runs under the backup lock, so a concurrent prune cannot delete the
+        chunks being read. Each file whose current content differs is
+        rebuilt chunk by chunk into a temporary file next to it and checked;
+        the files are only replaced once all of them passed, so a corrupted
+        snapshot changes nothing.
+
+        Without `into`, the live folders are replaced under the history and
+        preferences locks: history files absent from the snapshot (e.g. a
+        newer change log) are removed, and the store version is moved past
+        its current value so every running session reloads. With `into`,
+        the folders are recreated under that directory instead.
+
+        Args:
+            snapshot_id: Snapshot to restore.
+            into: Optional directory to restore into instead of the live data.
+
+        Returns:
+            The restored snapshot manifest.
+
+        Raises:
+            ValueError: If the snapshot is corrupted (nothing is replaced).
+        """
+        if into is not None:
+            targets = {folder: Path(into) / folder for folder in self._sources()}
+        else:
+            targets = self._sources()
+
+        with self._lock, self.screening.lock, self.preferences.lock:
+            manifest = self.load_snapshot(snapshot_id)
+            current_meta = self.screening.read_meta()
+            staged: dict[Path, Path] = {}
+
+            try:
+                for name, entry in manifest["files"].items():
+                    folder, file_name = name.split("/", 1)
+                    if folder not in targets:
+                        continue
+                    path = targets[folder] / file_name
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    if path.exists() and self._file_sha256(path) == entry["sha256"]:
+                        continue
+                    staged[path] = path.with_name(f"{path.name}.{os.getpid()}.restore.tmp")
+                    with open(staged[path], "wb") as file:
+                        for chunk in self.iter_file(entry):
+                            file.write(chunk)
+
+                for folder, folder_path in targets.items():
+                    folder_path.mkdir(parents=True, exist_ok=True)
+                    wanted = {name.split("/", 1)[1] for name in manifest["files"] if name.split("/", 1)[0] == folder}
+                    if into is None and folder_path == self.screening.save_dir:
+                        for file_path in folder_path.iterdir():
+                            if (file_path.is_file() and file_path.name not in wanted
+                                    and not file_path.name.endswith(self.SKIPPED_SUFFIXES)):
+                                file_path.unlink()
+
+                for path, tmp_path in staged.items():
+                    os.replace(tmp_path, path)
+            finally:
+                for tmp_path in staged.values():
+                    tmp_path.unlink(missing_ok=True)
+
+            if into is None:
+                self.screening.mark_replaced(current_meta)
+
+        self.logger.info(
+            "Backup %s restored into %s (%d file(s) written, %d unchanged).",
+            manifest["id"], into or "the live data folders", len(staged), len(manifest["files"]) - len(staged),
+        )
+
+        return manifest
+
+    def prune(self, keep: int) -> int:
+        """Keep the `keep` most recent snapshots and delete unused chunks.
+
+        Returns:
+            Number of chunk files deleted.
+        """
+        with self._lock:
+            manifests = self.list_snapshots()
+            for manifest in manifests[:max(len(manifests) - keep, 0)]:
+                (self.target_dir / self.SNAPSHOTS_DIRNAME / f"{manifest['id']}.json").unlink(missing_ok=True)
+
+            used = {
+                digest
+                for manifest in self.list_snapshots()
+                for entry in manifest["files"].values()
+                for digest in entry["chunks"]
+            }
+            deleted = 0
+            for chunk_path in (self.target_dir / self.CHUNKS_DIRNAME).glob("*/*"):
+                if chunk_path.name not in used and not chunk_path.name.endswith(".tmp"):
+                    chunk_path.unlink()
+                    deleted += 1
+
+        self.logger.info("Backups pruned to %d snapshot(s), %d unused chunk(s) deleted.", min(keep, len(manifests)), deleted)
+
+        return deleted
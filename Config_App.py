@@ -1,5 +1,14 @@
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+from typing import Mapping, Optional
+
 patient_history_columns = ["Test_date", "STI", "Test_type", "Result", "Location", "Notes", "Entry_ts"]
 
+# Stable identifier of each history row (kept as the DataFrame index in memory)
+patient_history_id_column = "Row_id"
+
 stis_full_list = [
     "HIV",
     "Syphilis",
@@ -126,4 +135,212 @@ sti_result_options = {
     "LGV (Lymphogranuloma venereum)": ["LGV detected", "Not detected", "Other / Don’t know"],
 }
 
-common_results = ["Negative / Non-reactive", "Positive / Reactive", "Not detected", "Inconclusive", "Other / Don’t know"]
\ No newline at end of file
+common_results = ["Negative / Non-reactive", "Positive / Reactive", "Not detected", "Inconclusive", "Other / Don’t know"]
+
+# Results counted as positive by the analytics (positivity rates)
+positive_results = [
+    "Positive / Reactive",
+    "Reactive",
+    "Detected",
+    "IgM positive",
+    "HBsAg positive",
+    "Antibody positive",
+    "RNA detected",
+    "HSV detected",
+    "Serology positive",
+    "HPV detected",
+    "Abnormal cytology",
+    "LGV detected",
+]
+
+# Recommended days between two tests of an STI, per profile tag (the
+# shortest interval of the user's tags applies, otherwise the default)
+recommended_test_intervals = {
+    "MSM (Men who have sex with men)": 180,
+    "PrEP user": 90,
+    "Multiple partners": 180,
+    "Casual partners": 180,
+    "Chemsex": 90,
+    "Sex work": 90,
+}
+
+default_test_interval_days = 365
+
+# Stable code tables for the categorical history columns (code = position in the tuple).
+# New vocabulary must be appended at the end so existing codes keep their meaning.
+sti_code_table: tuple[str, ...] = ()
+test_type_code_table: tuple[str, ...] = ()
+result_code_table: tuple[str, ...] = ()
+
+history_code_tables: dict[str, tuple[str, ...]] = {}
+
+fallback_test_types = ["Other / Don’t know"]
+
+
+@dataclass(frozen=True)
+class VocabularyRegistry:
+    """Immutable, precompiled view of the vocabularies above.
+
+    Built once at import (and again by reload_vocabularies) so the register
+    wizard and bulk validation do O(1) membership and index lookups instead
+    of scanning the lists.
+
+    Attributes:
+        stis: Set of known STIs.
+        profile_tags: Set of known profile tags.
+        test_types: Allowed test types per STI, in display order.
+        results: Allowed results per STI, in display order.
+        test_type_index: Value → position maps of `test_types`, per STI.
+        result_index: Value → position maps of `results`, per STI.
+        fallback_test_types: Test types offered for an STI without its own list.
+        common_results: Results offered for an STI without its own list.
+        fallback_test_type_index: Value → position map of `fallback_test_types`.
+        common_result_index: Value → position map of `common_results`.
+    """
+
+    stis: frozenset[str]
+    profile_tags: frozenset[str]
+    test_types: Mapping[str, tuple[str, ...]]
+    results: Mapping[str, tuple[str, ...]]
+    test_type_index: Mapping[str, Mapping[str, int]]
+    result_index: Mapping[str, Mapping[str, int]]
+    fallback_test_types: tuple[str, ...]
+    common_results: tuple[str, ...]
+    fallback_test_type_index: Mapping[str, int]
+    common_result_index: Mapping[str, int]
+
+    @staticmethod
+    def _index_map(values: tuple[str, ...]) -> Mapping[str, int]:
+        """Return a read-only value → first position map."""
+        index: dict[str, int] = {}
+        for position, value in enumerate(values):
+            index.setdefault(value, position)
+        return MappingProxyType(index)
+
+    @classmethod
+    def build(cls) -> "VocabularyRegistry":
+        """Compile the registry from the current module-level vocabularies."""
+        test_types = {sti: tuple(options) for sti, options in sti_test_types.items()}
+        results = {sti: tuple(options) for sti, options in sti_result_options.items()}
+
+        return cls(
+            stis=frozenset(stis_full_list),
+            profile_tags=frozenset(profile_tags_full_list),
+            test_types=MappingProxyType(test_types),
+            results=MappingProxyType(results),
+            test_type_index=MappingProxyType({sti: cls._index_map(v) for sti, v in test_types.items()}),
+            result_index=MappingProxyType({sti: cls._index_map(v) for sti, v in results.items()}),
+            fallback_test_types=tuple(fallback_test_types),
+            common_results=tuple(common_results),
+            fallback_test_type_index=cls._index_map(tuple(fallback_test_types)),
+            common_result_index=cls._index_map(tuple(common_results)),
+        )
+
+    def test_types_for(self, sti: str) -> tuple[str, ...]:
+        """Return the test types offered for `sti`."""
+        return self.test_types.get(sti, self.fallback_test_types)
+
+    def results_for(self, sti: str) -> tuple[str, ...]:
+        """Return the results offered for `sti`."""
+        return self.results.get(sti, self.common_results)
+
+    def test_type_position(self, sti: str, test_type: Optional[str], default: int = 0) -> int:
+        """Return the position of `test_type` among the test types of `sti` (or `default`)."""
+        return self.test_type_index.get(sti, self.fallback_test_type_index).get(test_type, default)
+
+    def result_position(self, sti: str, result: Optional[str], default: int = 0) -> int:
+        """Return the position of `result` among the results of `sti` (or `default`)."""
+        return self.result_index.get(sti, self.common_result_index).get(result, default)
+
+    def validate_record(self, sti: str, test_type: Optional[str], result: Optional[str]) -> list[str]:
+        """Check one (STI, test type, result) triple against the vocabularies.
+
+        Empty test type or result are accepted (the wizard allows them).
+
+        Returns:
+            A list of human-readable problems (empty if the record is valid).
+        """
+        errors = []
+        if sti not in self.stis:
+            errors.append(f"Unknown STI: {sti!r}")
+            return errors
+        # STIs without their own lists accept the fallback options (see test_types_for)
+        if test_type and test_type not in self.test_type_index.get(sti, self.fallback_test_type_index):
+            errors.append(f"Unknown test type for {sti}: {test_type!r}")
+        if result and result not in self.result_index.get(sti, self.common_result_index):
+            errors.append(f"Unknown result for {sti}: {result!r}")
+        return errors
+
+
+def _rebuild() -> VocabularyRegistry:
+    """Recompute the code tables and the registry from the vocabularies, and return the registry."""
+    global sti_code_table, test_type_code_table, result_code_table, registry
+
+    # Keep previously known codes first so codes stay stable across reloads
+    sti_code_table = tuple(dict.fromkeys([*sti_code_table, *stis_full_list]))
+    test_type_code_table = tuple(dict.fromkeys([
+        *test_type_code_table,
+        *(test_type for test_types in sti_test_types.values() for test_type in test_types),
+    ]))
+    result_code_table = tuple(dict.fromkeys([
+        *result_code_table,
+        *(result for results in sti_result_options.values() for result in results),
+        *common_results,
+    ]))
+
+    history_code_tables.update({
+        "STI": sti_code_table,
+        "Test_type": test_type_code_table,
+        "Result": result_code_table,
+    })
+    registry = VocabularyRegistry.build()
+    return registry
+
+
+# Only built by _rebuild, with the code tables (here and on reload_vocabularies)
+registry: VocabularyRegistry = _rebuild()
+
+
+def get_registry() -> VocabularyRegistry:
+    """Return the current vocabulary registry (follows reload_vocabularies)."""
+    return registry
+
+
+def reload_vocabularies(path: Path) -> VocabularyRegistry:
+    """Reload vocabularies from a JSON file and rebuild the registry.
+
+    The file may contain any of the keys `stis_full_list`,
+    `profile_tags_full_list`, `sti_test_types`, `sti_result_options`,
+    `common_results`, `positive_results` and `recommended_test_intervals`;
+    missing keys keep their current value. The module
+    lists and dicts are updated in place, so modules that imported them
+    see the new values.
+
+    Args:
+        path: Path to the JSON vocabulary file.
+
+    Returns:
+        The new registry.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        vocabularies = json.load(file)
+
+    for name, target in (
+        ("stis_full_list", stis_full_list),
+        ("profile_tags_full_list", profile_tags_full_list),
+        ("common_results", common_results),
+        ("positive_results", positive_results),
+    ):
+        if name in vocabularies:
+            target[:] = vocabularies[name]
+
+    for name, target in (
+        ("sti_test_types", sti_test_types),
+        ("sti_result_options", sti_result_options),
+        ("recommended_test_intervals", recommended_test_intervals),
+    ):
+        if name in vocabularies:
+            target.clear()
+            target.update(vocabularies[name])
+
+    return _rebuild()
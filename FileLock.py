@@ -0,0 +1,111 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@dataclass
+class FileLock:
+    """Cross-process exclusive lock backed by a sidecar lock file.
+
+    Used as a context manager around every read-modify-write of a shared
+    data file, so several Streamlit server processes (or CLI jobs) can work
+    on the same data directory. The lock is re-entrant for the thread that
+    holds it and also serializes threads of the same process.
+
+    Attributes:
+        path: Path of the lock file (created if missing, never deleted).
+        timeout: Seconds to wait for the lock before raising TimeoutError.
+        poll_interval: Seconds between two acquisition attempts.
+    """
+
+    path: Path
+    timeout: float = 10.0
+    poll_interval: float = 0.05
+
+    _handle: Optional[IO] = field(init=False, default=None, repr=False)
+    _depth: int = field(init=False, default=0, repr=False)
+    _thread_lock: threading.RLock = field(init=False, default_factory=threading.RLock, repr=False)
+
+    def __post_init__(self) -> None:
+        """Normalize the lock path and make sure its folder exists."""
+        self.path = Path(self.path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def acquire(self) -> None:
+        """Acquire the lock, waiting up to `timeout` seconds.
+
+        Raises:
+            TimeoutError: If another process keeps the lock for too long.
+        """
+        if not self._thread_lock.acquire(timeout=self.timeout):
+            raise TimeoutError(f"Could not acquire lock {self.path} within {self.timeout}s.")
+
+        if self._depth > 0:
+            self._depth += 1
+            return
+
+        handle = open(self.path, "a+b")
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            try:
+                self._try_lock(handle)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    handle.close()
+                    self._thread_lock.release()
+                    raise TimeoutError(f"Could not acquire lock {self.path} within {self.timeout}s.")
+                time.sleep(self.poll_interval)
+
+        self._handle = handle
+        self._depth = 1
+
+    def release(self) -> None:
+        """Release one level of the lock (the file lock is freed at depth 0)."""
+        if self._depth == 0:
+            return
+
+        self._depth -= 1
+
+        if self._depth == 0 and self._handle is not None:
+            try:
+                self._unlock(self._handle)
+            finally:
+                self._handle.close()
+                self._handle = None
+
+        self._thread_lock.release()
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+    @staticmethod
+    def _try_lock(handle: IO) -> None:
+        """Try once to take an exclusive lock on `handle` (raises OSError if busy)."""
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+
+    @staticmethod
+    def _unlock(handle: IO) -> None:
+        """Release the OS-level lock held on `handle`."""
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,268 @@
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, ClassVar, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from Config_App import default_test_interval_days, positive_results, recommended_test_intervals
+from ScreeningLoader import ScreeningLoader
+from UserPreferences import UserPreferences
+
+
+@dataclass
+class HistoryAnalytics:
+    """Per-STI testing analytics over the patient history.
+
+    Works on the encoded in-memory history: the dated rows are sorted once
+    by (STI code, test day) into numpy arrays, intervals between tests come
+    from `np.diff` within each STI run, and per-STI statistics and
+    positivity tables from `np.bincount` over the categorical codes. The
+    prepared arrays are cached per process and history version, so they
+    are only recomputed after the history changes.
+
+    Several tests of one STI on the same day (e.g. two test types) count as
+    one testing event for frequencies and intervals; positivity counts
+    every row with a result.
+
+    Attributes:
+        screening: History store to analyse.
+        preferences: Preferences whose profile tags set the recommended
+            testing interval.
+    """
+
+    # {history folder: (history version, prepared arrays)}
+    _CACHE: ClassVar[dict[Path, tuple[int, dict[str, Any]]]] = {}
+    _MUTEX: ClassVar[threading.Lock] = threading.Lock()
+
+    screening: ScreeningLoader = field(default_factory=ScreeningLoader)
+    preferences: UserPreferences = field(default_factory=UserPreferences)
+
+    @staticmethod
+    def recommended_interval(profile_tags: Iterable[str]) -> int:
+        """Return the recommended days between two tests for a set of profile tags."""
+        intervals = [recommended_test_intervals[tag] for tag in profile_tags if tag in recommended_test_intervals]
+        return min(intervals, default=default_test_interval_days)
+
+    @staticmethod
+    def _today_days(today: Optional[Any] = None) -> int:
+        """Return `today` (default: the current date) as days since the epoch."""
+        day = pd.Timestamp(today if today is not None else pd.Timestamp.now()).normalize()
+        return int((day - ScreeningLoader._EPOCH).days)
+
+    def prepared(self) -> dict[str, Any]:
+        """Return the analysis arrays of the current history version (cached).
+
+        Loads the history if needed, and otherwise picks up changes made by
+        other sessions first.
+        """
+        screening = self.screening
+        if screening.patient_history is not None:
+            screening.refresh()
+        # The loader may be shared with other sessions: keep the frame and its version together
+        history, version = screening.snapshot()
+
+        cached = self._CACHE.get(screening.save_dir)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        prepared = self._prepare(history)
+        with self._MUTEX:
+            self._CACHE[screening.save_dir] = (version, prepared)
+
+        return prepared
+
+    @staticmethod
+    def _category_mask(values: pd.Series, accepted: Iterable[str]) -> np.ndarray:
+        """Return a boolean array marking the rows whose category is in `accepted`."""
+        lookup = np.append(np.isin(values.cat.categories.to_numpy(dtype=object), list(accepted)), False)
+        # Missing values have code -1, which picks the trailing False
+        return lookup[values.cat.codes.to_numpy()]
+
+    @classmethod
+    def _prepare(cls, history: pd.DataFrame) -> dict[str, Any]:
+        """Compute the sorted event, interval and per-STI arrays of an encoded history."""
+        stis = history["STI"].cat.categories
+        n_stis = len(stis)
+
+        codes = history["STI"].cat.codes.to_numpy().astype(np.int64)
+        positive = cls._category_mask(history["Result"], positive_results)
+        resulted = history["Result"].notna().to_numpy()
+
+        dated = history["Test_date"].notna().to_numpy() & (codes >= 0)
+        days = history["Test_date"].to_numpy(dtype="int64", na_value=0)[dated]
+
+        # One sort of the combined (STI code, day) keys gives the distinct
+        # testing events ordered by STI, then by day
+        first_test_day = days.min() if len(days) else 0
+        span = int(days.max() - first_test_day) + 1 if len(days) else 1
+        events = np.unique(codes[dated] * span + (days - first_test_day))
+        event_codes, event_days = events // span, events % span + first_test_day
+
+        same_sti = event_codes[1:] == event_codes[:-1]
+        intervals = np.diff(event_days)[same_sti]
+        interval_codes = event_codes[1:][same_sti]
+
+        # Events are grouped by STI: runs give the first and last test days
+        starts = np.flatnonzero(np.r_[True, event_codes[1:] != event_codes[:-1]]) if len(event_codes) else np.array([], dtype=np.int64)
+        ends = np.r_[starts[1:], len(event_codes)] - 1
+        first_day = np.full(n_stis, -1, dtype=np.int64)
+        last_day = np.full(n_stis, -1, dtype=np.int64)
+        first_day[event_codes[starts]] = event_days[starts]
+        last_day[event_codes[starts]] = event_days[ends]
+
+        # Medians: sort the intervals within each STI, then pick the middle ones
+        interval_count = np.bincount(interval_codes, minlength=n_stis)
+        sorted_intervals = intervals[np.lexsort((intervals, interval_codes))]
+        offsets = np.cumsum(interval_count) - interval_count
+        has_intervals = interval_count > 0
+        median = np.full(n_stis, np.nan)
+        low = offsets[has_intervals] + (interval_count[has_intervals] - 1) // 2
+        high = offsets[has_intervals] + interval_count[has_intervals] // 2
+        median[has_intervals] = (sorted_intervals[low] + sorted_intervals[high]) / 2
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.bincount(interval_codes, weights=intervals, minlength=n_stis) / interval_count
+
+        valid = codes >= 0
+        return {
+            "stis": stis,
+            "tests": np.bincount(codes[valid], minlength=n_stis),
+            "positives": np.bincount(codes[valid & positive], minlength=n_stis),
+            "resulted": np.bincount(codes[valid & resulted], minlength=n_stis),
+            "test_days": np.bincount(event_codes, minlength=n_stis),
+            "first_day": first_day,
+            "last_day": last_day,
+            "event_codes": event_codes,
+            "event_days": event_days,
+            "intervals": intervals,
+            "interval_codes": interval_codes,
+            "interval_count": interval_count,
+            "mean_interval": mean,
+            "median_interval": median,
+            "by_test_type": cls._positivity_table(history, "Test_type", codes, positive, resulted),
+            "by_location": cls._positivity_table(history, "Location", codes, positive, resulted),
+        }
+
+    @staticmethod
+    def _positivity_table(
+        history: pd.DataFrame, column: str, codes: np.ndarray, positive: np.ndarray, resulted: np.ndarray
+    ) -> pd.DataFrame:
+        """Count tests, results and positives per (STI, `column`) pair.
+
+        Pairs are grouped on combined integer codes with `np.bincount`;
+        a missing `column` value gets its own "Not specified" group.
+        """
+        values = history[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            second_codes = values.cat.codes.to_numpy().astype(np.int64)
+            labels = values.cat.categories
+        else:
+            values = values.where(values.fillna("").astype(str).str.strip() != "")
+            second_codes, labels = pd.factorize(values)
+            second_codes = second_codes.astype(np.int64)
+
+        labels = pd.Index(labels, dtype=object).append(pd.Index(["Not specified"], dtype=object))
+        second_codes = np.where(second_codes < 0, len(labels) - 1, second_codes)
+
+        valid = codes >= 0
+        keys = codes[valid] * len(labels) + second_codes[valid]
+        size = len(history["STI"].cat.categories) * len(labels)
+        tests = np.bincount(keys, minlength=size)
+        present = np.flatnonzero(tests)
+
+        positives = np.bincount(keys[positive[valid]], minlength=size)[present]
+        results = np.bincount(keys[resulted[valid]], minlength=size)[present]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rate = np.where(results > 0, positives / results, np.nan)
+
+        table = pd.DataFrame({
+            "STI": history["STI"].cat.categories.to_numpy(dtype=object)[present // len(labels)],
+            column: labels.to_numpy()[present % len(labels)],
+            "tests": tests[present],
+            "positives": positives,
+            "positivity_rate": rate,
+        })
+        return table.sort_values(["STI", "tests"], ascending=[True, False], ignore_index=True)
+
+    def sti_summary(self, today: Optional[Any] = None) -> pd.DataFrame:
+        """Return one row of testing statistics per tested STI.
+
+        Columns: tests, test_days (testing events), first_test, last_test,
+        days_since_last, tests_last_year, mean_interval and median_interval
+        (days between consecutive events), recommended_interval, adherence
+        (share of intervals within the recommended one), overdue,
+        positives and positivity_rate (positives / rows with a result).
+
+        Args:
+            today: Reference date for days_since_last, tests_last_year and
+                overdue (default: the current date).
+        """
+        prepared = self.prepared()
+        today_days = self._today_days(today)
+        recommended = self.recommended_interval(self.preferences.profile_tags)
+        n_stis = len(prepared["stis"])
+
+        recent = prepared["event_days"] > today_days - 365
+        tests_last_year = np.bincount(prepared["event_codes"][recent], minlength=n_stis)
+
+        within = prepared["intervals"] <= recommended
+        adherent = np.bincount(prepared["interval_codes"][within], minlength=n_stis)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            adherence = np.where(prepared["interval_count"] > 0, adherent / prepared["interval_count"], np.nan)
+            positivity = np.where(prepared["resulted"] > 0, prepared["positives"] / prepared["resulted"], np.nan)
+
+        tested = prepared["test_days"] > 0
+        days_since_last = today_days - prepared["last_day"]
+
+        summary = pd.DataFrame(
+            {
+                "tests": prepared["tests"],
+                "test_days": prepared["test_days"],
+                "first_test": pd.to_datetime(prepared["first_day"], unit="D"),
+                "last_test": pd.to_datetime(prepared["last_day"], unit="D"),
+                "days_since_last": days_since_last,
+                "tests_last_year": tests_last_year,
+                "mean_interval": prepared["mean_interval"],
+                "median_interval": prepared["median_interval"],
+                "recommended_interval": recommended,
+                "adherence": adherence,
+                "overdue": days_since_last > recommended,
+                "positives": prepared["positives"],
+                "positivity_rate": positivity,
+            },
+            index=pd.Index(prepared["stis"], name="STI"),
+        )
+        return summary.loc[tested]
+
+    def positivity_by_test_type(self) -> pd.DataFrame:
+        """Return tests, positives and positivity rate per (STI, Test_type)."""
+        return self.prepared()["by_test_type"].copy()
+
+    def positivity_by_location(self) -> pd.DataFrame:
+        """Return tests, positives and positivity rate per (STI, Location)."""
+        return self.prepared()["by_location"].copy()
+
+    def monthly_tests(self) -> pd.DataFrame:
+        """Return testing events per month (rows) and STI (columns)."""
+        prepared = self.prepared()
+        event_codes = prepared["event_codes"]
+        if not len(event_codes):
+            return pd.DataFrame()
+
+        months = prepared["event_days"].astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+        first_month = months.min()
+        n_months = int(months.max() - first_month) + 1
+        n_stis = len(prepared["stis"])
+
+        counts = np.bincount((months - first_month) * n_stis + event_codes, minlength=n_months * n_stis)
+        table = pd.DataFrame(
+            counts.reshape(n_months, n_stis),
+            index=pd.Index(
+                (np.arange(n_months) + first_month).astype("datetime64[M]").astype("datetime64[ns]"), name="Month"
+            ),
+            columns=prepared["stis"].to_numpy(dtype=object),
+        )
+        return table.loc[:, prepared["test_days"] > 0]
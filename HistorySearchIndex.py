@@ -0,0 +1,405 @@
+import bisect
+import json
+import math
+import re
+import threading
+import unicodedata
+import zipfile
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, ClassVar, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from UserPreferences import UserPreferences
+
+
+@dataclass
+class HistorySearchIndex:
+    """Inverted token index over the free-text columns of the history.
+
+    Maps each token of `Location` and `Notes` to the row ids containing it
+    (with term frequencies), and answers prefix queries ranked by a
+    BM25-like score. Postings are sorted numpy arrays of row ids and term
+    frequencies: a rebuild tokenizes each distinct text once and builds
+    them with one sort, and a query scores, intersects and ranks them with
+    array operations, keeping only the best `limit` rows. It is persisted
+    next to the history as a snapshot file (the postings as numpy arrays)
+    plus an append-only JSON journal: appends and deletions only write one
+    small journal line, and the journal is folded into the snapshot when
+    it grows.
+
+    Parsed indexes are cached per process, so recreating a ScreeningLoader
+    on every Streamlit rerun does not re-read the files.
+
+    An index that is not `persistent` (for an encrypted history, whose
+    words must not be written in plain text) lives only in that cache:
+    it is built from the history and kept up to date by `record`, and no
+    file is written.
+
+    Attributes:
+        save_dir: Folder holding the index files (the history folder).
+        version: History version the index reflects (-1 if never built).
+        persistent: Whether the index is saved to the snapshot and journal.
+    """
+
+    SNAPSHOT_FILENAME: ClassVar[str] = "patient_history.search.npz"
+    # Snapshot of the former JSON format (deleted when a snapshot is saved)
+    _JSON_SNAPSHOT_FILENAME: ClassVar[str] = "patient_history.search.json"
+    JOURNAL_FILENAME: ClassVar[str] = "patient_history.search.log"
+    TEXT_COLUMNS: ClassVar[tuple[str, ...]] = ("Location", "Notes")
+    # Fold the journal into the snapshot once it has this many entries
+    MAX_JOURNAL_ENTRIES: ClassVar[int] = 200
+    PREFIX_WEIGHT: ClassVar[float] = 0.6
+
+    _CACHE: ClassVar[dict[Path, "HistorySearchIndex"]] = {}
+    # Cached indexes are shared by the sessions (threads) of a Streamlit server
+    _MUTEX: ClassVar[threading.RLock] = threading.RLock()
+    _TOKEN_RE: ClassVar[re.Pattern] = re.compile(r"\w+")
+
+    save_dir: Path
+    version: int = -1
+    persistent: bool = True
+
+    # {token: (sorted row ids (int64), term frequencies (int32))}
+    postings: dict[str, tuple[np.ndarray, np.ndarray]] = field(default_factory=dict, repr=False)
+    doc_count: int = 0
+    journal_entries: int = field(default=0, repr=False)
+    _sorted_tokens: Optional[list[str]] = field(init=False, default=None, repr=False)
+
+    @classmethod
+    def tokenize(cls, text: Any) -> list[str]:
+        """Split text into lowercase, accent-free word tokens."""
+        if text is None or (isinstance(text, float) and math.isnan(text)):
+            return []
+        normalized = unicodedata.normalize("NFKD", str(text).casefold())
+        normalized = "".join(char for char in normalized if not unicodedata.combining(char))
+        return cls._TOKEN_RE.findall(normalized)
+
+    @classmethod
+    def row_terms(cls, rows: pd.DataFrame) -> list[tuple[int, dict[str, int]]]:
+        """Return (row id, term frequencies) for each row of `rows`."""
+        texts = rows.reindex(columns=list(cls.TEXT_COLUMNS)).astype(object)
+        # Locations and notes repeat a lot: tokenize each distinct row text once
+        terms_by_text: dict[tuple, dict[str, int]] = {}
+        row_terms = []
+        for row_id, values in zip(rows.index, texts.itertuples(index=False, name=None)):
+            terms = terms_by_text.get(values)
+            if terms is None:
+                terms = dict(Counter(token for value in values for token in cls.tokenize(value)))
+                terms_by_text[values] = terms
+            row_terms.append((int(row_id), terms))
+        return row_terms
+
+    @classmethod
+    def row_postings(cls, rows: pd.DataFrame) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+        """Return the postings of `rows`: {token: (sorted row ids, term frequencies)}.
+
+        Rows are grouped by distinct (Location, Notes) pair, each pair is
+        tokenized once, and a token's posting is the concatenation of the
+        row id groups of the pairs containing it.
+        """
+        texts = rows.reindex(columns=list(cls.TEXT_COLUMNS)).astype(object)
+        location_codes, locations = pd.factorize(texts["Location"])
+        note_codes, notes = pd.factorize(texts["Notes"])
+        pair_codes, pairs = pd.factorize((location_codes + 1).astype(np.int64) * (len(notes) + 1) + note_codes + 1)
+
+        order = np.argsort(pair_codes, kind="stable")
+        groups = np.split(
+            rows.index.to_numpy(dtype=np.int64)[order], np.cumsum(np.bincount(pair_codes, minlength=len(pairs)))[:-1]
+        )
+
+        parts: dict[str, tuple[list[np.ndarray], list[int]]] = {}
+        for pair, group in zip(pairs.tolist(), groups):
+            location_code, note_code = divmod(pair, len(notes) + 1)
+            terms = Counter(cls.tokenize(locations[location_code - 1]) if location_code else [])
+            terms.update(cls.tokenize(notes[note_code - 1]) if note_code else [])
+            for token, tf in terms.items():
+                ids, tfs = parts.setdefault(token, ([], []))
+                ids.append(group)
+                tfs.append(tf)
+
+        postings = {}
+        for token, (ids, tfs) in parts.items():
+            tfs = np.repeat(np.asarray(tfs, dtype=np.int32), [len(group) for group in ids])
+            ids = np.concatenate(ids)
+            if len(ids) > 1 and not (ids[1:] > ids[:-1]).all():
+                order = np.argsort(ids, kind="stable")
+                ids, tfs = ids[order], tfs[order]
+            postings[token] = (ids, tfs)
+
+        return postings
+
+    @classmethod
+    def load(cls, save_dir: Path, from_disk: bool = False, persistent: bool = True) -> "HistorySearchIndex":
+        """Return the index stored in `save_dir` (snapshot + journal).
+
+        Uses the process-wide cache and only replays journal entries newer
+        than the cached version. Missing files give an empty index with
+        version -1.
+
+        Args:
+            save_dir: Folder holding the index files.
+            from_disk: Ignore the cached index and re-read the snapshot
+                (e.g. after another process folded the journal).
+            persistent: False for an index kept in memory only: the files
+                are never read, and the cached index is returned as is.
+        """
+        save_dir = Path(save_dir)
+        index = None if from_disk else cls._CACHE.get(save_dir)
+        if index is not None and index.persistent != persistent:
+            index = None
+
+        if not persistent:
+            if index is None:
+                index = cls(save_dir=save_dir, persistent=False)
+                cls._CACHE[save_dir] = index
+            return index
+
+        if index is None:
+            index = cls(save_dir=save_dir)
+            try:
+                with np.load(save_dir / cls.SNAPSHOT_FILENAME, allow_pickle=False) as snapshot:
+                    index.version = int(snapshot["version"])
+                    index.doc_count = int(snapshot["doc_count"])
+                    # Postings are stored end to end, in token order
+                    bounds = np.cumsum(snapshot["lengths"])[:-1]
+                    index.postings = dict(zip(
+                        snapshot["tokens"].tolist(),
+                        zip(np.split(snapshot["ids"], bounds), np.split(snapshot["tfs"], bounds)),
+                    ))
+            except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+                index = cls(save_dir=save_dir)
+
+        index._replay_journal()
+        cls._CACHE[save_dir] = index
+
+        return index
+
+    def _replay_journal(self) -> None:
+        """Apply journal entries newer than the in-memory version."""
+        try:
+            with open(self.save_dir / self.JOURNAL_FILENAME, "r", encoding="utf-8") as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            lines = []
+
+        self.journal_entries = len(lines)
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A torn last line from an interrupted write: the index will be rebuilt
+                break
+            if entry["base_version"] == self.version:
+                self._apply(entry["remove"], entry["add"])
+                self.version = int(entry["version"])
+
+    def _apply(self, remove: Iterable, add: Iterable) -> None:
+        """Apply removed and added (row id, term frequencies) pairs in memory."""
+        with self._MUTEX:
+            self._apply_unlocked(remove, add)
+
+    def _apply_unlocked(self, remove: Iterable, add: Iterable) -> None:
+        """Body of _apply, called with _MUTEX held.
+
+        Changes are grouped by token, so each touched posting is rebuilt once.
+        """
+        removed: dict[str, list[int]] = {}
+        for row_id, terms in remove:
+            for token in terms:
+                removed.setdefault(token, []).append(int(row_id))
+            self.doc_count -= 1
+
+        added: dict[str, dict[int, int]] = {}
+        for row_id, terms in add:
+            for token, tf in terms.items():
+                added.setdefault(token, {})[int(row_id)] = int(tf)
+            self.doc_count += 1
+
+        for token in removed.keys() | added.keys():
+            ids, tfs = self.postings.get(token, (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32)))
+            new_rows = added.get(token, {})
+            # Added rows replace any posting they already have
+            drop = np.unique(np.asarray([*removed.get(token, []), *new_rows], dtype=np.int64))
+            positions = np.searchsorted(ids, drop)
+            found = positions < len(ids)
+            found[found] = ids[positions[found]] == drop[found]
+            if found.any():
+                ids, tfs = np.delete(ids, positions[found]), np.delete(tfs, positions[found])
+            if new_rows:
+                new_ids = np.asarray(sorted(new_rows), dtype=np.int64)
+                positions = np.searchsorted(ids, new_ids)
+                ids = np.insert(ids, positions, new_ids)
+                tfs = np.insert(tfs, positions, np.asarray([new_rows[row_id] for row_id in new_ids.tolist()], dtype=np.int32))
+
+            if len(ids):
+                if token not in self.postings:
+                    self._sorted_tokens = None
+                self.postings[token] = (ids, tfs)
+            elif token in self.postings:
+                del self.postings[token]
+                self._sorted_tokens = None
+
+    def rebuild(self, history: pd.DataFrame, version: int) -> None:
+        """Rebuild the whole index from `history` and persist it as a snapshot."""
+        postings = self.row_postings(history)
+        with self._MUTEX:
+            self.postings = postings
+            self.doc_count = len(history)
+            self._sorted_tokens = None
+            self.version = version
+        if self.persistent:
+            self.save_snapshot()
+
+    def save_snapshot(self) -> None:
+        """Write the snapshot file atomically and truncate the journal."""
+        with self._MUTEX:
+            tokens = list(self.postings)
+            postings = [self.postings[token] for token in tokens]
+            snapshot = {
+                "version": np.int64(self.version),
+                "doc_count": np.int64(self.doc_count),
+                "tokens": np.asarray(tokens, dtype=str),
+                "lengths": np.asarray([len(ids) for ids, _ in postings], dtype=np.int64),
+                "ids": np.concatenate([ids for ids, _ in postings] or [np.empty(0, dtype=np.int64)]),
+                "tfs": np.concatenate([tfs for _, tfs in postings] or [np.empty(0, dtype=np.int32)]),
+            }
+
+        def write(tmp_path: Path) -> None:
+            with open(tmp_path, "wb") as file:
+                np.savez(file, **snapshot)
+
+        UserPreferences.atomic_write(self.save_dir / self.SNAPSHOT_FILENAME, write)
+        (self.save_dir / self._JSON_SNAPSHOT_FILENAME).unlink(missing_ok=True)
+        (self.save_dir / self.JOURNAL_FILENAME).write_text("", encoding="utf-8")
+        self.journal_entries = 0
+
+    @classmethod
+    def record(
+        cls,
+        save_dir: Path,
+        base_version: int,
+        version: int,
+        removed: Optional[pd.DataFrame] = None,
+        added: Optional[pd.DataFrame] = None,
+    ) -> None:
+        """Record a change of the history in the journal (and in the cached index).
+
+        Must be called under the history store lock, right after the change
+        moved the store from `base_version` to `version`. Does nothing while
+        no index was ever built in `save_dir`. An index kept in memory only
+        is updated without writing the journal.
+
+        Args:
+            save_dir: Folder holding the index files.
+            base_version: History version before the change.
+            version: History version after the change.
+            removed: Rows (old values) removed or replaced by the change.
+            added: Rows (new values) added or replacing old ones.
+        """
+        save_dir = Path(save_dir)
+        index = cls._CACHE.get(save_dir)
+        in_memory = index is not None and not index.persistent
+        if not in_memory and not (save_dir / cls.SNAPSHOT_FILENAME).exists():
+            return
+
+        remove = cls.row_terms(removed) if removed is not None else []
+        add = cls.row_terms(added) if added is not None else []
+
+        if not in_memory:
+            entry = {"base_version": base_version, "version": version, "remove": remove, "add": add}
+            with open(save_dir / cls.JOURNAL_FILENAME, "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+        if index is not None and index.version == base_version:
+            index._apply(remove, add)
+            index.version = version
+            if not in_memory:
+                index.journal_entries += 1
+                if index.journal_entries >= cls.MAX_JOURNAL_ENTRIES:
+                    index.save_snapshot()
+
+    def _expand(self, term: str) -> list[tuple[str, float]]:
+        """Return index tokens matching `term` exactly or as a prefix, with weights."""
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self.postings)
+
+        matches = []
+        position = bisect.bisect_left(self._sorted_tokens, term)
+        while position < len(self._sorted_tokens) and self._sorted_tokens[position].startswith(term):
+            token = self._sorted_tokens[position]
+            matches.append((token, 1.0 if token == term else self.PREFIX_WEIGHT))
+            position += 1
+
+        return matches
+
+    def search(
+        self, query: str, limit: Optional[int] = None, within: Optional[np.ndarray | pd.Index | list[int]] = None
+    ) -> list[tuple[int, float]]:
+        """Return rows matching every query term (as word prefixes), best first.
+
+        Args:
+            query: Free text; each word must prefix-match a word of the row.
+            limit: Maximum number of results (None for all).
+            within: Only rank these row ids (e.g. the index of the rows
+                passing the other filters), or None for all rows.
+
+        Returns:
+            (row id, score) pairs sorted by decreasing score (then
+            decreasing row id).
+        """
+        terms = list(dict.fromkeys(self.tokenize(query)))
+        if not terms or limit == 0:
+            return []
+
+        with self._MUTEX:
+            ids, scores = self._score_unlocked(terms)
+        if within is not None and len(ids):
+            keep = np.isin(ids, np.asarray(within, dtype=np.int64))
+            ids, scores = ids[keep], scores[keep]
+
+        if limit is not None and limit < len(ids):
+            # Keep the rows scoring at least the limit-th best score, then rank only those
+            threshold = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+            keep = scores >= threshold
+            ids, scores = ids[keep], scores[keep]
+        order = np.lexsort((-ids, -scores))[:limit]
+
+        return list(zip(ids[order].tolist(), scores[order].tolist()))
+
+    def _score_unlocked(self, terms: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """Return the ids (sorted) and scores of the rows matching every term (call with _MUTEX held)."""
+        ids = np.empty(0, dtype=np.int64)
+        scores = np.empty(0, dtype=np.float64)
+        for position, term in enumerate(terms):
+            term_ids, term_scores = [], []
+            for token, weight in self._expand(term):
+                token_ids, tfs = self.postings[token]
+                idf = math.log(1 + (self.doc_count - len(token_ids) + 0.5) / (len(token_ids) + 0.5))
+                term_ids.append(token_ids)
+                term_scores.append(weight * idf * tfs / (tfs + 1.0))
+            if not term_ids:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+            if len(term_ids) == 1:
+                matched_ids, matched_scores = term_ids[0], term_scores[0]
+            else:
+                # A row matching several tokens of the term keeps its best score
+                matched_ids, matched_scores = np.concatenate(term_ids), np.concatenate(term_scores)
+                order = np.lexsort((-matched_scores, matched_ids))
+                matched_ids, matched_scores = matched_ids[order], matched_scores[order]
+                first = np.r_[True, matched_ids[1:] != matched_ids[:-1]]
+                matched_ids, matched_scores = matched_ids[first], matched_scores[first]
+
+            if position == 0:
+                ids, scores = matched_ids, matched_scores
+            else:
+                ids, left, right = np.intersect1d(ids, matched_ids, assume_unique=True, return_indices=True)
+                scores = scores[left] + matched_scores[right]
+            if not len(ids):
+                break
+
+        return ids, scores
@@ -0,0 +1,268 @@
+import gzip
+import logging
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, ClassVar, Optional
+
+from FileLock import FileLock
+from ScreeningLoader import ScreeningLoader
+
+
+@dataclass
+class RetentionEngine:
+    """Retention and compaction policy for the app log and the history store.
+
+    A run works through small steps, cheapest first: roll `app.log` when it
+    is too big or too old (rename then gzip; the processes' log handlers
+    reopen a new `app.log`), delete archives past their age or count,
+    then compact the history partitions that have a change log or rows
+    appended out of date order, most fragmented first. It stops once its
+    I/O budget is spent and the next run picks up the rest. Each
+    compaction holds the history lock for a single partition, so
+    interactive sessions never wait for a whole pass.
+
+    Attributes:
+        screening: History store to compact.
+        log_dir: Folder of `app.log` and its archives (default: the
+            `log_files` folder next to the history folder).
+        max_log_bytes: Roll `app.log` once it reaches this size.
+        roll_after_days: Roll `app.log` once its first entry is this old.
+        max_log_age_days: Delete archives older than this.
+        max_log_archives: Keep at most this many archives.
+        min_compact_log_bytes: Compact a partition once its change log
+            reaches this size.
+        min_compact_unsorted_rows: Compact a partition once this many rows
+            were appended out of test date order.
+        io_budget_bytes: Bytes read and written per run (None: no limit).
+            The first step always runs, so every run makes progress.
+        interval_seconds: Minimum time between two background runs.
+        step_pause_seconds: Pause between two steps of a background run.
+    """
+
+    LOG_FILENAME: ClassVar[str] = "app.log"
+    _ARCHIVE_PREFIX: ClassVar[str] = "app.log."
+    _ARCHIVE_SUFFIX: ClassVar[str] = ".gz"
+    _ARCHIVE_STAMP: ClassVar[str] = "%Y%m%d-%H%M%S"
+    _LOG_LOCK_FILENAME: ClassVar[str] = "app.log.lock"
+    # Matches the "%(asctime)s" prefix written by UserPreferences.configure_logging
+    _ENTRY_STAMP: ClassVar[str] = "%Y-%m-%d %H:%M:%S"
+
+    # Background runs, per history folder: running ones and last start time
+    _RUNNING: ClassVar[set[Path]] = set()
+    _LAST_RUN: ClassVar[dict[Path, float]] = {}
+    _MUTEX: ClassVar[threading.Lock] = threading.Lock()
+
+    screening: ScreeningLoader = field(default_factory=ScreeningLoader)
+    log_dir: Optional[Path] = None
+    max_log_bytes: int = 5 * 1024 * 1024
+    roll_after_days: int = 7
+    max_log_age_days: int = 90
+    max_log_archives: int = 20
+    min_compact_log_bytes: int = 64 * 1024
+    min_compact_unsorted_rows: int = 1000
+    io_budget_bytes: Optional[int] = 8 * 1024 * 1024
+    interval_seconds: float = 600.0
+    step_pause_seconds: float = 0.05
+
+    logger: Optional[logging.Logger] = field(init=False, default=None, repr=False)
+
+    def __post_init__(self) -> None:
+        """Resolve the log folder and share the app logger."""
+        self.log_dir = Path(self.log_dir) if self.log_dir is not None else self.screening.save_dir.parent / "log_files"
+        self.logger = self.screening.logger
+
+    @property
+    def log_path(self) -> Path:
+        """Return the active log file."""
+        return self.log_dir / self.LOG_FILENAME
+
+    def archives(self) -> list[tuple[datetime, Path]]:
+        """Return the log archives with their roll time, oldest first."""
+        archives = []
+        for path in self.log_dir.glob(f"{self._ARCHIVE_PREFIX}*{self._ARCHIVE_SUFFIX}"):
+            stamp = path.name[len(self._ARCHIVE_PREFIX):-len(self._ARCHIVE_SUFFIX)]
+            try:
+                archives.append((datetime.strptime(stamp, self._ARCHIVE_STAMP), path))
+            except ValueError:
+                continue
+        return sorted(archives)
+
+    def _first_entry_time(self) -> Optional[datetime]:
+        """Return the time of the first entry of the active log (None if unknown)."""
+        try:
+            with open(self.log_path, "r", encoding="utf-8", errors="replace") as file:
+                head = file.read(19)
+            return datetime.strptime(head, self._ENTRY_STAMP)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def log_roll_due(self, now: Optional[datetime] = None) -> bool:
+        """Return True if the active log is too big or its first entry too old."""
+        try:
+            size = self.log_path.stat().st_size
+        except FileNotFoundError:
+            return False
+        if size == 0:
+            return False
+        if size >= self.max_log_bytes:
+            return True
+
+        first_entry = self._first_entry_time()
+        now = now or datetime.now()
+        return first_entry is not None and now - first_entry >= timedelta(days=self.roll_after_days)
+
+    def roll_log(self) -> int:
+        """Move the active log into a timestamped gzip archive.
+
+        The log is renamed first, so entries written from then on go to a
+        new `app.log`: the handlers of UserPreferences.configure_logging
+        (WatchedFileHandler) reopen it on their next write, in every
+        process. An entry that a process was writing at the very moment of
+        the rename lands in the renamed file; it is archived if it arrives
+        before the copy ends, and lost otherwise.
+
+        Where an open file cannot be renamed (Windows), the log is copied
+        then truncated instead, and entries written by other processes
+        between the copy and the truncation are lost.
+
+        Returns:
+            The number of bytes read and written.
+        """
+        with FileLock(self.log_dir / self._LOG_LOCK_FILENAME):
+            if not self.log_roll_due():
+                return 0
+
+            stamp = datetime.now()
+            archive = self.log_dir / f"{self._ARCHIVE_PREFIX}{stamp.strftime(self._ARCHIVE_STAMP)}{self._ARCHIVE_SUFFIX}"
+            while archive.exists():
+                stamp += timedelta(seconds=1)
+                archive = self.log_dir / f"{self._ARCHIVE_PREFIX}{stamp.strftime(self._ARCHIVE_STAMP)}{self._ARCHIVE_SUFFIX}"
+
+            rolling = archive.with_name(f"{archive.name}.{os.getpid()}.rolling")
+            try:
+                os.replace(self.log_path, rolling)
+            except PermissionError:
+                # Windows: the log is open in other handlers
+                rolling = None
+
+            source_path = rolling or self.log_path
+            tmp_path = archive.with_name(f"{archive.name}.{os.getpid()}.tmp")
+            try:
+                with open(source_path, "rb") as source, gzip.open(tmp_path, "wb") as target:
+                    shutil.copyfileobj(source, target)
+                    read_bytes = source.tell()
+                os.replace(tmp_path, archive)
+            except BaseException:
+                if rolling is not None and not self.log_path.exists():
+                    # Put the log back so its entries are not lost
+                    os.replace(rolling, self.log_path)
+                raise
+            finally:
+                tmp_path.unlink(missing_ok=True)
+            if rolling is not None:
+                rolling.unlink()
+            else:
+                os.truncate(self.log_path, 0)
+
+        self.logger.info("Log rolled into %s (%d byte(s)).", archive.name, read_bytes)
+
+        return read_bytes + archive.stat().st_size
+
+    def prune_archives(self, now: Optional[datetime] = None) -> int:
+        """Delete archives older than `max_log_age_days` or beyond `max_log_archives`.
+
+        Returns:
+            The number of archives deleted.
+        """
+        now = now or datetime.now()
+        archives = self.archives()
+        expired = [
+            path for position, (rolled_at, path) in enumerate(archives)
+            if now - rolled_at > timedelta(days=self.max_log_age_days)
+            or position < len(archives) - self.max_log_archives
+        ]
+        for path in expired:
+            path.unlink(missing_ok=True)
+
+        if expired:
+            self.logger.info("Deleted %d expired log archive(s).", len(expired))
+
+        return len(expired)
+
+    def run(self, io_budget_bytes: Optional[int] = None, pause_seconds: float = 0.0) -> dict[str, Any]:
+        """Apply the policy once, within an I/O budget.
+
+        Args:
+            io_budget_bytes: Overrides `io_budget_bytes` for this run.
+            pause_seconds: Sleep between two steps (lets other work run).
+
+        Returns:
+            A report: {"log_rolled", "archives_deleted", "compacted",
+            "io_bytes", "complete"}, where `complete` is False when some
+            work was left for the next run.
+        """
+        budget = io_budget_bytes if io_budget_bytes is not None else self.io_budget_bytes
+        report: dict[str, Any] = {"log_rolled": False, "archives_deleted": 0, "compacted": [], "io_bytes": 0, "complete": True}
+
+        def affordable(cost: int) -> bool:
+            # The first step always runs, so a small budget still makes progress
+            return budget is None or report["io_bytes"] == 0 or report["io_bytes"] + cost <= budget
+
+        if self.log_roll_due():
+            if affordable(2 * self.log_path.stat().st_size):
+                report["io_bytes"] += self.roll_log()
+                report["log_rolled"] = True
+            else:
+                report["complete"] = False
+        report["archives_deleted"] = self.prune_archives()
+
+        meta = self.screening.read_meta()
+        for name in self.screening.compaction_candidates(
+            self.min_compact_log_bytes, self.min_compact_unsorted_rows, meta
+        ):
+            # Reading the partition and its log, then writing it back
+            if not affordable(2 * self.screening.partition_bytes(name, meta)):
+                report["complete"] = False
+                break
+            if report["io_bytes"] and pause_seconds:
+                time.sleep(pause_seconds)
+            report["io_bytes"] += self.screening.compact_partition(name)
+            report["compacted"].append(name)
+
+        return report
+
+    def schedule(self) -> bool:
+        """Start `run` in a background thread if the interval has elapsed.
+
+        Only one background run per history folder is active at a time.
+
+        Returns:
+            True if a run was started.
+        """
+        save_dir = self.screening.save_dir
+        with self._MUTEX:
+            last_run = self._LAST_RUN.get(save_dir)
+            if save_dir in self._RUNNING or (last_run is not None and time.monotonic() - last_run < self.interval_seconds):
+                return False
+            self._RUNNING.add(save_dir)
+            self._LAST_RUN[save_dir] = time.monotonic()
+
+        def run() -> None:
+            try:
+                report = self.run(pause_seconds=self.step_pause_seconds)
+                if report["log_rolled"] or report["archives_deleted"] or report["compacted"]:
+                    self.logger.info("Retention run: %s", report)
+            except Exception:
+                self.logger.exception("Retention run failed.")
+            finally:
+                with self._MUTEX:
+                    self._RUNNING.discard(save_dir)
+
+        threading.Thread(target=run, name="retention", daemon=True).start()
+
+        return True
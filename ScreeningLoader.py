@@ -1,10 +1,19 @@
-from dataclasses import dataclass
+import io
+import json
+import logging
+import shutil
+import threading
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, ClassVar, Optional
+from typing import Any, ClassVar, Iterable, Optional
 
+import numpy as np
 import pandas as pd
 
-from Config_App import patient_history_columns
+from Config_App import get_registry, history_code_tables, patient_history_columns, patient_history_id_column
+from FileLock import FileLock
+from HistorySearchIndex import HistorySearchIndex
+from StorageCipher import EncryptionError, StorageCipher
 from UserPreferences import UserPreferences
 
 
@@ -14,52 +23,1051 @@ class ScreeningLoader(UserPreferences):
 
     Inherits from UserPreferences to use the same saving directory
     structure and logging configuration.
+
+    Every row carries a stable `Row_id` (the DataFrame index in memory), and
+    the store keeps a version counter in a sidecar meta file. Writes take a
+    cross-process file lock and are merged against the latest on-disk state,
+    so several sessions or server processes can share the same data folder.
+
+    On disk the history is partitioned by test date: one CSV file per year
+    (or per month while a year is still split), listed in a manifest kept in
+    the meta file with row counts and min/max test dates. Writes cost
+    O(changed rows): new rows are appended to their partition's CSV, while
+    corrections and deletions are recorded as small entries of that
+    partition's append-only change log. A reload only re-reads the
+    partitions that changed, `load_range` only reads the partitions
+    overlapping a date range, and a background pass merges small partitions
+    and folds large change logs.
+
+    In memory the history is kept encoded: `STI`, `Test_type` and `Result`
+    are categoricals over the fixed code tables of Config_App, `Test_date`
+    is an Int32 number of days since the epoch and `Entry_ts` an Int64
+    number of nanoseconds. `register_show` decodes for display, and the CSV
+    files keep their plain-text format.
+
+    With a `cipher`, the partition files and change logs are encrypted at
+    rest in chunks (see StorageCipher): appends only encrypt the new rows
+    and each partition is decrypted as it is streamed into `read_csv`. The
+    meta file (row counts and date bounds) stays readable, and the search
+    index is then only kept in memory. Plain partitions of an existing
+    store are encrypted on the next load.
     """
-    
+
+    # Single-file layout used before partitions (migrated on load)
     _FILENAME: ClassVar[str] = "patient_history.csv"
-    
-    save_dir: Path = Path(__file__).resolve().parent / "patient_files"   
+    _LOG_FILENAME: ClassVar[str] = "patient_history.log.jsonl"
+    _META_FILENAME: ClassVar[str] = "patient_history.meta.json"
+    _LOCK_FILENAME: ClassVar[str] = "patient_history.lock"
+    _PARTITION_FILENAME: ClassVar[str] = "patient_history.{name}.csv"
+    _PARTITION_LOG_FILENAME: ClassVar[str] = "patient_history.{name}.log.jsonl"
+    UNDATED_PARTITION: ClassVar[str] = "undated"
+    # A year is stored as one partition while it holds at most this many rows
+    PARTITION_MAX_ROWS: ClassVar[int] = 50_000
+    # A partition's change log is folded into its CSV past this size
+    _MAX_LOG_BYTES: ClassVar[int] = 1024 * 1024
+    EDITABLE_COLUMNS: ClassVar[tuple[str, ...]] = ("Test_date", "STI", "Test_type", "Result", "Location", "Notes")
+    _EPOCH: ClassVar[pd.Timestamp] = pd.Timestamp("1970-01-01")
+    # Columns read as text, so e.g. "01234" keeps its leading zero
+    CSV_DTYPES: ClassVar[dict[str, type]] = {"Location": str, "Notes": str}
+    # Rows with the same values in these columns are duplicates
+    DUPLICATE_KEY_COLUMNS: ClassVar[tuple[str, ...]] = ("Test_date", "STI", "Test_type", "Result", "Location")
+
+    # Duplicate-key hash index per data folder, shared by the instances of
+    # the process: {save_dir: (history version, {key hash: row id})}
+    _DUPLICATE_INDEX: ClassVar[dict[Path, tuple[int, dict[int, int]]]] = {}
+    # Categorical columns whose distinct values `facets` counts
+    FACET_COLUMNS: ClassVar[tuple[str, ...]] = ("STI", "Test_type", "Result")
+    # Filter facets per data folder, shared by the instances of the
+    # process: {save_dir: (history version, facets)}
+    _FACETS: ClassVar[dict[Path, tuple[int, dict[str, Any]]]] = {}
+
+    # Data folders with a background maintenance pass running in this process
+    _MAINTENANCE: ClassVar[set[Path]] = set()
+    _MAINTENANCE_MUTEX: ClassVar[threading.Lock] = threading.Lock()
+
+    save_dir: Path = Path(__file__).resolve().parent / "patient_files"
     patient_history: Optional[pd.DataFrame] = None
-    
+
+    _version: int = field(init=False, default=-1, repr=False)
+    _generation: int = field(init=False, default=-1, repr=False)
+    _partitions: dict[str, dict[str, Any]] = field(init=False, default_factory=dict, repr=False)
+    _next_row_id: int = field(init=False, default=0, repr=False)
+    _lock: Optional[FileLock] = field(init=False, default=None, repr=False)
 
     def __post_init__(self) -> None:
         """Initialize directories after dataclass creation."""
         super().__post_init__()
         self.build_path().parent.mkdir(parents=True, exist_ok=True)
+        self._lock = FileLock(self.save_dir / self._LOCK_FILENAME)
+
+    @property
+    def version(self) -> int:
+        """Version of the in-memory history (-1 if nothing was loaded yet)."""
+        return self._version
+
+    @property
+    def lock(self) -> FileLock:
+        """Cross-process lock of the history files (hold it to read them consistently)."""
+        return self._lock
+
+    def partition_path(self, name: str) -> Path:
+        """Return the CSV file of a partition."""
+        return self.save_dir / self._PARTITION_FILENAME.format(name=name)
+
+    def _partition_log_path(self, name: str) -> Path:
+        """Return the change log file of a partition."""
+        return self.save_dir / self._PARTITION_LOG_FILENAME.format(name=name)
+
+    def read_meta(self) -> dict[str, Any]:
+        """Read the sidecar meta file.
+
+        Returns:
+            The store version, the next row id, the partition generation
+            counter, whether the files are encrypted, and the partition
+            manifest: {name: {"rows", "min_day", "max_day", "log_bytes",
+            "unsorted_rows", "generation"}}, where `unsorted_rows` counts
+            rows appended out of test date order and the generation changes
+            whenever the partition's files change.
+        """
+        try:
+            with open(self.save_dir / self._META_FILENAME, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            meta = {}
+
+        return {
+            "version": int(meta.get("version", 0)),
+            "next_row_id": int(meta.get("next_row_id", 0)),
+            "generation": int(meta.get("generation", 0)),
+            "encrypted": bool(meta.get("encrypted", False)),
+            "partitions": meta.get("partitions", {}),
+        }
+
+    def _write_meta(self, meta: dict[str, Any]) -> None:
+        """Atomically write the sidecar meta file."""
+        def write(tmp_path: Path) -> None:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(meta, file)
+
+        self.atomic_write(self.save_dir / self._META_FILENAME, write)
+
+    def _commit(self, meta: dict[str, Any], touched: Iterable[str] = ()) -> None:
+        """Write `meta` after a data change (call under the lock).
+
+        Bumps the store version and gives the touched partitions a new
+        generation. The in-memory history is marked as matching the new
+        meta: it must already hold the change, or the caller swaps it in
+        right after this returns.
+        """
+        touched = [name for name in touched if name in meta["partitions"]]
+        if touched:
+            meta["generation"] += 1
+            for name in touched:
+                meta["partitions"][name]["generation"] = meta["generation"]
+        meta["version"] += 1
+        meta["next_row_id"] = max(meta["next_row_id"], self._next_row_id)
+        self._write_meta(meta)
+
+        self._version = meta["version"]
+        self._generation = meta["generation"]
+        self._partitions = {name: dict(info) for name, info in meta["partitions"].items()}
+        self._schedule_maintenance(meta)
+
+    def mark_replaced(self, previous_meta: dict[str, Any]) -> None:
+        """Move the store past `previous_meta` after its files were replaced (call under the lock).
+
+        Used after a restore: the restored meta file may carry older version
+        and generation numbers, so both move past the previous ones (and row
+        ids are never reused), which makes every session reload.
+        """
+        meta = self.read_meta()
+        meta["version"] = max(meta["version"], previous_meta["version"]) + 1
+        meta["generation"] = max(meta["generation"], previous_meta["generation"]) + 1
+        meta["next_row_id"] = max(meta["next_row_id"], previous_meta["next_row_id"])
+        for info in meta["partitions"].values():
+            info["generation"] = meta["generation"]
+        self._write_meta(meta)
+
+    def is_stale(self) -> bool:
+        """Return True if another session changed the history since it was loaded."""
+        return self.patient_history is None or self.read_meta()["version"] != self._version
+
+    def snapshot(self) -> tuple[pd.DataFrame, int]:
+        """Return the in-memory history and its version, read together (loading it if needed).
+
+        For a loader shared by several threads (e.g. the Streamlit sessions
+        of a process). Writes never modify the frame in place: appends,
+        corrections and deletions replace patient_history with a new frame,
+        so the returned frame, and masks and views built from it, stay as
+        they were while other threads write.
+        """
+        with self._lock:
+            if self.patient_history is None:
+                self.load_patient_history()
+            return self.patient_history, self._version
+
+    def refresh(self) -> bool:
+        """Bring the in-memory history up to date with the files.
+
+        Only the partitions whose generation changed are re-read.
+
+        Returns:
+            True if anything was reloaded.
+        """
+        meta = self.read_meta()
+        if (self.patient_history is not None and meta["version"] == self._version
+                and meta["generation"] == self._generation):
+            return False
+
+        with self._lock:
+            self._sync(self.read_meta())
+        return True
 
     def load_patient_history(self) -> None:
-        """Load patient history from CSV file.
+        """Load patient history from its partition files.
 
-        If the file does not exist, creates an empty DataFrame with
-        predefined columns from Config_App.patient_history_columns.
+        If there is no data yet, creates an empty DataFrame with predefined
+        columns from Config_App.patient_history_columns. A history in the
+        single-file layout is migrated to partitions first. Pending entries
+        of the partition change logs are applied on top.
         """
-        path_to_history = self.build_path()
-        
-        try:   
-            self.patient_history = pd.read_csv(path_to_history)
-            self.logger.info("Patient history loaded successfully from %s.", path_to_history)
-        except FileNotFoundError:   
-            self.patient_history = pd.DataFrame(columns=patient_history_columns)
+        with self._lock:
+            self.patient_history = None
+            self._partitions = {}
+            self._sync(self.read_meta())
+
+        if self._partitions:
+            self.logger.info(
+                "Patient history loaded successfully from %s (%d partition(s)).", self.save_dir, len(self._partitions)
+            )
+        else:
             self.logger.warning("History data not found, using empty dataframe.")
-            
-    def save_patient_history(self) -> None:
-        """Save patient history to CSV file.
 
-       If patient_history is empty or invalid, logs a warning instead.
-       """
+    def _sync(self, meta: dict[str, Any]) -> None:
+        """Re-read the partitions that changed since the last sync (call under the lock).
+
+        Rows are routed to partitions by test date, so the in-memory rows of
+        a changed partition are exactly those within its date range.
+        """
+        if self.build_path().exists():
+            self._migrate_single_file()
+            return
+        if meta["encrypted"] and self.cipher is None:
+            raise EncryptionError(
+                f"The history in {self.save_dir} is encrypted: set {StorageCipher.PASSPHRASE_ENV} to its passphrase."
+            )
+        if self.cipher is not None and not meta["encrypted"]:
+            self._encrypt_partitions(meta)
+
+        partitions = meta["partitions"]
+        if self.patient_history is None:
+            reload = set(partitions)
+            frames = []
+        else:
+            reload = {
+                name for name, info in partitions.items()
+                if self._partitions.get(name, {}).get("generation") != info["generation"]
+            }
+            dropped = reload | (self._partitions.keys() - partitions.keys())
+            history = self.patient_history
+            frames = [history.loc[~self._partition_mask(history["Test_date"], dropped)]]
+
+        frames.extend(self._read_partition(name) for name in sorted(reload))
+        self.patient_history = self._concat(frames)
+        self._version = meta["version"]
+        self._generation = meta["generation"]
+        self._partitions = {name: dict(info) for name, info in partitions.items()}
+        self._next_row_id = max(
+            meta["next_row_id"], int(self.patient_history.index.max()) + 1 if len(self.patient_history) else 0
+        )
+
+    def _migrate_single_file(self) -> None:
+        """Load the single-file layout and rewrite it as partitions (call under the lock).
+
+        Files written before row ids existed get ids assigned on load. The
+        original file (and its change log) is kept with a `.bak` suffix.
+        """
         path_to_history = self.build_path()
-        
+        history = pd.read_csv(path_to_history, dtype=self.CSV_DTYPES)
+        if patient_history_id_column in history.columns:
+            history = history.set_index(patient_history_id_column)
+        else:
+            history.index = pd.RangeIndex(len(history), name=patient_history_id_column)
+        history.index = history.index.astype("int64")
+
+        # The migration is one-way: keep the original files next to the partitions
+        legacy_log = self.save_dir / self._LOG_FILENAME
+        for path in (path_to_history, legacy_log):
+            if path.exists():
+                shutil.copy2(path, path.with_name(f"{path.name}.bak"))
+
+        unparsed = self._unparsed(history["Test_date"], self.parse_test_dates(history["Test_date"]))
+        if unparsed.any():
+            # Those rows are kept without a date
+            self.logger.warning(
+                "%d test date(s) of %s could not be parsed; original file kept as %s.bak.",
+                unparsed.sum(), path_to_history.name, path_to_history.name,
+            )
+
+        self.patient_history = self._replay_log(
+            self.encode_history(history), self._read_log(legacy_log)
+        )
+        self._next_row_id = max(self.read_meta()["next_row_id"], int(history.index.max()) + 1 if len(history) else 0)
+        self.logger.info("Migrating %s (%d row(s)) to date partitions.", path_to_history, len(self.patient_history))
+        self.save_patient_history()
+
+    def encrypted_files(self, meta: Optional[dict[str, Any]] = None) -> list[Path]:
+        """Return the history files (partitions, change logs, old layout) that are encrypted."""
+        meta = self.read_meta() if meta is None else meta
+        paths = [self.build_path(), self.save_dir / self._LOG_FILENAME]
+        for name in sorted(meta["partitions"]):
+            paths += [self.partition_path(name), self._partition_log_path(name)]
+
+        return [path for path in paths if path.exists() and StorageCipher.is_encrypted(path)]
+
+    def _encrypt_partitions(self, meta: dict[str, Any]) -> None:
+        """Rewrite the plain partitions of the store encrypted (call under the lock).
+
+        Data is unchanged, so like `maintain` the version stays the same and
+        only the rewritten partitions get a new generation. The plain search
+        index files are removed.
+        """
+        plain = [
+            name for name in sorted(meta["partitions"])
+            if any(
+                path.exists() and not StorageCipher.is_encrypted(path)
+                for path in (self.partition_path(name), self._partition_log_path(name))
+            )
+        ]
+        if plain:
+            meta["generation"] += 1
+        for name in plain:
+            self._write_partition(meta, name, self._read_partition(name))
+            meta["partitions"][name]["generation"] = meta["generation"]
+        meta["encrypted"] = True
+        self._write_meta(meta)
+
+        for name in plain:
+            self._partition_log_path(name).unlink(missing_ok=True)
+        for filename in (HistorySearchIndex.SNAPSHOT_FILENAME, HistorySearchIndex.JOURNAL_FILENAME):
+            (self.save_dir / filename).unlink(missing_ok=True)
+
+        self.logger.info("History in %s encrypted at rest (%d partition(s) rewritten).", self.save_dir, len(plain))
+
+    def _read_partition(self, name: str) -> pd.DataFrame:
+        """Read one partition (CSV file plus change log) as encoded rows."""
+        try:
+            with self.open_file(self.partition_path(name)) as file:
+                rows = pd.read_csv(file, dtype=self.CSV_DTYPES)
+        except FileNotFoundError:
+            # A partition may only exist in its change log (rows moved into it)
+            rows = pd.DataFrame(columns=[patient_history_id_column, *patient_history_columns])
+        if patient_history_id_column not in rows.columns:
+            # Appended to before it had a file, by an earlier version: no header
+            self.logger.warning(
+                "%s has no header row; reading it with the default columns.", self.partition_path(name).name
+            )
+            with self.open_file(self.partition_path(name)) as file:
+                rows = pd.read_csv(
+                    file, dtype=self.CSV_DTYPES, header=None, names=[patient_history_id_column, *patient_history_columns]
+                )
+
+        rows = rows.set_index(patient_history_id_column)
+        rows.index = rows.index.astype("int64")
+
+        return self._replay_log(self.encode_history(rows), self._read_log(self._partition_log_path(name)))
+
+    def load_range(self, start_date: Optional[Any] = None, end_date: Optional[Any] = None) -> pd.DataFrame:
+        """Read the rows tested between two dates without loading the whole history.
+
+        Only the partitions whose min/max test dates overlap the range are
+        read; patient_history is left untouched.
+
+        Args:
+            start_date: First test date to keep (inclusive), or None.
+            end_date: Last test date to keep (inclusive), or None.
+
+        Returns:
+            The encoded rows, in partition order.
+        """
+        first = None if start_date is None else (pd.Timestamp(start_date).normalize() - self._EPOCH).days
+        last = None if end_date is None else (pd.Timestamp(end_date).normalize() - self._EPOCH).days
+
+        with self._lock:
+            if self.build_path().exists():
+                self.load_patient_history()
+            partitions = self.read_meta()["partitions"]
+            names = [
+                name for name, info in sorted(partitions.items())
+                if (first is None and last is None) or (
+                    info["min_day"] is not None
+                    and (last is None or info["min_day"] <= last)
+                    and (first is None or info["max_day"] >= first)
+                )
+            ]
+            rows = self._concat([self._read_partition(name) for name in names])
+
+        self.logger.info("load_range: read %d/%d partition(s), %d row(s).", len(names), len(partitions), len(rows))
+        days = rows["Test_date"].to_numpy(dtype="float64", na_value=np.nan)
+        mask = np.ones(len(rows), dtype=bool)
+        if first is not None:
+            mask &= days >= first
+        if last is not None:
+            mask &= days <= last
+
+        return rows.loc[mask]
+
+    def _read_log(self, path: Path) -> list[dict[str, Any]]:
+        """Read a change log (a torn last line from a crash is ignored)."""
+        entries = []
+        try:
+            with self.open_file(path) as file:
+                for line in file:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        self.logger.warning("Ignoring an incomplete change log entry in %s.", path.name)
+                        break
+        except FileNotFoundError:
+            pass
+
+        return entries
+
+    def _append_log(self, meta: dict[str, Any], name: str, entry: dict[str, Any]) -> None:
+        """Append one entry to a partition's change log (call under the lock)."""
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self.open_file(self._partition_log_path(name), "a") as file:
+            file.write(line)
+        self._partition_info(meta, name)["log_bytes"] += len(line.encode("utf-8"))
+
+    @classmethod
+    def _replay_log(cls, rows: pd.DataFrame, entries: list[dict[str, Any]]) -> pd.DataFrame:
+        """Apply change log entries, in order, to encoded rows.
+
+        Entries are "update" (new values of some cells), "delete" (row ids)
+        and "put" (whole rows, as CSV text, moved into the partition by a
+        date change).
+        """
+        for entry in entries:
+            if entry["op"] == "update":
+                rows = cls._apply_updates(rows, {int(row_id): values for row_id, values in entry["changes"].items()})[0]
+            elif entry["op"] == "delete":
+                rows = rows.drop(index=entry["ids"], errors="ignore")
+            elif entry["op"] == "put":
+                put = pd.read_csv(io.StringIO(entry["csv"]), dtype=cls.CSV_DTYPES).set_index(patient_history_id_column)
+                put.index = put.index.astype("int64")
+                rows = cls._concat([rows.drop(index=put.index, errors="ignore"), cls.encode_history(put)])
+
+        return rows
+
+    @classmethod
+    def _partition_bounds(cls, name: str) -> Optional[tuple[int, int]]:
+        """Return the [first, last + 1) day numbers a partition covers (None if undated)."""
+        if name == cls.UNDATED_PARTITION:
+            return None
+
+        start = pd.Timestamp(f"{name}-01-01" if name.isdigit() else f"{name}-01")
+        end = start + (pd.DateOffset(years=1) if name.isdigit() else pd.DateOffset(months=1))
+
+        return (start - cls._EPOCH).days, (end - cls._EPOCH).days
+
+    @classmethod
+    def _partition_mask(cls, days: pd.Series, names: Iterable[str]) -> np.ndarray:
+        """Return a boolean mask of the rows whose test date falls in the given partitions."""
+        values = days.to_numpy(dtype="float64", na_value=np.nan)
+        mask = np.zeros(len(values), dtype=bool)
+        for name in names:
+            bounds = cls._partition_bounds(name)
+            if bounds is None:
+                mask |= np.isnan(values)
+            else:
+                mask |= (values >= bounds[0]) & (values < bounds[1])
+
+        return mask
+
+    @classmethod
+    def _route(cls, days: pd.Series, yearly: Iterable[str]) -> np.ndarray:
+        """Return the partition name of each row from its encoded test date.
+
+        A row goes to its year's partition if that year is in `yearly`, else
+        to its month's partition; rows without a date go to UNDATED_PARTITION.
+        """
+        yearly = set(yearly)
+        values = days.to_numpy(dtype="float64", na_value=np.nan)
+        names = np.full(len(values), cls.UNDATED_PARTITION, dtype=object)
+        dated = ~np.isnan(values)
+
+        months, inverse = np.unique(
+            values[dated].astype("int64").astype("datetime64[D]").astype("datetime64[M]"), return_inverse=True
+        )
+        labels = [str(month)[:4] if str(month)[:4] in yearly else str(month) for month in months]
+        names[dated] = np.array(labels, dtype=object)[inverse]
+
+        return names
+
+    @classmethod
+    def _yearly_layout(cls, days: pd.Series) -> set[str]:
+        """Return the years small enough to be stored as a single partition."""
+        values = days.to_numpy(dtype="float64", na_value=np.nan)
+        values = values[~np.isnan(values)]
+        years, counts = np.unique(values.astype("int64").astype("datetime64[D]").astype("datetime64[Y]"), return_counts=True)
+
+        return {str(year) for year, count in zip(years, counts) if count <= cls.PARTITION_MAX_ROWS}
+
+    @classmethod
+    def _yearly_for(cls, meta: dict[str, Any], rows: pd.DataFrame) -> set[str]:
+        """Return the years stored as a single partition once `rows` are added.
+
+        Years new to the store get a single partition if they are small enough.
+        """
+        split_years = {name[:4] for name in meta["partitions"] if not name.isdigit()}
+        yearly = {name for name in meta["partitions"] if name.isdigit()}
+
+        return yearly | (cls._yearly_layout(rows["Test_date"]) - split_years)
+
+    @staticmethod
+    def _partition_info(meta: dict[str, Any], name: str) -> dict[str, Any]:
+        """Return the manifest entry of a partition, creating it if needed."""
+        return meta["partitions"].setdefault(
+            name, {"rows": 0, "min_day": None, "max_day": None, "log_bytes": 0, "unsorted_rows": 0, "generation": 0}
+        )
+
+    @classmethod
+    def _widen(cls, info: dict[str, Any], rows: pd.DataFrame) -> None:
+        """Extend a manifest entry's min/max test dates to cover `rows`."""
+        days = rows["Test_date"].dropna()
+        if len(days):
+            info["min_day"] = int(days.min()) if info["min_day"] is None else min(info["min_day"], int(days.min()))
+            info["max_day"] = int(days.max()) if info["max_day"] is None else max(info["max_day"], int(days.max()))
+
+    def _write_partition(self, meta: dict[str, Any], name: str, rows: pd.DataFrame) -> None:
+        """Rewrite a partition's CSV file from encoded rows (call under the lock).
+
+        The change log is not removed: the caller deletes it once the new
+        meta is written (replaying it on the new file changes nothing).
+        """
+        to_save = self._to_csv_frame(rows)
+
+        def write(tmp_path: Path) -> None:
+            with self.open_file(tmp_path, "w") as file:
+                to_save.to_csv(file, index=True)
+
+        self.atomic_write(self.partition_path(name), write)
+        in_order = rows["Test_date"].dropna().is_monotonic_increasing
+        meta["partitions"][name] = {
+            "rows": len(rows), "min_day": None, "max_day": None, "log_bytes": 0,
+            "unsorted_rows": 0 if in_order else len(rows), "generation": 0,
+        }
+        self._widen(meta["partitions"][name], rows)
+
+    def _append_rows(self, meta: dict[str, Any], rows: pd.DataFrame) -> list[str]:
+        """Append new encoded rows to the CSV files of their partitions (call under the lock).
+
+        Returns:
+            The names of the partitions written.
+        """
+        written = []
+        for name, part in rows.groupby(self._route(rows["Test_date"], self._yearly_for(meta, rows)), sort=True):
+            if name not in meta["partitions"]:
+                # New partition: replace any leftover file of an interrupted merge
+                self._write_partition(meta, name, part)
+                self._partition_log_path(name).unlink(missing_ok=True)
+            else:
+                # A partition created by a correction only exists in its change log
+                path = self.partition_path(name)
+                header = not path.exists()
+                with self.open_file(path, "a") as file:
+                    self._to_csv_frame(part).to_csv(file, header=header, index=True)
+                info = meta["partitions"][name]
+                days = part["Test_date"].dropna()
+                # Rows dated after the partition's last day keep the file sorted
+                if len(days) and not (
+                    (info["max_day"] is None or int(days.min()) >= info["max_day"]) and days.is_monotonic_increasing
+                ):
+                    info["unsorted_rows"] = info.get("unsorted_rows", 0) + len(part)
+                info["rows"] += len(part)
+                self._widen(info, part)
+            written.append(name)
+
+        return written
+
+    @classmethod
+    def _to_csv_frame(cls, df: pd.DataFrame) -> pd.DataFrame:
+        """Decode encoded rows into the plain-text layout of the CSV files."""
+        to_save = cls.decode_history(df)
+        to_save["Test_date"] = to_save["Test_date"].dt.strftime("%Y-%m-%d")
+        return to_save
+
+    def save_patient_history(self) -> bool:
+        """Save the whole patient history, rewriting every partition.
+
+        If patient_history is empty or invalid, logs a warning instead.
+        Partitions are laid out again (one per year, or per month for years
+        above PARTITION_MAX_ROWS), files are replaced atomically, change
+        logs are folded, and the store version is bumped. Files are
+        encrypted if `cipher` is set and written in plain text otherwise.
+
+        Returns:
+            True if the history was saved, False otherwise (see the log).
+        """
         if self.patient_history is None:
-            self.logger.warning("No patient history to save at %s.", path_to_history)
-            
-            return
-        
+            self.logger.warning("No patient history to save at %s.", self.save_dir)
+
+            return False
+
         try:
-            self.patient_history.to_csv(path_to_history, index=False)
-            self.logger.info("Patient history saved to %s.", path_to_history)  
+            with self._lock:
+                meta = self.read_meta()
+                previous = set(meta["partitions"])
+                meta["partitions"] = {}
+                meta["encrypted"] = self.cipher is not None
+                history = self.patient_history
+                names = self._route(history["Test_date"], self._yearly_layout(history["Test_date"]))
+                for name, rows in history.groupby(names, sort=True):
+                    self._write_partition(meta, name, rows)
+
+                self._commit(meta, touched=list(meta["partitions"]))
+
+                # Every logged change is now in the files (replaying them would be a no-op)
+                for name in previous | set(meta["partitions"]):
+                    self._partition_log_path(name).unlink(missing_ok=True)
+                for name in previous - set(meta["partitions"]):
+                    self.partition_path(name).unlink(missing_ok=True)
+                self.build_path().unlink(missing_ok=True)
+                (self.save_dir / self._LOG_FILENAME).unlink(missing_ok=True)
+            self.logger.info(
+                "Patient history saved to %s (%d partition(s), version %d).",
+                self.save_dir, len(meta["partitions"]), self._version,
+            )
         except Exception:
-            self.logger.exception("Failed to save patient history to %s.", path_to_history)
-            
+            self.logger.exception("Failed to save patient history to %s.", self.save_dir)
+
+            return False
+
+        return True
+
+    def maintenance_due(self, meta: Optional[dict[str, Any]] = None) -> bool:
+        """Return True if some partitions should be merged, dropped (empty) or have their log folded."""
+        meta = meta or self.read_meta()
+        partitions = meta["partitions"]
+
+        return bool(self._mergeable(partitions)) or any(
+            info["rows"] == 0 or info["log_bytes"] > self._MAX_LOG_BYTES for info in partitions.values()
+        )
+
+    @classmethod
+    def _mergeable(cls, partitions: dict[str, dict[str, Any]]) -> dict[str, list[str]]:
+        """Group month partitions of a same year that fit in one partition together."""
+        by_year: dict[str, list[str]] = {}
+        for name in partitions:
+            if name != cls.UNDATED_PARTITION and not name.isdigit():
+                by_year.setdefault(name[:4], []).append(name)
+
+        return {
+            year: sorted(names) for year, names in by_year.items()
+            if len(names) > 1 and sum(partitions[name]["rows"] for name in names) <= cls.PARTITION_MAX_ROWS
+        }
+
+    def maintain(self) -> None:
+        """Merge small partitions, drop empty ones and fold large change logs, on disk only.
+
+        Data is unchanged, so the store version stays the same; the rewritten
+        partitions get a new generation, which makes sessions re-read only
+        them. The in-memory history of this instance is not touched (this
+        may run in a background thread).
+        """
+        with self._lock:
+            meta = self.read_meta()
+            merges = self._mergeable(meta["partitions"])
+            merged = {name for names in merges.values() for name in names}
+            empty = [name for name, info in meta["partitions"].items() if info["rows"] == 0 and name not in merged]
+            folds = [
+                name for name, info in meta["partitions"].items()
+                if info["log_bytes"] > self._MAX_LOG_BYTES and name not in merged and name not in empty
+            ]
+            if not merges and not empty and not folds:
+                return
+
+            meta["generation"] += 1
+            for year, names in merges.items():
+                rows = self._concat([self._read_partition(name) for name in names])
+                rows = rows.sort_values(["Test_date", patient_history_id_column], kind="stable", na_position="last")
+                self._write_partition(meta, year, rows)
+                meta["partitions"][year]["generation"] = meta["generation"]
+                for name in names:
+                    del meta["partitions"][name]
+            for name in empty:
+                del meta["partitions"][name]
+            for name in folds:
+                self._write_partition(meta, name, self._read_partition(name))
+                meta["partitions"][name]["generation"] = meta["generation"]
+            self._write_meta(meta)
+
+            for name in [*merged, *empty]:
+                self.partition_path(name).unlink(missing_ok=True)
+            for name in [*merged, *empty, *folds]:
+                self._partition_log_path(name).unlink(missing_ok=True)
+
+        self.logger.info(
+            "History maintenance: merged %s, dropped %s, folded change logs of %s.", dict(merges), empty, folds
+        )
+
+    def compaction_candidates(
+        self, min_log_bytes: int = 0, min_unsorted_rows: int = 1, meta: Optional[dict[str, Any]] = None
+    ) -> list[str]:
+        """Return the partitions worth compacting, most fragmented first.
+
+        A partition qualifies when its change log holds at least
+        `min_log_bytes` bytes (and is not empty) or when at least
+        `min_unsorted_rows` rows were appended out of test date order.
+        """
+        meta = meta or self.read_meta()
+        candidates = [
+            (info["log_bytes"] + info.get("unsorted_rows", 0), name)
+            for name, info in meta["partitions"].items()
+            if (info["log_bytes"] > 0 and info["log_bytes"] >= min_log_bytes)
+            or info.get("unsorted_rows", 0) >= max(min_unsorted_rows, 1)
+        ]
+        return [name for _, name in sorted(candidates, reverse=True)]
+
+    def partition_bytes(self, name: str, meta: Optional[dict[str, Any]] = None) -> int:
+        """Return the on-disk size of a partition (CSV file plus change log)."""
+        meta = meta or self.read_meta()
+        info = meta["partitions"].get(name, {})
+        path = self.partition_path(name)
+        return (path.stat().st_size if path.exists() else 0) + info.get("log_bytes", 0)
+
+    def compact_partition(self, name: str) -> int:
+        """Rewrite one partition sorted by test date, with its change log folded in.
+
+        Deleted rows are dropped and edits applied (the log is replayed on
+        read). Data is unchanged, so only the partition's generation moves,
+        like in `maintain`; this may run in a background thread.
+
+        Returns:
+            The number of bytes read and written (0 if the partition is gone).
+        """
+        with self._lock:
+            meta = self.read_meta()
+            if name not in meta["partitions"]:
+                return 0
+
+            read_bytes = self.partition_bytes(name, meta)
+            rows = self._read_partition(name)
+            rows = rows.sort_values(["Test_date", patient_history_id_column], kind="stable", na_position="last")
+
+            meta["generation"] += 1
+            self._write_partition(meta, name, rows)
+            meta["partitions"][name]["generation"] = meta["generation"]
+            self._write_meta(meta)
+            self._partition_log_path(name).unlink(missing_ok=True)
+
+        written_bytes = self.partition_path(name).stat().st_size
+        self.logger.info("Partition %s compacted (%d row(s), %d byte(s) read).", name, len(rows), read_bytes)
+
+        return read_bytes + written_bytes
+
+    def _schedule_maintenance(self, meta: dict[str, Any]) -> None:
+        """Start `maintain` in a background thread if needed (one per data folder)."""
+        if not self.maintenance_due(meta):
+            return
+
+        with self._MAINTENANCE_MUTEX:
+            if self.save_dir in self._MAINTENANCE:
+                return
+            self._MAINTENANCE.add(self.save_dir)
+
+        def run() -> None:
+            try:
+                self.maintain()
+            except Exception:
+                self.logger.exception("History maintenance failed.")
+            finally:
+                with self._MAINTENANCE_MUTEX:
+                    self._MAINTENANCE.discard(self.save_dir)
+
+        threading.Thread(target=run, name="history-maintenance", daemon=True).start()
+
+    @classmethod
+    def encode_history(cls, df: pd.DataFrame) -> pd.DataFrame:
+        """Return `df` in the compact in-memory representation.
+
+        Vocabulary columns become categoricals whose categories start with
+        the Config_App code table (values outside it, e.g. from old files,
+        are appended after it so nothing is lost). Columns that are already
+        encoded are left as they are. `Location` and `Notes` are kept as
+        strings (or NA), even when read as numbers (e.g. postcodes).
+
+        Args:
+            df: History rows with plain values (strings, dates, timestamps).
+
+        Returns:
+            A new DataFrame with patient_history_columns, encoded.
+        """
+        encoded = df.reindex(columns=patient_history_columns)
+
+        for column, code_table in history_code_tables.items():
+            values = encoded[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                present = values.cat.categories
+            else:
+                # Blank values are missing, as they read back from the CSV files
+                values = values.where(values.isna(), values.astype(str)).replace("", np.nan)
+                present = pd.Index(values.dropna().unique())
+            extra = sorted(set(present) - set(code_table))
+            categories = [*code_table, *extra]
+            if not (isinstance(values.dtype, pd.CategoricalDtype) and list(values.cat.categories) == categories):
+                encoded[column] = pd.Categorical(values, categories=categories)
+
+        for column in ("Location", "Notes"):
+            values = encoded[column]
+            if pd.api.types.infer_dtype(values, skipna=True) not in ("string", "empty"):
+                if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+                    # Whole numbers read as floats because of missing values
+                    values = values.astype("Int64")
+                encoded[column] = values.astype(str).astype(object).where(values.notna(), np.nan)
+
+        if encoded["Test_date"].dtype != "Int32":
+            dates = cls.parse_test_dates(encoded["Test_date"])
+            unparsed = cls._unparsed(encoded["Test_date"], dates)
+            if unparsed.any():
+                logging.getLogger("STITracker").warning(
+                    "%d test date(s) could not be parsed and were left empty (row ids %s, values %s).",
+                    unparsed.sum(), encoded.index[unparsed][:5].tolist(),
+                    encoded["Test_date"][unparsed][:5].tolist(),
+                )
+            encoded["Test_date"] = ((dates - cls._EPOCH).dt.days).astype("Int32")
+
+        if encoded["Entry_ts"].dtype != "Int64":
+            stamps = cls._to_datetime(encoded["Entry_ts"], utc=True).dt.as_unit("ns")
+            encoded["Entry_ts"] = pd.Series(stamps.array.asi8, index=encoded.index, dtype="Int64").mask(stamps.isna())
+
+        return encoded
+
+    @staticmethod
+    def _to_datetime(values: pd.Series, utc: bool = False) -> pd.Series:
+        """Parse dates in one ISO 8601 pass, then one by one (format="mixed") for the values left.
+
+        Unlike a format inferred from the first value, styles can be mixed
+        within a column (e.g. "2023-05-05" next to "2024-01-02 00:00:00").
+        Values that cannot be parsed become NaT.
+        """
+        parsed = pd.to_datetime(values, errors="coerce", format="ISO8601", utc=utc)
+        retry = parsed.isna().to_numpy() & values.notna().to_numpy()
+        if retry.any():
+            parsed[retry] = pd.to_datetime(values[retry], errors="coerce", format="mixed", utc=utc)
+
+        return parsed
+
+    @classmethod
+    def parse_test_dates(cls, values: pd.Series) -> pd.Series:
+        """Parse test dates (strings, dates or timestamps) to naive midnight datetimes.
+
+        A timestamp counts for the calendar day it was written for: its UTC
+        offset is dropped, not applied. Values that cannot be parsed become
+        NaT (see `_unparsed` to flag them).
+        """
+        if pd.api.types.is_datetime64_any_dtype(values):
+            dates = values
+        else:
+            try:
+                dates = cls._to_datetime(values)
+            except ValueError:
+                # Several UTC offsets in one column: the offset does not change
+                # the day the test was written for, so parse without it
+                text = values.where(values.isna(), values.astype(str).str.strip())
+                dates = cls._to_datetime(text.str.replace(r"(?:Z|[+-]\d{2}:?\d{2})$", "", regex=True))
+
+        if dates.dt.tz is not None:
+            dates = dates.dt.tz_localize(None)
+
+        return dates.dt.normalize()
+
+    @staticmethod
+    def _unparsed(values: pd.Series, dates: pd.Series) -> np.ndarray:
+        """Flag the non-empty `values` that `parse_test_dates` turned into NaT."""
+        present = values.notna() & (values.astype(str).str.strip() != "")
+        return (present & dates.isna()).to_numpy()
+
+    @classmethod
+    def decode_history(cls, df: pd.DataFrame) -> pd.DataFrame:
+        """Return a plain (display) copy of an encoded history DataFrame.
+
+        Categoricals become strings, `Test_date` a datetime64 column and
+        `Entry_ts` a UTC timestamp column.
+        """
+        decoded = df.copy()
+
+        for column in history_code_tables:
+            decoded[column] = decoded[column].astype(object).where(decoded[column].notna(), None)
+
+        decoded["Test_date"] = pd.to_datetime(decoded["Test_date"].astype("float64"), unit="D")
+        decoded["Entry_ts"] = pd.to_datetime(
+            decoded["Entry_ts"].to_numpy(dtype="int64", na_value=np.iinfo(np.int64).min), unit="ns", utc=True
+        )
+
+        return decoded
+
+    @staticmethod
+    def _align_categories(history: pd.DataFrame, new_rows: pd.DataFrame) -> None:
+        """Give `new_rows` and `history` the same categories, in place.
+
+        Unseen values are appended to the categories, which keeps existing
+        codes unchanged.
+        """
+        for column in history_code_tables:
+            categories = history[column].cat.categories
+            extra = new_rows[column].cat.categories.difference(categories)
+            if len(extra):
+                categories = categories.append(extra)
+                history[column] = history[column].cat.set_categories(categories)
+            new_rows[column] = new_rows[column].cat.set_categories(categories)
+
+    @classmethod
+    def _concat(cls, frames: list[pd.DataFrame]) -> pd.DataFrame:
+        """Concatenate encoded frames, keeping categoricals.
+
+        The frames are not modified: one whose categories differ is aligned
+        on a new frame, so views of patient_history held by other sessions
+        stay as they were.
+        """
+        frames = [frame for frame in frames if len(frame)] or frames[:1]
+        if not frames:
+            empty = pd.DataFrame(columns=patient_history_columns, index=pd.Index([], dtype="int64", name=patient_history_id_column))
+            return cls.encode_history(empty)
+        if len(frames) == 1:
+            return frames[0]
+
+        for column in history_code_tables:
+            categories = frames[0][column].cat.categories
+            for frame in frames[1:]:
+                extra = frame[column].cat.categories.difference(categories)
+                if len(extra):
+                    categories = categories.append(extra)
+            frames = [
+                frame if frame[column].cat.categories.equals(categories)
+                else frame.assign(**{column: frame[column].cat.set_categories(categories)})
+                for frame in frames
+            ]
+
+        return pd.concat(frames)
+
+    def _concat_encoded(self, new_rows: pd.DataFrame) -> pd.DataFrame:
+        """Concatenate encoded rows to patient_history, keeping categoricals."""
+        return self._concat([self.patient_history, new_rows])
+
+    @classmethod
+    def _apply_updates(
+        cls, history: pd.DataFrame, changes: dict[int, dict[str, Any]]
+    ) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        """Apply cell changes to encoded rows (missing ids are skipped).
+
+        Only the changed rows are decoded, modified and re-encoded. `history`
+        is left unchanged: the changes go to a copy.
+
+        Returns:
+            The updated rows, and the (old, new) encoded versions of the
+            changed rows.
+        """
+        history = history.copy()
+        row_ids = history.index[history.index.isin(list(changes))]
+        old_rows = history.loc[row_ids]
+
+        updated = cls.decode_history(old_rows).astype(object)
+        for row_id in row_ids:
+            for column, value in changes[row_id].items():
+                updated.at[row_id, column] = value
+
+        new_rows = cls.encode_history(updated)
+        cls._align_categories(history, new_rows)
+        history.loc[row_ids, patient_history_columns] = new_rows[patient_history_columns]
+
+        return history, old_rows, new_rows
+
+    def filter_mask(
+        self,
+        stis: Optional[Iterable[str]] = None,
+        results: Optional[Iterable[str]] = None,
+        start_date: Optional[Any] = None,
+        end_date: Optional[Any] = None,
+        history: Optional[pd.DataFrame] = None,
+    ) -> pd.Series:
+        """Build a boolean mask over patient_history from display filters.
+
+        Works directly on the encoded columns: vocabulary filters compare
+        category codes and date filters compare integer day numbers.
+
+        Args:
+            stis: STIs to keep (None or empty keeps all).
+            results: Results to keep (None or empty keeps all).
+            start_date: First test date to keep (inclusive), or None.
+            end_date: Last test date to keep (inclusive), or None.
+            history: Encoded rows to filter (e.g. from `load_range`);
+                defaults to patient_history.
+
+        Returns:
+            A boolean Series aligned with the filtered rows' index.
+        """
+        if history is None:
+            if self.patient_history is None:
+                self.load_patient_history()
+            history = self.patient_history
+        mask = np.ones(len(history), dtype=bool)
+
+        for column, selected in (("STI", stis), ("Result", results)):
+            if selected:
+                codes = history[column].cat.categories.get_indexer(list(selected))
+                mask &= np.isin(history[column].cat.codes.to_numpy(), codes[codes >= 0])
+
+        days = history["Test_date"].to_numpy(dtype="float64", na_value=np.nan)
+        if start_date is not None:
+            mask &= days >= (pd.Timestamp(start_date).normalize() - self._EPOCH).days
+        if end_date is not None:
+            mask &= days <= (pd.Timestamp(end_date).normalize() - self._EPOCH).days
+
+        return pd.Series(mask, index=history.index)
+
+    def facets(self) -> dict[str, Any]:
+        """Return the filter options of the history: distinct values with counts, and test date bounds.
+
+        Computed with one `np.bincount` per categorical column and cached
+        per process and history version, so until the next append, edit or
+        deletion every call (and every session) gets the same values in
+        constant time. The returned dict is shared: do not modify it.
+
+        Returns:
+            {"rows": row count, "STI" / "Test_type" / "Result": {value:
+            row count} sorted by value (values without rows left out),
+            "first_test" / "last_test": datetime.date, or None without
+            dated rows}.
+        """
+        if self.patient_history is None:
+            self.load_patient_history()
+
+        cached = self._FACETS.get(self.save_dir)
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+
+        history = self.patient_history
+        facets: dict[str, Any] = {"rows": len(history)}
+        for column in self.FACET_COLUMNS:
+            categories = history[column].cat.categories
+            codes = history[column].cat.codes.to_numpy()
+            counts = np.bincount(codes[codes >= 0], minlength=len(categories))
+            facets[column] = {
+                value: int(count) for value, count in sorted(zip(categories.tolist(), counts.tolist())) if count
+            }
+
+        days = history["Test_date"].dropna()
+        facets["first_test"], facets["last_test"] = (
+            [(self._EPOCH + pd.Timedelta(days=int(day))).date() for day in (days.min(), days.max())]
+            if len(days) else [None, None]
+        )
+
+        self._FACETS[self.save_dir] = (self._version, facets)
+
+        return facets
+
     @staticmethod
     def register_to_rows(register: dict[str, Any]) -> pd.DataFrame:
         """Convert a patient test register dictionary (from Streamlit forms)
@@ -88,39 +1096,220 @@ class ScreeningLoader(UserPreferences):
         
         return pd.DataFrame(rows, columns=patient_history_columns)
     
-    def append_register(self, df: pd.DataFrame) -> None:
+    @staticmethod
+    def row_problems(df: pd.DataFrame) -> dict[int, list[str]]:
+        """Validate a batch of history rows in a single pass.
+
+        Checks that every row has a valid test date and a known STI, and
+        that its test type and result belong to that STI's vocabulary
+        (O(1) lookups in the Config_App registry).
+
+        Args:
+            df: Rows with (at least) Test_date, STI, Test_type and Result.
+
+        Returns:
+            Problems per invalid row, keyed by 0-based row position
+            (empty if the whole batch is valid).
+        """
+        rows = df.reindex(columns=patient_history_columns)
+        vocabularies = get_registry()
+        dates_ok = ScreeningLoader.parse_test_dates(rows["Test_date"]).notna().to_numpy()
+        problems = {}
+
+        for position, (date_ok, sti, test_type, result) in enumerate(
+            zip(dates_ok, rows["STI"], rows["Test_type"], rows["Result"])
+        ):
+            test_type = test_type if isinstance(test_type, str) else None
+            result = result if isinstance(result, str) else None
+            row_errors = [] if date_ok else ["missing or invalid test date"]
+            row_errors.extend(vocabularies.validate_record(sti, test_type, result))
+            if row_errors:
+                problems[position] = row_errors
+
+        return problems
+
+    @classmethod
+    def validate_rows(cls, df: pd.DataFrame) -> list[str]:
+        """Return the problems of `row_problems` as messages prefixed with the
+        (1-based) row number — empty if the whole batch is valid."""
+        return [
+            f"Row {position + 1}: {problem}"
+            for position, row_errors in cls.row_problems(df).items()
+            for problem in row_errors
+        ]
+
+    def append_register(self, df: pd.DataFrame, allow_duplicates: bool = False) -> Optional[int]:
         """Append a new test register DataFrame to the patient history.
 
-        Loads the history if not already in memory, appends new rows, and
-        saves the updated CSV file.
+        Under the store lock, reloads the history if another session changed
+        it, gives the new rows fresh row ids, and appends them to the CSV
+        files of their date partitions (existing rows are not rewritten).
+        Rows that duplicate an existing row or an earlier row of `df` (same
+        DUPLICATE_KEY_COLUMNS) are skipped, e.g. after a double submit or a
+        repeated import.
         
         Args:
             df: DataFrame to append to the current patient history.
-        """
-        if self.patient_history is None:
-            self.load_patient_history()
+            allow_duplicates: Append duplicate rows as well.
 
+        Returns:
+            The number of rows appended, or None if the files could not be written.
+        """
         if df is None or df.empty:
             self.logger.warning("append_register called with an empty DataFrame — nothing added.")
             
-            return
+            return 0
+        
+        with self._lock:
+            self.refresh()
             
-        self.patient_history = pd.concat([self.patient_history, df], ignore_index=True)   
-        self.save_patient_history()
+            new_rows = self.encode_history(df)
+            if not allow_duplicates:
+                new_rows = new_rows.loc[~self.duplicate_mask(new_rows)]
+                skipped = len(df) - len(new_rows)
+                if skipped:
+                    self.logger.warning("append_register: skipped %d duplicate row(s).", skipped)
+                if new_rows.empty:
+                    return 0
+            
+            new_rows.index = pd.RangeIndex(
+                self._next_row_id, self._next_row_id + len(new_rows), name=patient_history_id_column
+            )
+            
+            meta = self.read_meta()
+            try:
+                touched = self._append_rows(meta, new_rows)
+            except Exception:
+                self.logger.exception("Failed to append to patient history in %s.", self.save_dir)
+                
+                return None
+            
+            base_version = self._version
+            self._next_row_id += len(new_rows)
+            self.patient_history = self._concat_encoded(new_rows)   
+            self._commit(meta, touched)
+            HistorySearchIndex.record(self.save_dir, base_version, self._version, added=new_rows)
+            self._record_duplicate_keys(base_version, added=new_rows)
+        
+        self.logger.info("Patient history updated with %d new row(s).", len(new_rows))
         
-        self.logger.info("Patient history updated with %d new row(s).", len(df))
+        return len(new_rows)
     
-    def register_show(self) -> pd.DataFrame:
-        """Return a copy of the current patient history DataFrame to be shown
-        on the app.
+    @classmethod
+    def duplicate_keys(cls, rows: pd.DataFrame) -> np.ndarray:
+        """Return a 64-bit hash of DUPLICATE_KEY_COLUMNS for each encoded row.
 
-        Automatically loads the file if not already in memory, renames
-        the 'Entry_ts' (entry timestamp) column to 'Register_date' for clarity.
+        Categoricals are hashed by value, so frames whose categories are
+        ordered differently agree. Locations are compared trimmed and
+        case-insensitively, a missing one equal to an empty one (only the
+        distinct locations are normalized).
         """
+        codes, uniques = pd.factorize(rows["Location"].fillna(""))
+        location_codes, locations = pd.factorize(pd.Index(uniques, dtype=object).astype(str).str.strip().str.casefold())
+        keys = rows[[column for column in cls.DUPLICATE_KEY_COLUMNS if column != "Location"]].assign(
+            Location=pd.Categorical.from_codes(location_codes[codes], categories=pd.Index(locations, dtype=object))
+        )
+        return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+    def _duplicate_index(self) -> dict[int, int]:
+        """Return the duplicate-key index of the in-memory history (call under the lock).
+
+        Built from the history on first use or after another session
+        changed it, then kept up to date by this process's writes.
+        """
+        cached = self._DUPLICATE_INDEX.get(self.save_dir)
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+
+        keys = self.duplicate_keys(self.patient_history)
+        # Reversed, so the first row of a duplicated key is the one kept
+        index = dict(zip(keys[::-1].tolist(), self.patient_history.index[::-1].tolist()))
+        self._DUPLICATE_INDEX[self.save_dir] = (self._version, index)
+
+        return index
+
+    def _record_duplicate_keys(
+        self, base_version: int, added: Optional[pd.DataFrame] = None, removed: Optional[pd.DataFrame] = None
+    ) -> None:
+        """Move the cached duplicate-key index from `base_version` to the current version (call under the lock).
+
+        An index cached for another version is dropped (rebuilt on next use).
+        """
+        cached = self._DUPLICATE_INDEX.get(self.save_dir)
+        if cached is None or cached[0] != base_version:
+            self._DUPLICATE_INDEX.pop(self.save_dir, None)
+            return
+
+        index = cached[1]
+        if removed is not None and len(removed):
+            for key, row_id in zip(self.duplicate_keys(removed).tolist(), removed.index.tolist()):
+                if index.get(key) == row_id:
+                    del index[key]
+        if added is not None and len(added):
+            for key, row_id in zip(self.duplicate_keys(added).tolist(), added.index.tolist()):
+                index.setdefault(key, row_id)
+        self._DUPLICATE_INDEX[self.save_dir] = (self._version, index)
+
+    def duplicate_mask(self, rows: pd.DataFrame) -> np.ndarray:
+        """Flag the encoded `rows` that duplicate a stored row or an earlier row of `rows`.
+
+        One hash lookup per row against the duplicate-key index (call under
+        the lock for a result that stays valid until the next write).
+        """
+        if self.patient_history is None:
+            self.load_patient_history()
+
+        index = self._duplicate_index()
+        seen: set[int] = set()
+        duplicated = np.zeros(len(rows), dtype=bool)
+        for position, key in enumerate(self.duplicate_keys(rows).tolist()):
+            duplicated[position] = key in index or key in seen
+            seen.add(key)
+
+        return duplicated
+
+    def find_duplicates(self) -> pd.Index:
+        """Return the ids of stored rows that repeat the key of a row with a lower id."""
         if self.patient_history is None:
             self.load_patient_history()
+        else:
+            self.refresh()
+
+        history = self.patient_history.sort_index()
+        duplicated = pd.Series(self.duplicate_keys(history)).duplicated(keep="first").to_numpy()
+
+        return history.index[duplicated]
+
+    def dedupe(self) -> int:
+        """Delete the stored duplicates, keeping the first row (lowest id) of each key.
+
+        Returns:
+            The number of rows deleted.
+        """
+        with self._lock:
+            duplicates = self.find_duplicates()
+            if len(duplicates):
+                self.delete_ids(duplicates)
+
+        self.logger.info("Dedupe: %d duplicate row(s) removed.", len(duplicates))
+
+        return len(duplicates)
+
+    def register_show(self, history: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """Return a copy of the current patient history DataFrame to be shown
+        on the app.
+
+        Automatically loads the file if not already in memory, decodes the
+        compact columns, and renames the 'Entry_ts' (entry timestamp) column
+        to 'Register_date' for clarity. `history` (e.g. from `snapshot`)
+        is shown instead of patient_history when given.
+        """
+        if history is None:
+            if self.patient_history is None:
+                self.load_patient_history()
+            history = self.patient_history
             
-        df = self.patient_history.copy()
+        df = self.decode_history(history)
         df = df.rename(columns={"Entry_ts": "Register_date"})
     
         return df
@@ -128,6 +1317,9 @@ class ScreeningLoader(UserPreferences):
     def delete_rows(self, mask: pd.Series | list[bool]) -> None:
         """Delete rows from patient history using a boolean mask.
 
+        The mask is resolved to row ids against the in-memory history, then
+        the deletion is merged into the latest on-disk state (see delete_ids).
+
         Args:
             mask: Boolean mask (pd.Series or list[bool]) with same length as patient_history.
         """
@@ -139,8 +1331,201 @@ class ScreeningLoader(UserPreferences):
             
             return
         
-        mask_series = pd.Series(mask, index=self.patient_history.index)
-        self.patient_history = self.patient_history.loc[~mask_series].reset_index(drop=True)
-        self.save_patient_history()
+        mask_values = pd.Series(mask).to_numpy(dtype=bool)
+        self.delete_ids(self.patient_history.index[mask_values])
+
+    def delete_ids(self, row_ids: Iterable[int]) -> None:
+        """Delete rows from patient history by row id.
+
+        Under the store lock, reloads the history if another session changed
+        it, so rows appended elsewhere in the meantime are kept, and records
+        a deletion entry in the change log of each partition involved. Ids
+        that no longer exist are ignored.
+
+        Args:
+            row_ids: Row ids (index labels of patient_history) to delete.
+        """
+        row_ids = pd.Index(list(row_ids), dtype="int64")
+        
+        with self._lock:
+            self.refresh()
+            
+            to_delete = self.patient_history.index.isin(row_ids)
+            if not to_delete.any():
+                self.logger.warning("delete_ids: none of the %d requested row(s) exist — nothing deleted.", len(row_ids))
+                
+                return
+            
+            base_version = self._version
+            removed = self.patient_history.loc[to_delete]
+            meta = self.read_meta()
+            names = self._route(removed["Test_date"], [name for name in meta["partitions"] if name.isdigit()])
+            for name, rows in removed.groupby(names, sort=True):
+                self._append_log(meta, name, {"op": "delete", "ids": rows.index.tolist()})
+                self._partition_info(meta, name)["rows"] -= len(rows)
+            
+            self.patient_history = self.patient_history.loc[~to_delete]
+            self._commit(meta, set(names))
+            HistorySearchIndex.record(self.save_dir, base_version, self._version, removed=removed)
+            self._record_duplicate_keys(base_version, removed=removed)
+        
+        self.logger.info("Deleted %d rows from patient history.", int(to_delete.sum()))
+
+    def update_rows(self, changes: dict[int, dict[str, Any]]) -> list[str]:
+        """Correct existing records in place, by row id.
+
+        Under the store lock, reloads the history if another session changed
+        it, validates the corrected rows, and records the changes in the
+        change logs of their partitions (the CSV files are not rewritten). A
+        row whose new test date belongs to another partition is moved there.
+
+        Args:
+            changes: {row_id: {column: new value}} with columns among
+                EDITABLE_COLUMNS. Ids that no longer exist are ignored.
+
+        Returns:
+            Problems found (nothing is saved if the list is not empty).
+        """
+        bad_columns = {column for values in changes.values() for column in values} - set(self.EDITABLE_COLUMNS)
+        if bad_columns:
+            return [f"Column(s) cannot be edited: {', '.join(sorted(bad_columns))}"]
+        
+        with self._lock:
+            self.refresh()
+            
+            row_ids = pd.Index([int(row_id) for row_id in changes], dtype="int64")
+            row_ids = row_ids.intersection(self.patient_history.index)
+            changes = {int(row_id): values for row_id, values in changes.items() if int(row_id) in row_ids}
+            if not changes:
+                self.logger.warning("update_rows: none of the requested row(s) exist — nothing updated.")
+                
+                return []
+            
+            # Validate the rows as they would be after the change
+            preview = self.decode_history(self.patient_history.loc[row_ids]).astype(object)
+            for row_id, values in changes.items():
+                for column, value in values.items():
+                    preview.at[row_id, column] = value
+            problems = [
+                f"Row_id {row_ids[position]}: {problem}"
+                for position, row_problems in self.row_problems(preview).items()
+                for problem in row_problems
+            ]
+            if problems:
+                self.logger.warning("update_rows rejected: %s", problems)
+                
+                return problems
+            
+            # Store plain JSON values (dates as YYYY-MM-DD)
+            logged = {
+                str(row_id): {
+                    column: (
+                        pd.Timestamp(value).strftime("%Y-%m-%d") if column == "Test_date"
+                        else None if pd.isna(value) else str(value)
+                    )
+                    for column, value in values.items()
+                }
+                for row_id, values in changes.items()
+            }
+            
+            base_version = self._version
+            updated, old_rows, new_rows = self._apply_updates(
+                self.patient_history, {int(row_id): values for row_id, values in logged.items()}
+            )
+            
+            meta = self.read_meta()
+            old_names = pd.Series(
+                self._route(old_rows["Test_date"], [name for name in meta["partitions"] if name.isdigit()]),
+                index=old_rows.index,
+            )
+            new_names = pd.Series(self._route(new_rows["Test_date"], self._yearly_for(meta, new_rows)), index=new_rows.index)
+            touched = sorted(set(old_names) | set(new_names))
+            for name in touched:
+                stay = old_rows.index[(old_names == name) & (new_names == name)]
+                moved_out = old_rows.index[(old_names == name) & (new_names != name)]
+                moved_in = new_rows.index[(new_names == name) & (old_names != name)]
+                info = self._partition_info(meta, name)
+                if len(stay):
+                    self._append_log(meta, name, {"op": "update", "changes": {str(row_id): logged[str(row_id)] for row_id in stay}})
+                if len(moved_out):
+                    self._append_log(meta, name, {"op": "delete", "ids": moved_out.tolist()})
+                if len(moved_in):
+                    put = self._to_csv_frame(new_rows.loc[moved_in]).to_csv(index=True)
+                    self._append_log(meta, name, {"op": "put", "csv": put})
+                info["rows"] += len(moved_in) - len(moved_out)
+                self._widen(info, new_rows.loc[new_names == name])
+            
+            # Memory only takes the change once it is on disk
+            self._commit(meta, touched)
+            self.patient_history = updated
+            HistorySearchIndex.record(self.save_dir, base_version, self._version, removed=old_rows, added=new_rows)
+            self._record_duplicate_keys(base_version, removed=old_rows, added=new_rows)
+        
+        self.logger.info("Updated %d row(s) of patient history.", len(changes))
         
-        self.logger.info("Deleted %d rows from patient history.", int(mask_series.sum()))
+        return []
+
+    def search(
+        self, query: str, limit: Optional[int] = None, within: Optional[np.ndarray | pd.Index | list[int]] = None
+    ) -> list[tuple[int, float]]:
+        """Full-text search over the `Location` and `Notes` columns.
+
+        Uses the persisted inverted index (see HistorySearchIndex), building
+        it on first use or when it no longer matches the history version.
+        With a `cipher` the index holds words of the encrypted columns, so
+        it is only kept in memory.
+
+        Args:
+            query: Free text; every word must prefix-match a word of the row.
+            limit: Maximum number of results (None for all).
+            within: Only rank these row ids (e.g. the rows passing the
+                other filters), or None for all rows.
+
+        Returns:
+            (row id, score) pairs, best match first.
+        """
+        if self.patient_history is None:
+            self.load_patient_history()
+
+        persistent = self.cipher is None
+        index = HistorySearchIndex.load(self.save_dir, persistent=persistent)
+
+        if index.version != self._version or index.journal_entries >= index.MAX_JOURNAL_ENTRIES:
+            with self._lock:
+                self.refresh()
+                if index.version != self._version:
+                    index = HistorySearchIndex.load(self.save_dir, from_disk=True, persistent=persistent)
+                if index.version != self._version:
+                    self.logger.info("Search index out of date — rebuilding from %d row(s).", len(self.patient_history))
+                    index.rebuild(self.patient_history, self._version)
+                elif index.journal_entries >= index.MAX_JOURNAL_ENTRIES:
+                    index.save_snapshot()
+
+        return index.search(query, limit, within)
+
+    def compact(self) -> bool:
+        """Rewrite every partition sorted by test date (then row id).
+
+        Folds the change logs into the files and lays the partitions out
+        again. Keeps row ids unchanged, so the search index stays valid and
+        only gets a no-op journal entry for the new version.
+
+        Returns:
+            True if the history was rewritten, False if saving failed.
+        """
+        with self._lock:
+            self.refresh()
+            
+            base_version = self._version
+            self.patient_history = self.patient_history.sort_values(
+                ["Test_date", patient_history_id_column], kind="stable", na_position="last"
+            )
+            saved = self.save_patient_history()
+            if self._version != base_version:
+                HistorySearchIndex.record(self.save_dir, base_version, self._version)
+                self._record_duplicate_keys(base_version)
+        
+        if saved:
+            self.logger.info("Patient history compacted (%d row(s)).", len(self.patient_history))
+
+        return saved
@@ -0,0 +1,410 @@
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import struct
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Any, BinaryIO, ClassVar, Optional
+
+from FileLock import FileLock
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:  # Optional dependency: encrypted storage is unavailable
+    AESGCM = None
+    InvalidTag = None
+
+
+class EncryptionError(Exception):
+    """Raised when encrypted data cannot be opened (no key, wrong passphrase or altered file)."""
+
+
+@dataclass
+class StorageCipher:
+    """Chunked AES-256-GCM encryption of the data files.
+
+    An encrypted file starts with a header (MAGIC and a random file id),
+    followed by independent records: a 4-byte length, a 12-byte random
+    nonce and the ciphertext of up to CHUNK_BYTES of plain text, with the
+    file id, the record number and a final-record flag as associated data,
+    so records cannot be moved within or between files. Each write (or
+    append) ends with a record flagged final, and a file without any final
+    record (cut within its first write) fails to open. Appending encrypts
+    only the new records and reading decrypts record by record as the file
+    is streamed. Both stop at the end of the last complete write (its final
+    record): what an interrupted append left after it is skipped by reads,
+    with a warning, and dropped by the next append, like a torn line of a
+    plain change log.
+
+    The key is derived from a passphrase with scrypt. The salt, the scrypt
+    cost and a check value (to reject a wrong passphrase up front) are kept
+    in KEY_FILENAME inside the data folder, so the folder and its backups
+    stay self-contained. Derived keys are cached per process.
+
+    Attributes:
+        key: The 32-byte AES key.
+    """
+
+    MAGIC: ClassVar[bytes] = b"STIENC1\n"
+    PASSPHRASE_ENV: ClassVar[str] = "STI_TRACKER_PASSPHRASE"
+    KEY_FILENAME: ClassVar[str] = "encryption.json"
+    _KEY_LOCK_FILENAME: ClassVar[str] = "encryption.lock"
+    CHUNK_BYTES: ClassVar[int] = 64 * 1024
+    _FILE_ID_BYTES: ClassVar[int] = 16
+    _NONCE_BYTES: ClassVar[int] = 12
+    _LENGTH: ClassVar[struct.Struct] = struct.Struct(">I")
+    # Set in the length of the last record of a write (lengths stay far below it)
+    _FINAL_FLAG: ClassVar[int] = 1 << 31
+    _INDEX: ClassVar[struct.Struct] = struct.Struct(">Q")
+    # scrypt cost (about 0.1 s and 32 MB per derivation)
+    _SCRYPT_N: ClassVar[int] = 2 ** 15
+    _SCRYPT_R: ClassVar[int] = 8
+    _SCRYPT_P: ClassVar[int] = 1
+
+    # Derived keys shared by the instances of the process:
+    # {(salt, scrypt cost, passphrase digest): key}
+    _KEYS: ClassVar[dict[tuple[str, int, int, int, str], bytes]] = {}
+    _KEYS_MUTEX: ClassVar[threading.Lock] = threading.Lock()
+
+    key: bytes = field(repr=False)
+
+    _aead: Any = field(init=False, default=None, repr=False)
+
+    def __post_init__(self) -> None:
+        """Check the dependency and set up the AEAD primitive."""
+        if AESGCM is None:
+            raise EncryptionError("Encrypted storage needs the 'cryptography' package (pip install cryptography).")
+        self._aead = AESGCM(self.key)
+
+    @staticmethod
+    def available() -> bool:
+        """Return True if the optional `cryptography` dependency is installed."""
+        return AESGCM is not None
+
+    @classmethod
+    def from_environment(cls, key_dir: Path) -> Optional["StorageCipher"]:
+        """Return the cipher of `key_dir` for the passphrase in PASSPHRASE_ENV (None if unset)."""
+        passphrase = os.environ.get(cls.PASSPHRASE_ENV)
+        if not passphrase:
+            return None
+
+        return cls.from_passphrase(key_dir, passphrase)
+
+    @classmethod
+    def from_passphrase(cls, key_dir: Path, passphrase: str) -> "StorageCipher":
+        """Derive the cipher of `key_dir` from a passphrase.
+
+        The first call for a folder creates its key file with a new salt.
+
+        Raises:
+            EncryptionError: If `cryptography` is missing or the passphrase
+                does not match the key file.
+        """
+        if AESGCM is None:
+            raise EncryptionError("Encrypted storage needs the 'cryptography' package (pip install cryptography).")
+
+        key_dir = Path(key_dir)
+        key_path = key_dir / cls.KEY_FILENAME
+        params = cls._read_key_file(key_path)
+        if params is None:
+            with FileLock(key_dir / cls._KEY_LOCK_FILENAME):
+                params = cls._read_key_file(key_path) or cls._create_key_file(key_path, passphrase)
+
+        cipher = cls(cls._derive(passphrase, params))
+        check = base64.b64decode(params["check"])
+        try:
+            cipher._aead.decrypt(check[:cls._NONCE_BYTES], check[cls._NONCE_BYTES:], key_path.name.encode())
+        except InvalidTag:
+            raise EncryptionError(f"Wrong passphrase for the encrypted data in {key_dir}.") from None
+
+        return cipher
+
+    @staticmethod
+    def _read_key_file(key_path: Path) -> Optional[dict[str, Any]]:
+        """Return the key parameters saved at `key_path` (None if missing)."""
+        try:
+            with open(key_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def _create_key_file(cls, key_path: Path, passphrase: str) -> dict[str, Any]:
+        """Write a new key file (salt, scrypt cost and check value) atomically."""
+        params: dict[str, Any] = {
+            "cipher": "AES-256-GCM",
+            "kdf": "scrypt",
+            "n": cls._SCRYPT_N,
+            "r": cls._SCRYPT_R,
+            "p": cls._SCRYPT_P,
+            "salt": base64.b64encode(os.urandom(16)).decode("ascii"),
+        }
+        nonce = os.urandom(cls._NONCE_BYTES)
+        check = AESGCM(cls._derive(passphrase, params)).encrypt(nonce, cls.MAGIC, key_path.name.encode())
+        params["check"] = base64.b64encode(nonce + check).decode("ascii")
+
+        tmp_path = key_path.with_name(f"{key_path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(params, file, indent=4)
+            os.replace(tmp_path, key_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+        return params
+
+    @classmethod
+    def _derive(cls, passphrase: str, params: dict[str, Any]) -> bytes:
+        """Return the scrypt key for `params` (cached per process)."""
+        cache_key = (
+            params["salt"], int(params["n"]), int(params["r"]), int(params["p"]),
+            hashlib.sha256(passphrase.encode("utf-8")).hexdigest(),
+        )
+        key = cls._KEYS.get(cache_key)
+        if key is None:
+            n, r, p = cache_key[1:4]
+            key = hashlib.scrypt(
+                passphrase.encode("utf-8"), salt=base64.b64decode(params["salt"]),
+                n=n, r=r, p=p, maxmem=256 * n * r, dklen=32,
+            )
+            with cls._KEYS_MUTEX:
+                cls._KEYS[cache_key] = key
+
+        return key
+
+    @classmethod
+    def is_encrypted(cls, path: Path) -> bool:
+        """Return True if `path` is an encrypted file (False if missing or plain)."""
+        try:
+            with open(path, "rb") as file:
+                return file.read(len(cls.MAGIC)) == cls.MAGIC
+        except FileNotFoundError:
+            return False
+
+    def open(self, path: Path, mode: str = "r") -> IO[str]:
+        """Open an encrypted file as a text stream.
+
+        Args:
+            path: File to open.
+            mode: "r" (decrypt while reading), "w" (new file) or "a"
+                (append records to an encrypted file, creating it if
+                missing or empty).
+
+        Raises:
+            EncryptionError: When reading or appending to a file that is
+                not encrypted, or a record fails authentication.
+        """
+        if mode == "r":
+            stream: io.BufferedIOBase = io.BufferedReader(self._open_reader(path), self.CHUNK_BYTES)
+        elif mode in ("w", "a"):
+            stream = io.BufferedWriter(self._open_writer(path, append=mode == "a"), self.CHUNK_BYTES)
+        else:
+            raise ValueError(f"Unsupported mode {mode!r}.")
+
+        return io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+    def _complete_end(self, file: BinaryIO) -> tuple[int, int, int]:
+        """Walk the record lengths from the current position, without decrypting.
+
+        Returns:
+            (end, index, count): the offset after the last final record (the
+            end of the last complete write; the current position if there
+            is none), the number of records up to it, and the number of
+            complete records in the file.
+        """
+        size = os.fstat(file.fileno()).st_size
+        position = end = file.tell()
+        index = count = 0
+        while True:
+            header = file.read(self._LENGTH.size)
+            if len(header) < self._LENGTH.size:
+                break
+            length = self._LENGTH.unpack(header)[0]
+            position += self._LENGTH.size + (length & ~self._FINAL_FLAG)
+            if position > size:
+                break
+            count += 1
+            if length & self._FINAL_FLAG:
+                end, index = position, count
+            file.seek(position)
+
+        return end, index, count
+
+    def _open_reader(self, path: Path) -> "_RecordReader":
+        """Open `path` for reading its records up to the end of its last complete write.
+
+        Records an interrupted append left after the last final record are
+        skipped with a warning (the next append drops them).
+        """
+        file = open(path, "rb")
+        try:
+            if file.read(len(self.MAGIC)) != self.MAGIC:
+                raise EncryptionError(f"{path.name} is not an encrypted file.")
+            file_id = file.read(self._FILE_ID_BYTES)
+            start = file.tell()
+            end, index, count = self._complete_end(file)
+            if not index:
+                raise EncryptionError(f"{path.name}: the file has no final record (truncated file).")
+            if end < os.fstat(file.fileno()).st_size:
+                logging.getLogger("STITracker").warning(
+                    "%s: ignoring %d record(s) and %d byte(s) after the last complete write (interrupted append).",
+                    path.name, count - index, os.fstat(file.fileno()).st_size - end,
+                )
+            file.seek(start)
+        except BaseException:
+            file.close()
+            raise
+
+        return _RecordReader(self, file, path.name, file_id, end)
+
+    def _open_writer(self, path: Path, append: bool) -> "_RecordWriter":
+        """Open `path` for writing records (after its last complete one when appending)."""
+        if not append or not path.exists() or path.stat().st_size == 0:
+            file = open(path, "wb")
+            file_id = os.urandom(self._FILE_ID_BYTES)
+            file.write(self.MAGIC + file_id)
+            return _RecordWriter(self, file, file_id, 0)
+
+        file = open(path, "r+b")
+        try:
+            if file.read(len(self.MAGIC)) != self.MAGIC:
+                raise EncryptionError(f"{path.name} is not an encrypted file.")
+            file_id = file.read(self._FILE_ID_BYTES)
+
+            end, index, _ = self._complete_end(file)
+
+            # Drop what an interrupted append left after it before appending
+            file.truncate(end)
+            file.seek(end)
+        except BaseException:
+            file.close()
+            raise
+
+        return _RecordWriter(self, file, file_id, index)
+
+    def _associated_data(self, file_id: bytes, index: int, final: bool) -> bytes:
+        """Return the data authenticated with record `index` of a file."""
+        return file_id + self._INDEX.pack(index) + (b"\x01" if final else b"\x00")
+
+    def encrypt_record(self, file_id: bytes, index: int, data: bytes, final: bool = False) -> bytes:
+        """Return record `index` of a file (length and flag, nonce, ciphertext) for `data`."""
+        nonce = os.urandom(self._NONCE_BYTES)
+        body = nonce + self._aead.encrypt(nonce, data, self._associated_data(file_id, index, final))
+        return self._LENGTH.pack(len(body) | (self._FINAL_FLAG if final else 0)) + body
+
+    def decrypt_record(self, file_id: bytes, index: int, body: bytes, final: bool = False) -> bytes:
+        """Return the plain text of record `index` (nonce and ciphertext, without the length)."""
+        return self._aead.decrypt(
+            body[:self._NONCE_BYTES], body[self._NONCE_BYTES:], self._associated_data(file_id, index, final)
+        )
+
+
+class _RecordReader(io.RawIOBase):
+    """Raw stream decrypting the records of an open encrypted file."""
+
+    def __init__(self, cipher: StorageCipher, file: BinaryIO, name: str, file_id: bytes, end: int) -> None:
+        super().__init__()
+        self._cipher = cipher
+        self._file = file
+        self._name = name
+        self._file_id = file_id
+        self._end = end
+        self._index = 0
+        self._buffer = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def _next_record(self) -> bool:
+        """Decrypt the next record into the buffer (False after the last complete write).
+
+        Raises:
+            EncryptionError: If a record fails authentication or was cut
+                off while reading.
+        """
+        if self._file.tell() >= self._end:
+            return False
+
+        header = self._file.read(StorageCipher._LENGTH.size)
+        length = StorageCipher._LENGTH.unpack(header)[0] if len(header) == StorageCipher._LENGTH.size else 0
+        final = bool(length & StorageCipher._FINAL_FLAG)
+        length &= ~StorageCipher._FINAL_FLAG
+        body = self._file.read(length)
+        if len(header) < StorageCipher._LENGTH.size or len(body) < length:
+            raise EncryptionError(f"{self._name}: record {self._index} was cut off while reading (truncated file).")
+
+        try:
+            self._buffer = memoryview(self._cipher.decrypt_record(self._file_id, self._index, body, final))
+        except InvalidTag:
+            raise EncryptionError(
+                f"{self._name}: record {self._index} failed authentication (wrong key or altered file)."
+            ) from None
+        self._index += 1
+
+        return True
+
+    def readinto(self, target: Any) -> int:
+        while not len(self._buffer):
+            if not self._next_record():
+                return 0
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+
+        return size
+
+    def close(self) -> None:
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+class _RecordWriter(io.RawIOBase):
+    """Raw stream encrypting what is written into records of CHUNK_BYTES."""
+
+    def __init__(self, cipher: StorageCipher, file: BinaryIO, file_id: bytes, index: int) -> None:
+        super().__init__()
+        self._cipher = cipher
+        self._file = file
+        self._file_id = file_id
+        self._index = index
+        self._pending = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def _emit(self, data: bytes, final: bool = False) -> None:
+        self._file.write(self._cipher.encrypt_record(self._file_id, self._index, data, final))
+        self._index += 1
+
+    def write(self, data: Any) -> int:
+        self._pending += data
+        chunk_bytes = StorageCipher.CHUNK_BYTES
+        if len(self._pending) >= chunk_bytes:
+            full = len(self._pending) - len(self._pending) % chunk_bytes
+            for start in range(0, full, chunk_bytes):
+                self._emit(bytes(self._pending[start:start + chunk_bytes]))
+            del self._pending[:full]
+
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            try:
+                # Always end with a final record (empty if nothing is pending)
+                self._emit(bytes(self._pending), final=True)
+                self._pending.clear()
+            finally:
+                self._file.close()
+        super().close()
@@ -1,8 +1,16 @@
+import copy
+import hashlib
 import json
 import logging
+import logging.handlers
+import os
+import threading
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, ClassVar, List, Optional
+from typing import IO, Any, Callable, ClassVar, List, Optional
+
+from FileLock import FileLock
+from StorageCipher import EncryptionError, StorageCipher
 
 
 @dataclass
@@ -15,16 +23,27 @@ class UserPreferences:
         reminder_hour: Preferred reminder time in 'HH:MM' (24h) or None.
         profile_tags: User profile tags (e.g., 'HSH' — men who have sex with men,
             'PrEP' — pre-exposure prophylaxis users).
+        cipher: Encrypts the files written to `save_dir` (see StorageCipher).
+            Defaults to the key derived from the STI_TRACKER_PASSPHRASE
+            environment variable, or None (plain files) when it is unset.
     """
     
     _FILENAME: ClassVar[str] = "preferences.json"
+    _LOCK_FILENAME: ClassVar[str] = "preferences.lock"
+    
+    # Parsed preferences files shared by every instance of the process:
+    # {path: (stat signature, preferences dict, version, encrypted)}
+    _CACHE: ClassVar[dict[Path, tuple[tuple[int, int, int], dict[str, Any], int, bool]]] = {}
+    _CACHE_MUTEX: ClassVar[threading.Lock] = threading.Lock()
     
     # Default to a project-local folder so the app is portable without extra setup.
     save_dir: Path = Path(__file__).resolve().parent / "preference_settings"
     tracked_stis: List[str] = field(default_factory=list)
     profile_tags: List[str] = field(default_factory=list)
     reminder_hour: Optional[str] = None
+    cipher: Optional[StorageCipher] = field(default=None, repr=False)
     _loaded: bool = field(init=False, default=False, repr=False)
+    _preferences_version: int = field(init=False, default=0, repr=False)
 
     logger: Optional[logging.Logger] = field(init=False, default=None, repr=False)
     
@@ -33,11 +52,128 @@ class UserPreferences:
         self.save_dir = Path(self.save_dir)
         self.save_dir.mkdir(parents=True, exist_ok=True)
         self.configure_logging()
+        if self.cipher is None:
+            self.cipher = StorageCipher.from_environment(self.save_dir)
     
     def build_path(self) -> Path:    
         """Return the full path to a file."""  
         return self.save_dir / self._FILENAME
     
+    @property
+    def lock(self) -> FileLock:
+        """Cross-process lock of the preferences file (hold it to replace the file)."""
+        return FileLock(self.save_dir / self._LOCK_FILENAME)
+    
+    @property
+    def preferences_version(self) -> int:
+        """Number of effective saves of the preferences file (0 if never saved).
+
+        Only changes when the saved content changes, so caches derived from
+        the preferences can use it as their key.
+        """
+        return self._preferences_version
+    
+    @staticmethod
+    def _stat_signature(stat: os.stat_result) -> tuple[int, int, int]:
+        """Return the (mtime, size, inode) triple identifying a file version."""
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+    
+    @staticmethod
+    def content_hash(preferences_dict: dict[str, Any]) -> str:
+        """Return a hash of the preferences, independent of key order."""
+        content = json.dumps(preferences_dict, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+    
+    def open_file(self, path: Path, mode: str = "r") -> IO[str]:
+        """Open a data file of `save_dir` as text, encrypted when `cipher` is set.
+
+        Reads detect the format from the file header, so plain files stay
+        readable once encryption is turned on. Appends keep the format of
+        an existing file; new files are encrypted when `cipher` is set.
+
+        Args:
+            path: File to open.
+            mode: "r", "w" or "a".
+
+        Raises:
+            EncryptionError: If the file is encrypted and no cipher is set.
+        """
+        if mode == "w":
+            encrypted = self.cipher is not None
+        else:
+            encrypted = StorageCipher.is_encrypted(path) or (
+                mode == "a" and self.cipher is not None and (not path.exists() or path.stat().st_size == 0)
+            )
+
+        if not encrypted:
+            return open(path, mode, encoding="utf-8", newline="")
+        if self.cipher is None:
+            raise EncryptionError(
+                f"{path.name} is encrypted: set {StorageCipher.PASSPHRASE_ENV} to the passphrase of {self.save_dir}."
+            )
+
+        return self.cipher.open(path, mode)
+    
+    def _read_file(self, path: Path) -> Optional[tuple[dict[str, Any], int, bool]]:
+        """Return the (preferences, version, encrypted) saved at `path`, or None if missing.
+
+        The file is only parsed when its stat signature differs from the
+        cached one; otherwise a copy of the cached preferences is returned.
+
+        Raises:
+            json.JSONDecodeError: If the file is not a JSON object.
+            EncryptionError: If the file is encrypted and cannot be decrypted.
+        """
+        try:
+            signature = self._stat_signature(path.stat())
+        except FileNotFoundError:
+            return None
+        
+        cached = self._CACHE.get(path)
+        if cached is None or cached[0] != signature:
+            encrypted = StorageCipher.is_encrypted(path)
+            with self.open_file(path, "r") as file:
+                # Stat the opened file: an atomic replace between the two
+                # calls must not pair the new signature with old content.
+                signature = self._stat_signature(os.fstat(file.fileno()))
+                preferences_dict = json.load(file)
+                
+            if not isinstance(preferences_dict, dict):
+                raise json.JSONDecodeError("Preferences must be a JSON object", "", 0)
+            
+            version = int(preferences_dict.pop("version", 0) or 0)
+            cached = (signature, preferences_dict, version, encrypted)
+            with self._CACHE_MUTEX:
+                self._CACHE[path] = cached
+            self.logger.info("Preferences loaded successfully from %s", path)
+        elif cached[3] and self.cipher is None:
+            # Parsed earlier by an instance holding the key
+            raise EncryptionError(
+                f"{path.name} is encrypted: set {StorageCipher.PASSPHRASE_ENV} to the passphrase of {self.save_dir}."
+            )
+            
+        return copy.deepcopy(cached[1]), cached[2], cached[3]
+    
+    @staticmethod
+    def atomic_write(path: Path, write: Callable[[Path], None]) -> None:
+        """Write a file atomically.
+
+        `write` receives a temporary path next to `path`; once it returns,
+        the temporary file replaces `path` in a single rename, so readers in
+        other processes never see a half-written file.
+
+        Args:
+            path: Final destination of the file.
+            write: Callable that writes the full content to the given path.
+        """
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+    
     def set_preferences(self, preferences_dict: dict[str, Any]) -> None:
         """Update user preferences from a dictionary.
 
@@ -58,44 +194,91 @@ class UserPreferences:
 
         If the file does not exist or is invalid, default values are kept (No preferences; the user will
         have to configure before using the app).
+        Parsed files are cached process-wide and keyed on their stat
+        signature, so while the file is unchanged a load costs one `stat`.
+        A plain file is rewritten encrypted once a `cipher` is set.
         """ 
         
         # Paulo Rodriguez 02/11/2025
         # Avoid re-loading and re-logging on every Streamlit rerun
-        if self._loaded:
-            
-            return True
-        
+        # (instances are recreated on each rerun, so the cache is per process)
         path = self.build_path()
         try:
-            with open(path, "r", encoding="utf-8") as file:
-                
-                preferences_dict = json.load(file)
-                self.set_preferences(preferences_dict)
-                
-            self.logger.info("Preferences loaded successfully from %s", path)
-            self._loaded = True
-            return True
-                
-        except FileNotFoundError:
+            saved = self._read_file(path)
+            if saved is None:
+                if not self._loaded:
+                    self.logger.warning("Preferences file not found at %s. Using defaults.", path)
+                self._loaded = True
+                return False
             
-            self.logger.warning("Preferences file not found at %s. Using defaults.", path)
+            preferences_dict, self._preferences_version, encrypted = saved
+            self.set_preferences(preferences_dict)
             self._loaded = True
-            return False
+            if self.cipher is not None and not encrypted:
+                self.save_preferences()
+            return True
         
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, ValueError):
             
             self.logger.error("Invalid JSON file at %s. Using defaults.", path)
             self._loaded = True
             return False
             
-    def save_preferences(self) -> None:
-        """Save user preferences to a JSON file."""
+    def save_preferences(self) -> bool:
+        """Save user preferences to a JSON file.
+
+        The file is only rewritten when `to_dict()` differs from the saved
+        preferences (compared by content hash), or to switch it to or from
+        encryption to follow `cipher`. Each change of content bumps
+        `preferences_version`; the file is always replaced atomically.
+
+        Returns:
+            True if the file was written, False if nothing changed.
+
+        Raises:
+            EncryptionError: If the saved file is encrypted, `cipher` is not
+                set and this instance did not load the file with the key.
+        """
         preferences_dict = self.to_dict()
+        path = self.build_path()
         
-        with open(self.build_path(), "w", encoding="utf-8") as file:
+        with self.lock:
+            try:
+                saved = self._read_file(path)
+            except (json.JSONDecodeError, ValueError):
+                saved = None
+            except EncryptionError:
+                # Switching to plain text (cipher dropped after a load with
+                # the key): the file is unchanged since this process parsed it
+                cached = self._CACHE.get(path)
+                if not self._loaded or cached is None or cached[0] != self._stat_signature(path.stat()):
+                    raise
+                saved = copy.deepcopy(cached[1]), cached[2], cached[3]
+            
+            version = saved[1] if saved is not None else 0
+            unchanged = saved is not None and self.content_hash(saved[0]) == self.content_hash(preferences_dict)
+            encrypted = self.cipher is not None
+            if unchanged and saved[2] == encrypted:
+                self._preferences_version = version
+                self.logger.debug("Preferences unchanged — %s not rewritten.", path)
+                return False
+            
+            if not unchanged:
+                version += 1
+            
+            def write(tmp_path: Path) -> None:
+                with self.open_file(tmp_path, "w") as file:
+                    json.dump({**preferences_dict, "version": version}, file, indent=4, ensure_ascii=False)
+            
+            self.atomic_write(path, write)
+            with self._CACHE_MUTEX:
+                self._CACHE[path] = (
+                    self._stat_signature(path.stat()), copy.deepcopy(preferences_dict), version, encrypted
+                )
+            self._preferences_version = version
             
-            json.dump(preferences_dict, file, indent=4, ensure_ascii=False)
+        self.logger.info("Preferences saved to %s (version %d).", path, version)
+        return True
     
     def reset_preferences(self) -> None:
         """
@@ -156,7 +339,8 @@ class UserPreferences:
                 "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
             )
     
-            file_handler = logging.FileHandler(log_file_path, encoding="utf-8")
+            # Reopens app.log once RetentionEngine.roll_log has renamed it
+            file_handler = logging.handlers.WatchedFileHandler(log_file_path, encoding="utf-8")
             file_handler.setFormatter(fmt)
     
             stream_handler = logging.StreamHandler()
@@ -0,0 +1,187 @@
+"""Load test for the local history API (app_api.py).
+
+Without --url, seeds a temporary data folder with a synthetic history,
+starts `app_api.py` on a free local port in a subprocess, and drives it.
+Each simulated client keeps one keep-alive connection open and sends a mix
+of paginated queries and single-row appends; the report gives requests/sec
+and latency percentiles per request kind.
+
+    python api_loadtest.py --connections 32 --duration 10 --rows 100000
+    python api_loadtest.py --url http://127.0.0.1:8765
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from app_cli import synthetic_history
+from ScreeningLoader import ScreeningLoader
+
+QUERIES = [
+    "/registers?limit=50",
+    "/registers?sti=HIV&limit=50",
+    "/registers?sti=Syphilis&sti=Gonorrhea&start=2020-01-01&end=2021-12-31&limit=100",
+    "/registers?result=Detected&offset=100&limit=50",
+    "/registers?q=prep&limit=20",
+    "/registers?q=hop%20bich&sti=HIV&limit=20",
+]
+NEW_ROW = {"Test_date": "2025-01-15", "STI": "HIV", "Test_type": "Rapid antibody test",
+           "Result": "Negative / Non-reactive", "Location": "Load test", "Notes": "synthetic"}
+
+
+async def request(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str,
+    method: str, path: str, body: Optional[bytes] = None,
+) -> int:
+    """Send one keep-alive request and read the full response; return the status."""
+    body = body or b""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+
+    return status
+
+
+async def client(host: str, port: int, deadline: float, write_ratio: float, seed: int,
+                 latencies: dict[str, list[float]], errors: list[int]) -> None:
+    """One simulated client on a single persistent connection."""
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+
+    try:
+        while time.perf_counter() < deadline:
+            if rng.random() < write_ratio:
+                # A distinct location per row, so appends are not skipped as duplicates
+                new_row = {**NEW_ROW, "Location": f"Load test {seed}-{rng.random():.12f}"}
+                kind, method, path, body = "append", "POST", "/registers", json.dumps(new_row).encode("utf-8")
+            else:
+                kind, method, path, body = "query", "GET", rng.choice(QUERIES), None
+
+            started = time.perf_counter()
+            status = await request(reader, writer, host, method, path, body)
+            latencies[kind].append(time.perf_counter() - started)
+            if status >= 400:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+def summarize(latencies: dict[str, list[float]], elapsed: float, errors: list[int]) -> dict:
+    """Build the report: throughput and latency percentiles (ms)."""
+    report = {"elapsed_s": round(elapsed, 2), "errors": len(errors)}
+    total = 0
+    for kind, values in latencies.items():
+        if not values:
+            continue
+        total += len(values)
+        ms = np.array(values) * 1000
+        report[kind] = {
+            "requests": len(values),
+            "rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(float(np.percentile(ms, 50)), 2),
+            "p95_ms": round(float(np.percentile(ms, 95)), 2),
+            "p99_ms": round(float(np.percentile(ms, 99)), 2),
+            "max_ms": round(float(ms.max()), 2),
+        }
+    report["total_rps"] = round(total / elapsed, 1)
+
+    return report
+
+
+async def wait_until_up(host: str, port: int, timeout: float = 60.0) -> None:
+    """Poll /health until the server answers."""
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            await request(reader, writer, host, "GET", "/health")
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def run_load(host: str, port: int, connections: int, duration: float, write_ratio: float) -> dict:
+    """Run all clients against host:port for `duration` seconds."""
+    await wait_until_up(host, port)
+    latencies: dict[str, list[float]] = {"query": [], "append": []}
+    errors: list[int] = []
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        client(host, port, started + duration, write_ratio, seed, latencies, errors)
+        for seed in range(connections)
+    ))
+
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def free_port() -> int:
+    """Return a currently free local TCP port."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """Parse arguments, start a local server if needed, and print the report."""
+    parser = argparse.ArgumentParser(prog="api_loadtest.py", description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Target an already running API instead of starting one.")
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--write-ratio", type=float, default=0.05)
+    parser.add_argument("--rows", type=int, default=50_000, help="Synthetic history size (local server only).")
+    args = parser.parse_args(argv)
+
+    if args.url:
+        target = urlsplit(args.url)
+        report = asyncio.run(run_load(target.hostname, target.port or 80, args.connections, args.duration, args.write_ratio))
+        print(json.dumps(report, indent=2))
+        return
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        seed = ScreeningLoader(save_dir=Path(data_dir) / "patient_files")
+        seed.append_register(synthetic_history(args.rows))
+
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, str(Path(__file__).resolve().parent / "app_api.py"),
+             "--data-dir", data_dir, "--port", str(port)],
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            report = asyncio.run(run_load("127.0.0.1", port, args.connections, args.duration, args.write_ratio))
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(json.dumps({"rows": args.rows, "connections": args.connections, **report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""Local HTTP/JSON API in front of the history store.
+
+A small asyncio (stdlib only) HTTP/1.1 server with keep-alive connections.
+All store access goes through one shared ScreeningLoader on a single worker
+thread, so the in-memory history is loaded once per process and only
+reloaded when another writer bumps the store version.
+
+    python app_api.py --port 8765
+
+Endpoints:
+    GET    /health
+    GET    /registers?sti=HIV&result=...&start=YYYY-MM-DD&end=...&q=text&offset=0&limit=100
+    POST   /registers            one row object
+    POST   /registers/batch      {"rows": [row, ...]} (validated all-or-nothing)
+    DELETE /registers/<row_id>
+    DELETE /registers            {"ids": [row_id, ...]}
+
+Rows use the history columns (Test_date, STI, Test_type, Result, Location,
+Notes); responses also carry Row_id and Entry_ts.
+"""
+import argparse
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from pathlib import Path
+from typing import Any, Callable, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+from app_cli import quiet_console
+from Config_App import patient_history_columns, patient_history_id_column
+from ScreeningLoader import ScreeningLoader
+
+DEFAULT_DATA_DIR = Path(__file__).resolve().parent
+MAX_BODY_BYTES = 10 * 1024 * 1024
+MAX_PAGE_SIZE = 1000
+
+
+class ApiError(Exception):
+    """Error returned to the client as a JSON body with an HTTP status."""
+
+    def __init__(self, status: HTTPStatus, message: str, details: Optional[list[str]] = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.details = details or []
+
+
+@dataclass
+class HistoryApi:
+    """Request handlers over a shared ScreeningLoader.
+
+    Attributes:
+        screening: The shared history store.
+        cache_size: Number of query responses kept (keyed by store version and query).
+    """
+
+    screening: ScreeningLoader
+    cache_size: int = 256
+
+    _executor: ThreadPoolExecutor = field(init=False, repr=False)
+    _cache: OrderedDict = field(init=False, default_factory=OrderedDict, repr=False)
+
+    def __post_init__(self) -> None:
+        """Start the single store worker thread."""
+        # One worker: pandas frames of the shared loader are never touched concurrently
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-store")
+
+    async def run(self, function: Callable[..., Any], *args: Any) -> Any:
+        """Run a blocking store call on the store worker thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def handle(self, method: str, target: str, body: bytes) -> tuple[HTTPStatus, bytes]:
+        """Dispatch one request and return (status, JSON body)."""
+        url = urlsplit(target)
+        parts = [part for part in url.path.split("/") if part]
+
+        if method == "GET" and parts == ["health"]:
+            return HTTPStatus.OK, b'{"status":"ok"}'
+
+        if parts[:1] != ["registers"]:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"No route for {url.path}")
+
+        if method == "GET" and len(parts) == 1:
+            return HTTPStatus.OK, await self.run(self.query, parse_qs(url.query))
+        if method == "POST" and len(parts) == 1:
+            return HTTPStatus.CREATED, await self.run(self.append, [self._json(body)])
+        if method == "POST" and parts[1:] == ["batch"]:
+            rows = self._json(body).get("rows")
+            if not isinstance(rows, list):
+                raise ApiError(HTTPStatus.BAD_REQUEST, 'Expected {"rows": [...]}')
+            return HTTPStatus.CREATED, await self.run(self.append, rows)
+        if method == "DELETE" and len(parts) == 2:
+            return HTTPStatus.OK, await self.run(self.delete, [self._row_id(parts[1])])
+        if method == "DELETE" and len(parts) == 1:
+            ids = self._json(body).get("ids")
+            if not isinstance(ids, list):
+                raise ApiError(HTTPStatus.BAD_REQUEST, 'Expected {"ids": [...]}')
+            return HTTPStatus.OK, await self.run(self.delete, [self._row_id(value) for value in ids])
+
+        raise ApiError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} not allowed on {url.path}")
+
+    @staticmethod
+    def _json(body: bytes) -> dict[str, Any]:
+        """Parse a JSON object body."""
+        try:
+            payload = json.loads(body or b"{}")
+        except json.JSONDecodeError as error:
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"Invalid JSON: {error}") from None
+        if not isinstance(payload, dict):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Expected a JSON object")
+        return payload
+
+    @staticmethod
+    def _row_id(value: Any) -> int:
+        """Parse a row id."""
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"Invalid row id: {value!r}") from None
+
+    def query(self, params: dict[str, list[str]]) -> bytes:
+        """Return one page of filtered rows (runs on the store thread)."""
+        self.screening.refresh()
+
+        try:
+            offset = max(int(params.get("offset", ["0"])[0]), 0)
+            limit = min(max(int(params.get("limit", ["100"])[0]), 0), MAX_PAGE_SIZE)
+        except ValueError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "offset and limit must be integers") from None
+
+        cache_key = (self.screening.version, tuple(sorted((k, tuple(v)) for k, v in params.items())))
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            self._cache.move_to_end(cache_key)
+            return cached
+
+        try:
+            mask = self.screening.filter_mask(
+                stis=params.get("sti"),
+                results=params.get("result"),
+                start_date=params.get("start", [None])[0],
+                end_date=params.get("end", [None])[0],
+            )
+        except ValueError as error:
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"Invalid date: {error}") from None
+
+        history = self.screening.patient_history.loc[mask]
+        query_text = params.get("q", [""])[0]
+        if query_text.strip():
+            ranked_ids = pd.Index(
+                [row_id for row_id, _ in self.screening.search(query_text)], name=patient_history_id_column
+            )
+            history = history.loc[ranked_ids.intersection(history.index, sort=False)]
+        else:
+            history = history.sort_values("Test_date", ascending=False, kind="stable")
+
+        page = self.screening.decode_history(history.iloc[offset:offset + limit])
+        page["Test_date"] = page["Test_date"].dt.strftime("%Y-%m-%d")
+        rows_json = page.reset_index().to_json(orient="records", date_format="iso", force_ascii=False)
+
+        response = (
+            f'{{"version":{self.screening.version},"total":{len(history)},'
+            f'"offset":{offset},"limit":{limit},"rows":{rows_json}}}'
+        ).encode("utf-8")
+
+        self._cache[cache_key] = response
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        return response
+
+    def append(self, rows: list[dict[str, Any]]) -> bytes:
+        """Validate and append rows in one write (runs on the store thread)."""
+        if not rows or not all(isinstance(row, dict) for row in rows):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Expected one or more row objects")
+
+        new_rows = pd.DataFrame(rows).reindex(columns=patient_history_columns)
+        errors = self.screening.validate_rows(new_rows)
+        if errors:
+            raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY, "Invalid rows — nothing saved", errors)
+
+        new_rows[["Location", "Notes"]] = new_rows[["Location", "Notes"]].fillna("")
+        new_rows["Entry_ts"] = new_rows["Entry_ts"].fillna(pd.Timestamp.now(tz="UTC").normalize())
+
+        added = self.screening.append_register(new_rows)
+        if added is None:
+            raise ApiError(HTTPStatus.INTERNAL_SERVER_ERROR, "Rows could not be saved")
+        ids = self.screening.patient_history.index[len(self.screening.patient_history) - added:].tolist()
+
+        return json.dumps(
+            {"version": self.screening.version, "ids": ids, "duplicates": len(new_rows) - added}
+        ).encode("utf-8")
+
+    def delete(self, row_ids: list[int]) -> bytes:
+        """Delete rows by id (runs on the store thread)."""
+        self.screening.refresh()
+        existing = self.screening.patient_history.index.intersection(pd.Index(row_ids, dtype="int64"))
+        if len(existing):
+            self.screening.delete_ids(existing)
+
+        return json.dumps({"version": self.screening.version, "deleted": existing.tolist()}).encode("utf-8")
+
+
+@dataclass
+class HttpServer:
+    """Minimal HTTP/1.1 server (keep-alive, Content-Length bodies) for HistoryApi."""
+
+    api: HistoryApi
+    host: str = "127.0.0.1"
+    port: int = 8765
+    idle_timeout: float = 30.0
+
+    async def serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve requests on one connection until the client closes it."""
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line.strip():
+                    break
+
+                method, target, version = request_line.decode("latin-1").split(maxsplit=2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version.strip() == "HTTP/1.1"
+                status, body = await self.respond(method.upper(), target, headers, reader)
+
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body
+                )
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(
+        self, method: str, target: str, headers: dict[str, str], reader: asyncio.StreamReader
+    ) -> tuple[HTTPStatus, bytes]:
+        """Read the request body and turn the API result (or error) into a response."""
+        try:
+            if "chunked" in headers.get("transfer-encoding", "").lower():
+                raise ApiError(HTTPStatus.LENGTH_REQUIRED, "Chunked bodies are not supported")
+            length = int(headers.get("content-length", "0"))
+            if length > MAX_BODY_BYTES:
+                raise ApiError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Body too large")
+            body = await reader.readexactly(length) if length else b""
+
+            return await self.api.handle(method, target, body)
+        except ApiError as error:
+            payload = {"error": error.message}
+            if error.details:
+                payload["details"] = error.details
+            return error.status, json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        except Exception:
+            self.api.screening.logger.exception("API error on %s %s", method, target)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, b'{"error":"Internal server error"}'
+
+    async def start(self) -> asyncio.AbstractServer:
+        """Start listening and return the asyncio server."""
+        server = await asyncio.start_server(self.serve_connection, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        self.api.screening.logger.info("History API listening on http://%s:%d", self.host, self.port)
+        return server
+
+
+def build_server(data_dir: Path, host: str = "127.0.0.1", port: int = 8765) -> HttpServer:
+    """Create the API server over the history stored in `data_dir`."""
+    screening = ScreeningLoader(save_dir=Path(data_dir) / "patient_files")
+    screening.load_patient_history()
+    return HttpServer(api=HistoryApi(screening=screening), host=host, port=port)
+
+
+async def serve_forever(server: HttpServer) -> None:
+    """Run the server until cancelled."""
+    async with await server.start() as listener:
+        await listener.serve_forever()
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """Parse arguments and run the API server."""
+    parser = argparse.ArgumentParser(prog="app_api.py", description="STI Tracker local HTTP/JSON API.")
+    parser.add_argument("--data-dir", type=Path, default=DEFAULT_DATA_DIR)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    server = build_server(args.data_dir, args.host, args.port)
+    # Store activity still goes to log_files/app.log; keep the console for warnings
+    quiet_console(server.api.screening.logger, logging.WARNING)
+    print(f"Serving on http://{args.host}:{args.port} (Ctrl+C to stop)")
+
+    try:
+        asyncio.run(serve_forever(server))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
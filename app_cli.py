@@ -0,0 +1,509 @@
+"""Headless command-line entry point for scheduled and batch jobs.
+
+Works directly on ScreeningLoader and UserPreferences, without booting the
+Streamlit runtime:
+
+    python app_cli.py import results.csv
+    python app_cli.py export > history.csv
+    python app_cli.py query --sti HIV --start 2024-01-01 --search checkpoint
+    python app_cli.py compact
+    python app_cli.py dedupe --dry-run
+    python app_cli.py retention --budget-mb 64
+    python app_cli.py stats
+    python app_cli.py analytics --by test_type
+    python app_cli.py benchmark --rows 100000
+    python app_cli.py backup --target /mnt/usb/sti_backups --keep 30
+    python app_cli.py restore --target /mnt/usb/sti_backups
+    STI_TRACKER_PASSPHRASE=... python app_cli.py encrypt
+"""
+import argparse
+import json
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from BackupStore import BackupStore
+from Config_App import patient_history_columns, patient_history_id_column, sti_result_options, sti_test_types
+from HistoryAnalytics import HistoryAnalytics
+from RetentionEngine import RetentionEngine
+from ScreeningLoader import ScreeningLoader
+from StorageCipher import EncryptionError, StorageCipher
+from UserPreferences import UserPreferences
+
+DEFAULT_DATA_DIR = Path(__file__).resolve().parent
+# Rows decoded and written per chunk when streaming to stdout
+STREAM_CHUNK_ROWS = 50_000
+
+
+def build_stores(data_dir: Path, verbose: bool = False) -> tuple[ScreeningLoader, UserPreferences]:
+    """Create the history and preferences stores rooted at `data_dir`."""
+    screening = ScreeningLoader(save_dir=data_dir / "patient_files")
+    preferences = UserPreferences(save_dir=data_dir / "preference_settings")
+
+    # Logs always go to log_files/app.log; keep the console quiet unless asked
+    quiet_console(screening.logger, logging.INFO if verbose else logging.WARNING)
+
+    return screening, preferences
+
+
+def quiet_console(logger: logging.Logger, level: int) -> None:
+    """Set `level` on the console handlers of `logger`, leaving its file handlers as they are."""
+    for handler in logger.handlers:
+        # File handlers are stream handlers too
+        if isinstance(handler, logging.StreamHandler) and not isinstance(handler, logging.FileHandler):
+            handler.setLevel(level)
+
+
+def stream_rows(screening: ScreeningLoader, history: pd.DataFrame, output_format: str) -> None:
+    """Decode and write `history` to stdout chunk by chunk (csv or jsonl)."""
+    for start in range(0, max(len(history), 1), STREAM_CHUNK_ROWS):
+        chunk = screening.decode_history(history.iloc[start:start + STREAM_CHUNK_ROWS])
+        chunk["Test_date"] = chunk["Test_date"].dt.strftime("%Y-%m-%d")
+
+        if output_format == "jsonl":
+            if not chunk.empty:
+                chunk.reset_index().to_json(sys.stdout, orient="records", lines=True, date_format="iso", force_ascii=False)
+        else:
+            chunk.to_csv(sys.stdout, header=(start == 0), index=True)
+
+
+def cmd_import(args: argparse.Namespace, screening: ScreeningLoader, preferences: UserPreferences) -> int:
+    """Validate a CSV file of history rows and append it in one write."""
+    rows = pd.read_csv(args.file, dtype=screening.CSV_DTYPES)
+    missing = {"Test_date", "STI"} - set(rows.columns)
+    if missing:
+        print(f"Missing required column(s): {', '.join(sorted(missing))}", file=sys.stderr)
+        return 2
+
+    problems = screening.row_problems(rows)
+    if problems and not args.skip_invalid:
+        print("\n".join(screening.validate_rows(rows)), file=sys.stderr)
+        print(f"{len(problems)} invalid row(s) — nothing imported (use --skip-invalid to drop them).", file=sys.stderr)
+        return 1
+
+    if problems:
+        rows = rows.drop(index=rows.index[sorted(problems)])
+        print(f"Skipped {len(problems)} invalid row(s).", file=sys.stderr)
+
+    rows = rows.reindex(columns=patient_history_columns)
+    if rows["Entry_ts"].isna().all():
+        rows["Entry_ts"] = pd.Timestamp.now(tz="UTC").normalize()
+
+    added = screening.append_register(rows, allow_duplicates=args.allow_duplicates)
+    if added is None:
+        print("Rows could not be saved (see log_files/app.log).", file=sys.stderr)
+        return 1
+
+    print(f"Imported {added} row(s), skipped {len(rows) - added} duplicate(s).", file=sys.stderr)
+
+    return 0
+
+
+def cmd_export(args: argparse.Namespace, screening: ScreeningLoader, preferences: UserPreferences) -> int:
+    """Stream the whole history to stdout."""
+    screening.load_patient_history()
+    stream_rows(screening, screening.patient_history, args.format)
+
+    return 0
+
+
+def cmd_query(args: argparse.Namespace, screening: ScreeningLoader, preferences: UserPreferences) -> int:
+    """Stream the rows matching the filters (and optional text search) to stdout."""
+    if (args.start or args.end) and not args.search:
+        # Only the date partitions overlapping the range are read
+        history = screening.load_range(args.start, args.end)
+    else:
+        screening.load_patient_history()
+        history = screening.patient_history
+
+    stis = args.sti
+    if args.tracked:
+        preferences.load_preferences()
+        stis = [*(stis or []), *preferences.tracked_stis]
+
+    mask = screening.filter_mask(stis=stis, results=args.result, start_date=args.start, end_date=args.end, history=history)
+    history = history.loc[mask]
+
+    if args.search:
+        ranked = screening.search(args.search, limit=args.limit, within=history.index)
+        history = history.loc[pd.Index([row_id for row_id, _ in ranked], name=patient_history_id_column)]
+    else:
+        history = history.sort_values("Test_date", ascending=False)
+
+    if args.limit is not None:
+        history = history.iloc[:args.limit]
+
+    stream_rows(screening, history, args.format)
+
+    return 0
+
+
+def cmd_compact(args: argparse.Namespace, screening: ScreeningLoader, preferences: UserPreferences) -> int:
+    """Rewrite the history sorted by test date."""
+    started = time.perf_counter()
+    if not screening.compact():
+        print("The history could not be compacted (see log_files/app.log).", file=sys.stderr)
+        return 1
+
+    print(f"Compacted {len(screening.patient_history)} row(s) in {time.perf_counter() - started:.2f}s.", file=sys.stderr)
+
+    return 0
+
+
+def cmd_dedupe(args: argparse.Namespace, screening: ScreeningLoader, preferences: UserPreferences) -> int:
+    """Delete duplicate rows (or only stream them to stdout with --dry-run)."""
+    if args.dry_run:
+        duplicates = screening.find_duplicates()
+        stream_rows(screening, screening.patient_history.loc[duplicates], "csv")
+        print(f"{len(duplicates)} duplicate row(s) found.", file=sys.stderr)
+    else:
+        print(f"Removed {screening.dedupe()} duplicate row(s).", file=sys.stderr)
+
+    return 0
+
+
+def cmd_retention(args: argparse.Namespace, screening: ScreeningLoader, preferences: UserPreferences) -> int:
+    """Roll and prune the logs and compact fragmented partitions, then print a JSON report."""
+    budget = int(args.budget_mb * 1024 * 1024) if args.budget_mb else None
+    engine = RetentionEngine(screening, log_dir=args.data_dir / "log_files", io_budget_bytes=budget)
+
+    started = time.perf_counter()
+    report = engine.run()
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+    return 0
+
+
+def cmd_stats(args: argparse.Namespace, screening: ScreeningLoader, preferences: UserPreferences) -> int:
+    """Print a JSON summary of the history and preferences."""
+    screening.load_patient_history()
+    preferences.load_preferences()
+    history = screening.patient_history
+    meta = screening.read_meta()
+    partitions = meta["partitions"]
+    facets = screening.facets()
+
+    stats = {
+        "rows": len(history),
+        "version": screening.version,
+        "file_bytes": sum(
+            screening.partition_path(name).stat().st_size
+            for name in partitions
+            if screening.partition_path(name).exists()
+        ),
+        "partitions": {name: info["rows"] for name, info in sorted(partitions.items())},
+        "encrypted": meta["encrypted"],
+        "memory_bytes": int(history.memory_usage(deep=True).sum()),
+        "first_test": facets["first_test"].isoformat() if facets["first_test"] else None,
+        "last_test": facets["last_test"].isoformat() if facets["last_test"] else None,
+        "by_sti": facets["STI"],
+        "by_test_type": facets["Test_type"],
+        "by_result": facets["Result"],
+        "preferences": preferences.to_dict(),
+    }
+    json.dump(stats, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+
+    return 0
+
+
+def cmd_analytics(args: argparse.Namespace, screening: ScreeningLoader, preferences: UserPreferences) -> int:
+    """Print per-STI testing analytics (or one of the positivity tables) as CSV."""
+    preferences.load_preferences()
+    analytics = HistoryAnalytics(screening, preferences)
+
+    tables: dict[str, Callable[[], pd.DataFrame]] = {
+        "sti": lambda: analytics.sti_summary(today=args.today).reset_index(),
+        "test_type": analytics.positivity_by_test_type,
+        "location": analytics.positivity_by_location,
+        "month": lambda: analytics.monthly_tests().reset_index(),
+    }
+    tables[args.by]().to_csv(sys.stdout, index=False)
+
+    return 0
+
+
+def cmd_encrypt(args: argparse.Namespace, screening: ScreeningLoader, preferences: UserPreferences) -> int:
+    """Encrypt the history and preferences files with the passphrase of STI_TRACKER_PASSPHRASE."""
+    if screening.cipher is None:
+        print(f"Set {StorageCipher.PASSPHRASE_ENV} to the passphrase to encrypt with.", file=sys.stderr)
+        return 2
+
+    # Loading rewrites the plain files encrypted
+    screening.load_patient_history()
+    preferences.load_preferences()
+    print(f"History ({len(screening.patient_history)} row(s)) and preferences are encrypted.", file=sys.stderr)
+
+    return 0
+
+
+def cmd_decrypt(args: argparse.Namespace, screening: ScreeningLoader, preferences: UserPreferences) -> int:
+    """Rewrite the encrypted history and preferences files in plain text."""
+    screening.load_patient_history()
+    has_preferences = preferences.load_preferences()
+
+    screening.cipher = preferences.cipher = None
+    saved = screening.save_patient_history()
+    if has_preferences:
+        try:
+            preferences.save_preferences()
+        except OSError:
+            preferences.logger.exception("Failed to save preferences to %s.", preferences.save_dir)
+
+    # The key files are the only way back to encrypted data: keep them
+    # unless every file was actually rewritten in plain text
+    with screening.lock:
+        still_encrypted = [path.name for path in screening.encrypted_files()]
+        if screening.read_meta()["encrypted"]:
+            still_encrypted.append("history manifest")
+    if not saved:
+        still_encrypted.append("history (not saved)")
+    preferences_path = preferences.build_path()
+    if preferences_path.exists() and StorageCipher.is_encrypted(preferences_path):
+        still_encrypted.append(preferences_path.name)
+    if still_encrypted:
+        print(
+            f"Decryption failed, encryption keys kept. Still encrypted: {', '.join(still_encrypted)} "
+            "(see log_files/app.log).",
+            file=sys.stderr,
+        )
+        return 1
+
+    # Without a key file, a later `encrypt` starts over with a new passphrase
+    for folder in (screening.save_dir, preferences.save_dir):
+        (folder / StorageCipher.KEY_FILENAME).unlink(missing_ok=True)
+
+    print(
+        f"History ({len(screening.patient_history)} row(s)) and preferences are stored in plain text: "
+        f"unset {StorageCipher.PASSPHRASE_ENV} before starting the app.",
+        file=sys.stderr,
+    )
+
+    return 0
+
+
+def cmd_backup(args: argparse.Namespace, screening: ScreeningLoader, preferences: UserPreferences) -> int:
+    """Take a deduplicated snapshot of the data folders (and optionally prune old ones)."""
+    backups = BackupStore(args.target, screening, preferences)
+    manifest = backups.snapshot(label=args.label)
+    if args.keep is not None:
+        backups.prune(args.keep)
+
+    json.dump({"id": manifest["id"], **manifest["stats"]}, sys.stdout, indent=2)
+    print()
+
+    return 0
+
+
+def cmd_backups(args: argparse.Namespace, screening: ScreeningLoader, preferences: UserPreferences) -> int:
+    """List the snapshots of a backup folder (one JSON object per line)."""
+    backups = BackupStore(args.target, screening, preferences)
+    for manifest in backups.list_snapshots():
+        summary = {key: manifest[key] for key in ("id", "created", "label", "history_version")}
+        print(json.dumps({**summary, **manifest["stats"]}, ensure_ascii=False))
+
+    return 0
+
+
+def cmd_restore(args: argparse.Namespace, screening: ScreeningLoader, preferences: UserPreferences) -> int:
+    """Verify and restore a snapshot into the live folders (or into --into)."""
+    backups = BackupStore(args.target, screening, preferences)
+    try:
+        problems = backups.verify(args.snapshot)
+    except FileNotFoundError as error:
+        print(error, file=sys.stderr)
+        return 2
+
+    if problems:
+        print("\n".join(problems), file=sys.stderr)
+        print("Backup is corrupted — nothing restored.", file=sys.stderr)
+        return 1
+
+    if args.verify_only:
+        print("Backup verified.", file=sys.stderr)
+        return 0
+
+    manifest = backups.restore(args.snapshot, into=args.into)
+    print(f"Restored backup {manifest['id']} ({manifest['stats']['files']} file(s)).", file=sys.stderr)
+
+    return 0
+
+
+def synthetic_history(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """Generate `n_rows` plausible history rows from the Config_App vocabularies."""
+    rng = np.random.default_rng(seed)
+    stis = np.array(list(sti_test_types))
+    sti = stis[rng.integers(0, len(stis), n_rows)]
+    locations = np.array(["Checkpoint Paris", "CeGIDD Lyon", "Hôpital Bichat", "Lab Central", ""])
+    notes = np.array(["", "routine PrEP visit", "partner notified", "symptoms after trip", "follow up"])
+
+    return pd.DataFrame({
+        "Test_date": pd.Timestamp("2015-01-01") + pd.to_timedelta(rng.integers(0, 3650, n_rows), unit="D"),
+        "STI": sti,
+        "Test_type": [sti_test_types[s][i % len(sti_test_types[s])] for s, i in zip(sti, rng.integers(0, 6, n_rows))],
+        "Result": [sti_result_options[s][i % len(sti_result_options[s])] for s, i in zip(sti, rng.integers(0, 4, n_rows))],
+        "Location": locations[rng.integers(0, len(locations), n_rows)],
+        "Notes": notes[rng.integers(0, len(notes), n_rows)],
+        "Entry_ts": pd.Timestamp.now(tz="UTC").normalize(),
+    })
+
+
+def cmd_benchmark(args: argparse.Namespace, screening: ScreeningLoader, preferences: UserPreferences) -> int:
+    """Time the main store operations on a synthetic history in a temp folder."""
+    results: dict[str, float] = {}
+
+    def timed(name: str, operation: Callable[[], object]) -> None:
+        started = time.perf_counter()
+        operation()
+        results[name] = round((time.perf_counter() - started) * 1000, 2)
+
+    rows = synthetic_history(args.rows)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bench = ScreeningLoader(save_dir=Path(tmp_dir) / "patient_files")
+        # Plain files, whatever STI_TRACKER_PASSPHRASE says
+        bench.cipher = None
+        # Synthetic rows may repeat one another: keep them all, so every run times the same rows
+        timed("append_bulk_ms", lambda: bench.append_register(rows, allow_duplicates=True))
+        timed("append_one_ms", lambda: bench.append_register(rows.iloc[:1].assign(Location="Benchmark")))
+
+        fresh = ScreeningLoader(save_dir=bench.save_dir)
+        fresh.cipher = None
+        timed("load_ms", fresh.load_patient_history)
+        stored_rows = len(fresh.patient_history)
+        timed("filter_ms", lambda: fresh.filter_mask(stis=["HIV"], start_date="2020-01-01", end_date="2020-12-31"))
+        timed("load_range_ms", lambda: fresh.load_range("2020-01-01", "2020-12-31"))
+        timed("register_show_ms", fresh.register_show)
+        timed("search_first_ms", lambda: fresh.search("prep"))
+        timed("analytics_ms", HistoryAnalytics(fresh, preferences).sti_summary)
+        timed("analytics_cached_ms", HistoryAnalytics(fresh, preferences).sti_summary)
+        timed("search_ms", lambda: fresh.search("hop bich"))
+        timed("delete_one_ms", lambda: fresh.delete_ids([int(fresh.patient_history.index[0])]))
+        timed("compact_ms", fresh.compact)
+
+        if StorageCipher.available():
+            # The same writes and reads on an encrypted store
+            secure_dir = Path(tmp_dir) / "encrypted_files"
+            secure_dir.mkdir()
+            cipher = StorageCipher.from_passphrase(secure_dir, "benchmark")
+            secure = ScreeningLoader(save_dir=secure_dir, cipher=cipher)
+            timed("encrypted_append_bulk_ms", lambda: secure.append_register(rows, allow_duplicates=True))
+            timed("encrypted_append_one_ms", lambda: secure.append_register(rows.iloc[:1].assign(Location="Benchmark")))
+
+            secure_fresh = ScreeningLoader(save_dir=secure.save_dir, cipher=cipher)
+            timed("encrypted_load_ms", secure_fresh.load_patient_history)
+            timed("encrypted_load_range_ms", lambda: secure_fresh.load_range("2020-01-01", "2020-12-31"))
+            results["encrypted_load_overhead_pct"] = round(100 * (results["encrypted_load_ms"] / results["load_ms"] - 1), 1)
+
+    json.dump({"rows": stored_rows, **results}, sys.stdout, indent=2)
+    print()
+
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the argument parser with one sub-command per job."""
+    parser = argparse.ArgumentParser(prog="app_cli.py", description="STI Tracker headless tools.")
+    parser.add_argument("--data-dir", type=Path, default=DEFAULT_DATA_DIR,
+                        help="Folder holding patient_files/, preference_settings/ and log_files/.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Also print info logs to the console.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="Append rows from a CSV file (one validated write).")
+    import_parser.add_argument("file", type=Path)
+    import_parser.add_argument("--skip-invalid", action="store_true", help="Drop invalid rows instead of aborting.")
+    import_parser.add_argument("--allow-duplicates", action="store_true",
+                               help="Also import rows that repeat an existing test (same date, STI, type, result, location).")
+    import_parser.set_defaults(handler=cmd_import)
+
+    export_parser = commands.add_parser("export", help="Stream the whole history to stdout.")
+    export_parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    export_parser.set_defaults(handler=cmd_export)
+
+    query_parser = commands.add_parser("query", help="Stream filtered rows to stdout.")
+    query_parser.add_argument("--sti", action="append", help="Keep this STI (repeatable).")
+    query_parser.add_argument("--tracked", action="store_true", help="Keep the STIs tracked in the preferences.")
+    query_parser.add_argument("--result", action="append", help="Keep this result (repeatable).")
+    query_parser.add_argument("--start", help="First test date (YYYY-MM-DD).")
+    query_parser.add_argument("--end", help="Last test date (YYYY-MM-DD).")
+    query_parser.add_argument("--search", help="Full-text search in laboratory and notes.")
+    query_parser.add_argument("--limit", type=int)
+    query_parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    query_parser.set_defaults(handler=cmd_query)
+
+    compact_parser = commands.add_parser("compact", help="Fold the change log and rewrite the history sorted by test date.")
+    compact_parser.set_defaults(handler=cmd_compact)
+
+    dedupe_parser = commands.add_parser("dedupe", help="Remove rows that repeat an earlier test (first one kept).")
+    dedupe_parser.add_argument("--dry-run", action="store_true", help="Only print the duplicate rows.")
+    dedupe_parser.set_defaults(handler=cmd_dedupe)
+
+    retention_parser = commands.add_parser("retention", help="Apply the log retention and history compaction policy.")
+    retention_parser.add_argument("--budget-mb", type=float, help="Stop after about this much I/O (default: no limit).")
+    retention_parser.set_defaults(handler=cmd_retention)
+
+    stats_parser = commands.add_parser("stats", help="Print a JSON summary of the data.")
+    stats_parser.set_defaults(handler=cmd_stats)
+
+    analytics_parser = commands.add_parser("analytics", help="Print testing analytics as CSV.")
+    analytics_parser.add_argument("--by", choices=["sti", "test_type", "location", "month"], default="sti",
+                                  help="Per-STI summary, positivity per test type or laboratory, or tests per month.")
+    analytics_parser.add_argument("--today", help="Reference date for recency and overdue columns (YYYY-MM-DD).")
+    analytics_parser.set_defaults(handler=cmd_analytics)
+
+    backup_parser = commands.add_parser("backup", help="Snapshot the history and preferences (deduplicated).")
+    backup_parser.add_argument("--target", type=Path, required=True, help="Backup folder.")
+    backup_parser.add_argument("--label", help="Note stored with the snapshot.")
+    backup_parser.add_argument("--keep", type=int, help="Then keep only the N most recent snapshots.")
+    backup_parser.set_defaults(handler=cmd_backup)
+
+    backups_parser = commands.add_parser("backups", help="List the snapshots of a backup folder.")
+    backups_parser.add_argument("--target", type=Path, required=True, help="Backup folder.")
+    backups_parser.set_defaults(handler=cmd_backups)
+
+    restore_parser = commands.add_parser("restore", help="Verify and restore a snapshot.")
+    restore_parser.add_argument("--target", type=Path, required=True, help="Backup folder.")
+    restore_parser.add_argument("--snapshot", help="Snapshot id (default: the latest).")
+    restore_parser.add_argument("--into", type=Path, help="Restore into this folder instead of the live data.")
+    restore_parser.add_argument("--verify-only", action="store_true", help="Only check the snapshot.")
+    restore_parser.set_defaults(handler=cmd_restore)
+
+    encrypt_parser = commands.add_parser("encrypt", help=f"Encrypt the data files with ${StorageCipher.PASSPHRASE_ENV}.")
+    encrypt_parser.set_defaults(handler=cmd_encrypt)
+
+    decrypt_parser = commands.add_parser("decrypt", help="Rewrite the encrypted data files in plain text.")
+    decrypt_parser.set_defaults(handler=cmd_decrypt)
+
+    benchmark_parser = commands.add_parser("benchmark", help="Time store operations on synthetic data (plain and encrypted).")
+    benchmark_parser.add_argument("--rows", type=int, default=100_000)
+    benchmark_parser.set_defaults(handler=cmd_benchmark)
+
+    return parser
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """Parse arguments and run the selected sub-command."""
+    args = build_parser().parse_args(argv)
+
+    try:
+        screening, preferences = build_stores(args.data_dir, verbose=args.verbose)
+        return args.handler(args, screening, preferences)
+    except EncryptionError as error:
+        print(error, file=sys.stderr)
+        return 2
+    except BrokenPipeError:
+        # Output piped into e.g. `head`: stop quietly
+        sys.stderr.close()
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
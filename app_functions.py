@@ -4,16 +4,21 @@ import pandas as pd
 import streamlit as st
 
 from Config_App import (
-    common_results,
+    get_registry,
+    history_code_tables,
+    patient_history_columns,
+    patient_history_id_column,
     profile_tags_full_list,
-    sti_result_options,
-    sti_test_types,
     stis_full_list,
 )
+from HistoryAnalytics import HistoryAnalytics
 from ScreeningLoader import ScreeningLoader
 from UserPreferences import UserPreferences
 
 REGISTER_FORM_TITLE = "### Register STI form"
+BATCH_COLUMNS = ["Test_date", "STI", "Test_type", "Result", "Location", "Notes"]
+# The history page decodes and shows at most this many rows (most recent or most relevant first)
+HISTORY_DISPLAY_ROWS = 5_000
 
 
 @dataclass
@@ -40,6 +45,24 @@ class AppFunctions:
         if logger:
             logger.debug("go_step: block=%s, from=%s, to=%s", state_bloc, prev, n)
     
+    def _tracked_sti_options(self) -> list[str]:
+        """Return the tracked STIs offered by the register forms.
+
+        Unknown STIs (e.g. removed from the vocabularies) are left out. The
+        list is cached in session state, keyed on the preferences version
+        and the known STIs, so it is only rebuilt after a preferences save.
+        """
+        known_stis = get_registry().stis
+        cache_key = (self.preferences.preferences_version, known_stis)
+        cached = st.session_state.get("_tracked_sti_options")
+        
+        if cached is None or cached[0] != cache_key:
+            options = [sti for sti in self.preferences.tracked_stis if sti in known_stis]
+            cached = (cache_key, options)
+            st.session_state["_tracked_sti_options"] = cached
+        
+        return cached[1]
+    
     def test_register(self) -> None:
         """Render and manage the multi-step STI new test register."""
         AppFunctions._ensure_register_state()
@@ -85,7 +108,7 @@ class AppFunctions:
                 st.write(REGISTER_FORM_TITLE)
                 st.write("Tested STIs")
                 
-                tested_stis = [option for option in self.preferences.tracked_stis 
+                tested_stis = [option for option in self._tracked_sti_options() 
                                if st.checkbox(option, key=f"reg_step2_cb_{option}")]
                 
                 c1, c2, c3, c4, c5 = st.columns([2, 1, 0.2, 1, 2])
@@ -120,12 +143,13 @@ class AppFunctions:
                 
                 sti_realised_tests = {}
                 results = {}
+                vocabularies = get_registry()
                 
                 for sti in register["tested_stis"]:
                     
-                    test_options = sti_test_types.get(sti, ["Other / Don’t know"])
+                    test_options = vocabularies.test_types_for(sti)
                     prev_test = register["sti_realised_tests"].get(sti)
-                    test_index = test_options.index(prev_test) if prev_test in test_options else 0
+                    test_index = vocabularies.test_type_position(sti, prev_test)
                     
                     test_choices = st.selectbox(
                         label=f"{sti} – test type",
@@ -136,9 +160,9 @@ class AppFunctions:
                     
                     sti_realised_tests[sti] = test_choices
                     
-                    res_options = sti_result_options.get(sti, common_results)
+                    res_options = vocabularies.results_for(sti)
                     prev_res = register["sti_results"].get(sti)
-                    res_index = res_options.index(prev_res) if prev_res in res_options else 0   
+                    res_index = vocabularies.result_position(sti, prev_res)   
                     
                     result_options = st.selectbox(
                         label=f"{sti} – result",
@@ -224,12 +248,17 @@ class AppFunctions:
                     "Register step 4 → finish: appending %d row(s) (location=%s, notes_len=%d)",
                     len(rows), test_location, len(notes or "")
                 )
-                self.screening.append_register(rows)
+                added = self.screening.append_register(rows)
+                if added is not None and added < len(rows):
+                    st.session_state["_register_duplicates"] = len(rows) - added
                 AppFunctions.go_step(5, "register")
         
         elif st.session_state["register"]["step"] == 5:
             
             st.success("Register completed! ✅")
+            duplicates = st.session_state.pop("_register_duplicates", 0)
+            if duplicates:
+                st.info(f"{duplicates} test(s) were already registered and were not added again.")
             st.caption("Choose what you want to do next:")
             
             left, mid1, mid2, right = st.columns([2, 1, 1, 2])
@@ -288,6 +317,94 @@ class AppFunctions:
         except Exception:
             pass
         
+    def batch_register(self) -> None:
+        """Render the batch register mode.
+
+        Registers are queued in session state through a grid editor (one row
+        per tested STI) and committed together: one validation pass over the
+        whole batch and a single `append_register` write.
+        """
+        if not getattr(self.preferences, "_loaded", False):
+            self.preferences.load_preferences()
+        
+        st.write("### Batch register")
+        st.caption("Add one line per tested STI, then commit the whole batch at once.")
+        
+        flash = st.session_state.pop("_batch_flash", None)
+        if flash:
+            kind, text = flash
+            getattr(st, kind)(text)
+        
+        # The editor's deltas are dropped by Streamlit when the user leaves the
+        # page: the edited grid is kept in `batch_queue`, and becomes the
+        # editor's base frame again when the editor is (re)created
+        queue = st.session_state.setdefault("batch_queue", pd.DataFrame(columns=BATCH_COLUMNS))
+        if "batch_editor" not in st.session_state or "_batch_base" not in st.session_state:
+            # Dates come back from the editor as text: the date column needs datetimes
+            st.session_state["_batch_base"] = queue.assign(
+                Test_date=pd.to_datetime(queue["Test_date"], errors="coerce")
+            )
+        
+        edited = st.data_editor(
+            st.session_state["_batch_base"],
+            num_rows="dynamic",
+            use_container_width=True,
+            hide_index=True,
+            key="batch_editor",
+            column_config={
+                "Test_date": st.column_config.DateColumn("Test date", required=True),
+                "STI": st.column_config.SelectboxColumn(
+                    "STI", options=self._tracked_sti_options() or stis_full_list, required=True
+                ),
+                "Test_type": st.column_config.SelectboxColumn("Test type", options=list(history_code_tables["Test_type"])),
+                "Result": st.column_config.SelectboxColumn("Result", options=list(history_code_tables["Result"])),
+                "Location": st.column_config.TextColumn("Laboratory"),
+                "Notes": st.column_config.TextColumn("Observations"),
+            },
+        )
+        st.session_state["batch_queue"] = edited
+        
+        c1, c2, c3 = st.columns([2, 2, 4])
+        commit_clicked = c1.button(f"💾 Commit {len(edited)} register(s)", disabled=edited.empty, type="primary")
+        clear_clicked = c2.button("🗑️ Clear batch", disabled=edited.empty)
+        
+        if clear_clicked:
+            AppFunctions._reset_batch()
+
+            self.preferences.logger.info("Batch register cleared (%d queued row(s) dropped)", len(edited))
+            st.rerun()
+        
+        if commit_clicked:
+            errors = self.screening.validate_rows(edited)
+            
+            if errors:
+                self.preferences.logger.warning("Batch register rejected: %d problem(s)", len(errors))
+                st.error("Fix the following before committing:\n\n" + "\n".join(f"- {e}" for e in errors))
+                
+                return
+            
+            rows = edited.reindex(columns=patient_history_columns)
+            rows["Test_date"] = pd.to_datetime(rows["Test_date"]).dt.date
+            rows[["Location", "Notes"]] = rows[["Location", "Notes"]].fillna("")
+            rows["Entry_ts"] = pd.Timestamp.now(tz="UTC").normalize()
+
+            self.preferences.logger.info("Batch register: committing %d row(s) in one write", len(rows))
+            added = self.screening.append_register(rows) or 0
+            
+            AppFunctions._reset_batch()
+            message = f"{added} register(s) saved ✅"
+            if added < len(rows):
+                message += f" — {len(rows) - added} duplicate(s) of existing tests skipped"
+            st.session_state["_batch_flash"] = ("success", message)
+            st.rerun()
+    
+    @staticmethod
+    def _reset_batch() -> None:
+        """Empty the batch queue and the grid editor state."""
+        st.session_state["batch_queue"] = pd.DataFrame(columns=BATCH_COLUMNS)
+        st.session_state.pop("_batch_base", None)
+        st.session_state.pop("batch_editor", None)
+        
     def change_preferences(self) -> None:
         """
         Display and manage the user preferences form in the Streamlit interface.
@@ -341,7 +458,9 @@ class AppFunctions:
                 "reminder_hour": reminder,
                 "profile_tags": tags,
             })
-            self.preferences.save_preferences()
+            if not self.preferences.save_preferences():
+                st.session_state["_flash_message"] = ("info", "No changes to save.")
+                st.rerun()
             
             self.preferences.logger.info(
                 "Preferences saved: tracked=%s, reminder=%s, tags=%s",
@@ -359,13 +478,16 @@ class AppFunctions:
             st.rerun()
     
     def test_show(self) -> None:
-        """Display test history with filters and (optional) manage/delete mode."""
-        df = self.screening.register_show()
-        df["Test_date"] = pd.to_datetime(df["Test_date"], errors="coerce")
+        """Display test history with filters and (optional) manage mode to edit or delete rows."""
+        # The loader is shared by the sessions of the process: render from one
+        # snapshot, so masks and views stay aligned while other sessions write
+        history, version = self.screening.snapshot()
+        # Filter options come from the store's cached facets, not from the history
+        facets = self.screening.facets()
 
-        self.preferences.logger.debug("test_show: loaded %d record(s) for display", len(df))
+        self.preferences.logger.debug("test_show: %d record(s) in history", len(history))
         
-        if df.empty:           
+        if history.empty:           
             st.info("No test history yet.")
         
         else:
@@ -374,26 +496,28 @@ class AppFunctions:
                 
                 st.subheader("Filters")
             
-                sti_options = sorted(df["STI"].dropna().unique().tolist())
+                sti_counts = facets["STI"]
                 stis = st.multiselect(
                     "STIs",
-                    options=sti_options
+                    options=list(sti_counts),
+                    format_func=lambda sti: f"{sti} ({sti_counts[sti]})",
                     )
                 
-                min_ts = df["Test_date"].min()
-                max_ts = df["Test_date"].max()
-                min_date = min_ts.date() if pd.notna(min_ts) else None
-                max_date = max_ts.date() if pd.notna(max_ts) else None         
+                min_date = facets["first_test"]
+                max_date = facets["last_test"]
                 
                 if min_date and max_date:
                     period = st.date_input("Test date", value=(min_date, max_date))
                 else:
                     period = st.date_input("Test date")
                 
-                result_options = sorted(df["Result"].dropna().unique().tolist())
+                result_counts = facets["Result"]
                 result = st.multiselect(
                     "Result",
-                    options=result_options)
+                    options=list(result_counts),
+                    format_func=lambda value: f"{value} ({result_counts[value]})")
+                
+                query = st.text_input("Search", placeholder="Laboratory or notes…")
             
                 col_a, col_b = st.columns(2)
                 apply_btn = col_a.form_submit_button("Apply")
@@ -401,45 +525,72 @@ class AppFunctions:
                 
             if reset_btn:
                 st.session_state["manage_mode"] = False
-                st.session_state.pop("history_editor", None)
+                st.session_state.pop("history_filters", None)
+                AppFunctions._drop_manage_view()
 
                 self.preferences.logger.info("test_show: filters cleared, manage_mode reset")
                 st.rerun()
-                
-            df_filtered = df.copy()
             
             if apply_btn:            
-                mask = pd.Series(True, index=df_filtered.index)
-                
-                if stis:                
-                    mask &= df_filtered["STI"].isin(stis)
-                if result:
-                    mask &= df_filtered["Result"].isin(result)
-                
-                    
                 start_date = end_date = None
                 if isinstance(period, (list, tuple)) and len(period) == 2:
                     start_date, end_date = period
                 elif hasattr(period, "year"):
                     start_date = end_date = period
                 
-                if start_date:
-                    start_ts = pd.to_datetime(start_date)
-                    mask &= df_filtered["Test_date"] >= start_ts
-                if end_date:
-                    end_ts = pd.to_datetime(end_date) + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1)
-                    mask &= df_filtered["Test_date"] <= end_ts
+                # Keep the applied filters across reruns (e.g. when toggling manage mode)
+                st.session_state["history_filters"] = {
+                    "stis": tuple(stis),
+                    "result": tuple(result),
+                    "start_date": start_date,
+                    "end_date": end_date,
+                    "query": query.strip(),
+                }
+            
+            filters = st.session_state.get("history_filters")
+            selected = history
+            
+            if filters:
+                # Filters are evaluated on the encoded history (category codes, day numbers)
+                mask = self.screening.filter_mask(
+                    stis=filters["stis"], results=filters["result"],
+                    start_date=filters["start_date"], end_date=filters["end_date"], history=history,
+                )
                     
-                df_filtered = df_filtered.loc[mask]
+                selected = selected.loc[mask]
+                
+                if filters["query"]:
+                    
+                    # Search results replace the date ordering with relevance ordering; only the
+                    # best rows among the filtered ones are ranked (one more than shown, to tell
+                    # whether there are others)
+                    ranked = self.screening.search(filters["query"], limit=HISTORY_DISPLAY_ROWS + 1, within=selected.index)
+                    selected = selected.loc[pd.Index([row_id for row_id, _ in ranked], name=patient_history_id_column)]
 
-                self.preferences.logger.info(
-                    "test_show: filters applied (stis=%s, result=%s, start=%s, end=%s) → %d/%d rows",
-                    stis, result, start_date, end_date, len(df_filtered), len(df)
-                )
+                if apply_btn:
+                    self.preferences.logger.info(
+                        "test_show: filters applied (%s) → %d/%d rows", filters, len(selected), len(history)
+                    )
             
-            df_filtered = df_filtered.sort_values("Test_date", ascending=False)
+            searched = bool(filters and filters["query"])
+            matching = len(selected)
+            if searched:
+                selected = selected.iloc[:HISTORY_DISPLAY_ROWS]
+            else:
+                # Sort the encoded day numbers only, then take the rows shown
+                newest = selected["Test_date"].sort_values(ascending=False, kind="stable").index
+                selected = selected.loc[newest[:HISTORY_DISPLAY_ROWS]]
             
-            st.caption(f"Showing {len(df_filtered)} out of {len(df)} records")
+            if searched and matching > len(selected):
+                st.caption(f"Showing the {len(selected)} best matches: narrow the search to see the others.")
+            elif matching > len(selected):
+                total = "" if matching == len(history) else f" (out of {len(history)})"
+                st.caption(
+                    f"Showing the first {len(selected)} of {matching} matching records{total}: "
+                    "narrow the filters to see the others."
+                )
+            else:
+                st.caption(f"Showing {len(selected)} out of {len(history)} records")
             
             manage = st.toggle("Manage mode", value=False, key="manage_mode")
 
@@ -447,18 +598,63 @@ class AppFunctions:
             
             if manage:
                 
-                df_view = df_filtered.copy()
-                df_view['delete'] = False
+                # The editor view is built once per (data version, filters) and kept in
+                # session state; the selection and the corrections are read from the
+                # editor's deltas only
+                view, editor_key = self._manage_view(selected, filters, version)
                 
-                check_rows = st.data_editor(
-                    df_view,
-                    column_config={"delete": st.column_config.CheckboxColumn("Delete row")},
+                st.caption("Edit cells to correct a record, or tick rows to delete them.")
+                st.data_editor(
+                    view,
+                    column_config={
+                        "Test_date": st.column_config.DateColumn("Test_date", required=True),
+                        "STI": st.column_config.SelectboxColumn("STI", options=stis_full_list, required=True),
+                        "Test_type": st.column_config.SelectboxColumn("Test_type", options=list(history_code_tables["Test_type"])),
+                        "Result": st.column_config.SelectboxColumn("Result", options=list(history_code_tables["Result"])),
+                        "delete": st.column_config.CheckboxColumn("Delete row"),
+                    },
+                    disabled=[
+                        column for column in view.columns
+                        if column != "delete" and column not in self.screening.EDITABLE_COLUMNS
+                    ],
                     use_container_width=True,
                     hide_index=False,
-                    key="history_editor",                
+                    key=editor_key,                
                     )
                 
-                selected_labels = df_view.index[check_rows["delete"]].tolist()
+                edited_rows = st.session_state.get(editor_key, {}).get("edited_rows", {})
+                selected_labels = [
+                    int(view.index[int(position)])
+                    for position, changes in edited_rows.items()
+                    if changes.get("delete")
+                ]
+                corrections = {
+                    int(view.index[int(position)]): {
+                        column: value for column, value in changes.items() if column != "delete"
+                    }
+                    for position, changes in edited_rows.items()
+                    if any(column != "delete" for column in changes)
+                }
+                
+                if corrections:
+                    st.info(f"{len(corrections)} record(s) edited.")
+                    c1, c2 = st.columns(2)
+                    if c1.button("Save changes", type="primary"):
+
+                        self.preferences.logger.info(
+                            "test_show: save changes pressed → updating %d row(s)", len(corrections)
+                        )
+                        errors = self.screening.update_rows(corrections)
+                        
+                        if errors:
+                            st.error("Fix the following before saving:\n\n" + "\n".join(f"- {e}" for e in errors))
+                        else:
+                            AppFunctions._drop_manage_view()
+                            st.rerun()
+                    
+                    if c2.button("Discard changes"):
+                        AppFunctions._drop_manage_view()
+                        st.rerun()
                 
                 if selected_labels:
                     st.warning(f"You selected {len(selected_labels)} record(s) for deletion.")
@@ -469,22 +665,107 @@ class AppFunctions:
                     )
                     c1, c2 = st.columns(2)
                     if c1.button("Confirm delete", type="primary"):
-                        
-                        # Paulo Rodriguez - 30/10/2025
-                        # build boolean mask against the full DataFrame by index labels
-                        
-                        full_index = self.screening.patient_history.index
-                        mask = full_index.isin(selected_labels).tolist()
 
                         self.preferences.logger.warning(
                             "test_show: confirm delete pressed → deleting %d row(s)",
                             len(selected_labels)
                         )
                 
-                        self.screening.delete_rows(mask)
+                        self.screening.delete_ids(selected_labels)
+                        AppFunctions._drop_manage_view()
                         st.success("Records deleted successfully.")
                         st.rerun()
-                    c2.button("Cancel")
+                    
+                    if c2.button("Cancel"):
+                        AppFunctions._drop_manage_view()
+                        st.rerun()
             else:
 
-                st.dataframe(df_filtered, use_container_width=True, hide_index=True)
+                # Only the rows shown are decoded
+                st.dataframe(self.screening.register_show(selected), use_container_width=True, hide_index=True)
+
+    def analytics_show(self) -> None:
+        """Display per-STI testing analytics: frequency, intervals, adherence and positivity."""
+        st.subheader("Analytics")
+        
+        analytics = HistoryAnalytics(screening=self.screening, preferences=self.preferences)
+        summary = analytics.sti_summary()
+        
+        if summary.empty:
+            st.info("No test history yet.")
+            return
+        
+        recommended = analytics.recommended_interval(self.preferences.profile_tags)
+        st.caption(f"Recommended testing interval for your profile: every {recommended} days.")
+        
+        overdue = summary.index[summary["overdue"]].tolist()
+        if overdue:
+            st.warning("Test due for: " + ", ".join(overdue))
+        
+        display = summary.reset_index()
+        display["positivity_rate"] *= 100
+        st.dataframe(
+            display,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "test_days": st.column_config.NumberColumn("Test days"),
+                "first_test": st.column_config.DateColumn("First test"),
+                "last_test": st.column_config.DateColumn("Last test"),
+                "days_since_last": st.column_config.NumberColumn("Days since last"),
+                "tests_last_year": st.column_config.NumberColumn("Last 12 months"),
+                "mean_interval": st.column_config.NumberColumn("Mean interval (days)", format="%.0f"),
+                "median_interval": st.column_config.NumberColumn("Median interval (days)", format="%.0f"),
+                "recommended_interval": None,
+                "adherence": st.column_config.ProgressColumn("Adherence", min_value=0.0, max_value=1.0),
+                "overdue": st.column_config.CheckboxColumn("Overdue"),
+                "positivity_rate": st.column_config.NumberColumn("Positivity", format="%.1f%%"),
+            },
+        )
+        
+        st.write("#### Tests per month")
+        st.bar_chart(analytics.monthly_tests())
+        
+        rate_config = {"positivity_rate": st.column_config.NumberColumn("Positivity", format="%.1f%%")}
+        by_test_type, by_location = st.tabs(["Positivity by test type", "Positivity by laboratory"])
+        with by_test_type:
+            table = analytics.positivity_by_test_type()
+            table["positivity_rate"] *= 100
+            st.dataframe(table, use_container_width=True, hide_index=True, column_config=rate_config)
+        with by_location:
+            table = analytics.positivity_by_location()
+            table["positivity_rate"] *= 100
+            st.dataframe(table, use_container_width=True, hide_index=True, column_config=rate_config)
+
+    def _manage_view(self, selected: pd.DataFrame, filters: dict | None, version: int) -> tuple[pd.DataFrame, str]:
+        """Return the manage-mode editor frame and its widget key.
+
+        The frame holds the rows shown (`selected`, encoded), decoded and
+        reduced to the editable columns plus a `delete` column, indexed by
+        Row_id. It is built once and cached in session state for the data
+        `version` and filters, so reruns caused by ticking checkboxes
+        neither decode the rows again nor reset the editor. A new frame gets
+        a new editor key, which drops stale deltas.
+        """
+        cache_key = (version, tuple(sorted((filters or {}).items())))
+        cached = st.session_state.get("_history_view")
+        
+        if cached is None or cached["key"] != cache_key:
+            generation = cached["generation"] + 1 if cached else 0
+            cached = {
+                "key": cache_key,
+                "frame": self.screening.decode_history(selected)[list(self.screening.EDITABLE_COLUMNS)].assign(delete=False),
+                "generation": generation,
+            }
+            st.session_state["_history_view"] = cached
+        
+        return cached["frame"], f"history_editor_{cached['generation']}"
+
+    @staticmethod
+    def _drop_manage_view() -> None:
+        """Forget the cached manage-mode view and its editor deltas."""
+        cached = st.session_state.pop("_history_view", None)
+        if cached:
+            st.session_state.pop(f"history_editor_{cached['generation']}", None)
+            # Keep generations increasing so a rebuilt editor never reuses old deltas
+            st.session_state["_history_view"] = {"key": None, "frame": None, "generation": cached["generation"]}
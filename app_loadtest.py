@@ -0,0 +1,261 @@
+"""End-to-end load test of the Streamlit app (app_main.py), run headless.
+
+Seeds a temporary data folder with a synthetic history and preferences,
+then simulates concurrent sessions with Streamlit's testing API
+(`streamlit.testing.v1.AppTest`). AppTest is not thread-safe, so each
+session runs in its own process, like several app instances sharing the
+data folder. Each session runs `app_main.main` against the temp folder and
+loops through the pages of `AppUI.router`: register wizard steps 1-5,
+history with filters, manage-mode delete, analytics and a preferences
+save. The report combines the sessions: actions per second, latency
+percentiles per action and the memory growth of the session processes.
+
+    python app_loadtest.py --sessions 8 --duration 30 --rows 50000
+"""
+import argparse
+import json
+import multiprocessing
+import queue
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from streamlit.testing.v1 import AppTest
+
+from api_loadtest import summarize
+from app_cli import synthetic_history
+from Config_App import stis_full_list
+from ScreeningLoader import ScreeningLoader
+from UserPreferences import UserPreferences
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PREFERENCES = {"tracked_stis": ["HIV", "Syphilis", "Gonorrhea", "Chlamydia"], "reminder_hour": "08:00",
+               "profile_tags": ["PrEP user"]}
+# Seconds a single script run may take before AppTest gives up
+RUN_TIMEOUT = 120.0
+# Times manage_delete ticks a row again when another session's change rebuilt the editor
+EDITOR_ATTEMPTS = 10
+# Seconds a session process may take to start, or to report after the test ends
+SESSION_GRACE = 300.0
+
+
+def run_app(data_dir: str) -> None:
+    """AppTest entry point: run the app on `data_dir`."""
+    import app_main
+
+    app_main.main(data_dir)
+
+
+def memory_bytes() -> Optional[int]:
+    """Return the resident memory of this process (None if unknown)."""
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * resource.getpagesize()
+    except (OSError, AttributeError):
+        pass
+    if resource is None:
+        return None
+    # Peak resident size: kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def by_label(elements, label: str):
+    """Return the first element of `elements` with this label."""
+    for element in elements:
+        if element.label == label:
+            return element
+    raise LookupError(f"No element labelled {label!r}.")
+
+
+def go_to(at: AppTest, page: str) -> None:
+    """Select a page in the sidebar."""
+    at.sidebar.radio[0].set_value(page)
+    at.run()
+
+
+def submit(at: AppTest, label: str) -> None:
+    """Click a button, then rerun once so the page shows the step it moved to."""
+    by_label(at.button, label).click()
+    at.run()
+    at.run()
+
+
+def register_step_3(at: AppTest, rng: random.Random) -> None:
+    """Tick a random, non-empty subset of the tracked STIs and go on."""
+    checkboxes = list(at.checkbox)
+    for checkbox in rng.sample(checkboxes, rng.randint(1, min(2, len(checkboxes)))):
+        checkbox.check()
+    submit(at, "Next")
+
+
+def register_step_5(at: AppTest, rng: random.Random) -> None:
+    """Finish the register with a distinct location, so it is not skipped as a duplicate."""
+    at.text_input(key="step4_location").set_value(f"Load test {rng.random():.12f}")
+    submit(at, "Finish register")
+
+
+def history_filter(at: AppTest, rng: random.Random) -> None:
+    """Filter the history on a random tracked STI."""
+    sti_filter = by_label(at.multiselect, "STIs")
+    sti_filter.set_value([rng.choice(sti_filter.options)])
+    by_label(at.button, "Apply").click()
+    at.run()
+
+
+def manage_delete(at: AppTest, rng: random.Random) -> None:
+    """Open manage mode, tick the first row for deletion and confirm."""
+    at.toggle(key="manage_mode").set_value(True)
+    at.run()
+    # A change from another session between two runs rebuilds the editor
+    # under a new key (dropping the tick), so the key is read again after
+    # every run and the row ticked on the editor that run showed
+    for _ in range(EDITOR_ATTEMPTS):
+        generation = at.session_state["_history_view"]["generation"]
+        at.session_state[f"history_editor_{generation}"] = {
+            "edited_rows": {"0": {"delete": True}}, "added_rows": [], "deleted_rows": [],
+        }
+        at.run()
+        if any(button.label == "Confirm delete" for button in at.button):
+            break
+    # The delete itself can still meet a rebuilt editor, which shows no
+    # selection and deletes nothing
+    by_label(at.button, "Confirm delete").click()
+    at.run()
+    at.toggle(key="manage_mode").set_value(False)
+    at.run()
+
+
+def preferences_save(at: AppTest, rng: random.Random) -> None:
+    """Save a random set of tracked STIs (HIV is always kept)."""
+    go_to(at, "⚙️ Preferences")
+    tracked = ["HIV", *rng.sample([sti for sti in stis_full_list if sti != "HIV"], 3)]
+    by_label(at.multiselect, "Which STIs do you want to track?").set_value(tracked)
+    by_label(at.button, "💾 Save").click()
+    at.run()
+
+
+# One loop of a session: (action name, operation)
+SCENARIO: list[tuple[str, Callable[[AppTest, random.Random], None]]] = [
+    ("register_step_1", lambda at, rng: go_to(at, "🧪 Register Test")),
+    ("register_step_2", lambda at, rng: submit(at, "Next")),
+    ("register_step_3", register_step_3),
+    ("register_step_4", lambda at, rng: submit(at, "Next")),
+    ("register_step_5", register_step_5),
+    ("history", lambda at, rng: go_to(at, "📊 Test History")),
+    ("history_filter", history_filter),
+    ("manage_delete", manage_delete),
+    ("analytics", lambda at, rng: go_to(at, "📈 Analytics")),
+    ("preferences_save", preferences_save),
+]
+
+
+def session(data_dir: Path, duration: float, seed: int, ready, results) -> None:
+    """One simulated browser session looping through the scenario, in its own process.
+
+    Waits on the `ready` barrier so all sessions start together, then puts
+    its latencies, errors, time span and memory use on the `results` queue.
+    """
+    rng = random.Random(seed)
+    latencies: dict[str, list[float]] = {"home": [], **{name: [] for name, _ in SCENARIO}}
+    errors: list[str] = []
+    at = AppTest.from_function(run_app, args=(str(data_dir),), default_timeout=RUN_TIMEOUT)
+    memory_before = memory_bytes()
+    ready.wait(timeout=SESSION_GRACE)
+    started = time.time()
+    deadline = time.perf_counter() + duration
+
+    def act(name: str, operation: Callable[[], object]) -> bool:
+        started = time.perf_counter()
+        error = None
+        try:
+            operation()
+            if at.exception:
+                error = at.exception[0].message
+        except Exception as exc:
+            error = repr(exc)
+        latencies[name].append(time.perf_counter() - started)
+        if error:
+            errors.append(f"{name}: {error}")
+        return error is None
+
+    act("home", lambda: at.run())
+    while time.perf_counter() < deadline:
+        for name, operation in SCENARIO:
+            if not act(name, lambda: operation(at, rng)):
+                # The page flow is lost after an error: start a fresh session
+                at = AppTest.from_function(run_app, args=(str(data_dir),), default_timeout=RUN_TIMEOUT)
+                act("home", lambda: at.run())
+                break
+
+    results.put({"latencies": latencies, "errors": errors, "started": started, "finished": time.time(),
+                 "memory_before": memory_before, "memory_after": memory_bytes()})
+
+
+def run_load(data_dir: Path, sessions: int, duration: float) -> dict:
+    """Run all sessions on `data_dir` for `duration` seconds, one process each, and combine their stats."""
+    context = multiprocessing.get_context("spawn")
+    ready = context.Barrier(sessions)
+    results = context.Queue()
+    processes = [
+        context.Process(target=session, args=(data_dir, duration, seed, ready, results), daemon=True)
+        for seed in range(sessions)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        outcomes = [results.get(timeout=duration + 2 * SESSION_GRACE) for _ in processes]
+    except queue.Empty:
+        raise RuntimeError("A session process stopped without reporting (see its traceback above).") from None
+    for process in processes:
+        process.join()
+
+    latencies: dict[str, list[float]] = {"home": [], **{name: [] for name, _ in SCENARIO}}
+    errors: list[str] = []
+    for outcome in outcomes:
+        for name, values in outcome["latencies"].items():
+            latencies[name].extend(values)
+        errors.extend(outcome["errors"])
+    elapsed = max(outcome["finished"] for outcome in outcomes) - min(outcome["started"] for outcome in outcomes)
+
+    report = summarize(latencies, elapsed, [])
+    report["errors"] = len(errors)
+    report["first_errors"] = sorted(set(errors))[:5]
+
+    memory = [(outcome["memory_before"], outcome["memory_after"]) for outcome in outcomes]
+    if all(before is not None and after is not None for before, after in memory):
+        report["memory_per_session_mb"] = round(max(after for _, after in memory) / 2**20, 1)
+        report["memory_growth_mb"] = round(max(after - before for before, after in memory) / 2**20, 1)
+    return report
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """Parse arguments, seed a temp data folder, and print the report."""
+    parser = argparse.ArgumentParser(prog="app_loadtest.py", description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=4, help="Concurrent simulated sessions.")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--rows", type=int, default=20_000, help="Synthetic history size.")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = Path(tmp_dir)
+        seed = ScreeningLoader(save_dir=data_dir / "patient_files")
+        seed.append_register(synthetic_history(args.rows))
+        preferences = UserPreferences(save_dir=data_dir / "preference_settings")
+        preferences.set_preferences(PREFERENCES)
+        preferences.save_preferences()
+
+        report = run_load(data_dir, args.sessions, args.duration)
+
+    print(json.dumps({"rows": args.rows, "sessions": args.sessions, **report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
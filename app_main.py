@@ -1,13 +1,49 @@
+from pathlib import Path
+from typing import Optional
+
 import streamlit as st
 
+from app_functions import AppFunctions
 from app_ui import AppUI
+from RetentionEngine import RetentionEngine
+from ScreeningLoader import ScreeningLoader
+from StorageCipher import EncryptionError
+from UserPreferences import UserPreferences
+
+
+@st.cache_resource(show_spinner=False)
+def shared_history(save_dir: Path) -> ScreeningLoader:
+    """Return the history store of `save_dir`, shared by the sessions of the process.
 
+    The history is loaded once; each rerun calls `refresh`, which only
+    re-reads the partitions that were changed since (writes serialize on
+    the store's lock).
+    """
+    return ScreeningLoader(save_dir=save_dir)
 
-def main() -> None:
-    """Initialize the app, handle onboarding, and dispatch to the UI router."""
+
+def main(data_dir: Optional[Path] = None) -> None:
+    """Initialize the app, handle onboarding, and dispatch to the UI router.
+
+    Args:
+        data_dir: Folder holding patient_files/ and preference_settings/
+            (default: the folders next to the app files).
+    """
     st.set_page_config(page_title="STI Tracker", layout="wide")
 
-    ui = AppUI()
+    if data_dir is None:
+        preferences = UserPreferences()
+        screening = shared_history(ScreeningLoader.save_dir)
+    else:
+        data_dir = Path(data_dir)
+        preferences = UserPreferences(save_dir=data_dir / "preference_settings")
+        screening = shared_history(data_dir / "patient_files")
+    try:
+        screening.refresh()
+    except EncryptionError as error:
+        st.error(f"🔒 {error}")
+        st.stop()
+    ui = AppUI(app_functions=AppFunctions(preferences=preferences, screening=screening))
 
     prefs = ui.app_functions.preferences
     prefs.load_preferences()
@@ -17,6 +53,10 @@ def main() -> None:
         ui.set_page("preferences")
         st.session_state["_pref_first_time"] = True
 
+    # Log rolling and history compaction run in the background, at most
+    # once per interval, with a bounded amount of I/O per run
+    RetentionEngine(ui.app_functions.screening).schedule()
+
     ui.side_bar(onboarding=onboarding)
     ui.router(onboarding=onboarding)
     
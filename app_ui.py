@@ -41,7 +41,9 @@ class AppUI:
         menu = {
             "🏠 Home": "home",
             "🧪 Register Test": "register",
+            "🗂️ Batch Register": "batch",
             "📊 Test History": "history",
+            "📈 Analytics": "analytics",
             "⚙️ Preferences": "preferences",
         }
 
@@ -104,8 +106,12 @@ class AppUI:
         elif page == "register":
             self.app_functions._ensure_register_state()
             self.app_functions.test_register()
+        elif page == "batch":
+            self.app_functions.batch_register()
         elif page == "history":
             self.app_functions.test_show()
+        elif page == "analytics":
+            self.app_functions.analytics_show()
         elif page == "preferences":
             self.app_functions.change_preferences()
         else:
@@ -0,0 +1,37 @@
+"""Shared fixtures of the test suite.
+
+The app modules live at the repository root: put it on sys.path so the
+tests (and the worker processes they spawn) can import them.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app_cli import synthetic_history
+from ScreeningLoader import ScreeningLoader
+from StorageCipher import StorageCipher
+
+
+@pytest.fixture(autouse=True)
+def plain_storage(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Run every test with plain files, whatever the environment says."""
+    monkeypatch.delenv(StorageCipher.PASSPHRASE_ENV, raising=False)
+
+
+@pytest.fixture
+def history_dir(tmp_path: Path) -> Path:
+    """Return an empty history folder."""
+    return tmp_path / "patient_files"
+
+
+@pytest.fixture
+def seeded(history_dir: Path) -> ScreeningLoader:
+    """Return a store holding 200 synthetic rows (2015-2024)."""
+    screening = ScreeningLoader(save_dir=history_dir)
+    screening.append_register(synthetic_history(200), allow_duplicates=True)
+    return screening
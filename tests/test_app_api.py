@@ -0,0 +1,110 @@
+"""Tests of the local HTTP/JSON API (app_api), over real connections."""
+import asyncio
+import json
+from pathlib import Path
+from typing import Any, Optional
+
+import pytest
+
+from app_api import HttpServer, build_server
+from app_cli import synthetic_history
+from ScreeningLoader import ScreeningLoader
+
+ROW = {"Test_date": "2024-05-01", "STI": "HIV", "Test_type": "Ag/Ab 4th generation (ELISA)",
+       "Result": "Negative / Non-reactive", "Location": "API lab", "Notes": "first visit"}
+
+
+async def call(server: HttpServer, method: str, path: str, payload: Optional[Any] = None,
+               raw: Optional[bytes] = None) -> tuple[int, dict]:
+    """Send one request on a new connection and return (status, JSON body)."""
+    reader, writer = await asyncio.open_connection(server.host, server.port)
+    body = raw if raw is not None else (json.dumps(payload).encode("utf-8") if payload is not None else b"")
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: test\r\nContent-Length: {len(body)}\r\n"
+        f"Connection: close\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    head, _, content = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(content)
+
+
+def serve(data_dir: Path, scenario) -> None:
+    """Run `scenario(server)` against an API server listening on a free port."""
+    async def main() -> None:
+        server = build_server(data_dir, port=0)
+        async with await server.start():
+            await scenario(server)
+
+    asyncio.run(main())
+
+
+@pytest.fixture
+def data_dir(tmp_path: Path) -> Path:
+    """Return a data folder holding 50 synthetic rows (row ids 0 to 49)."""
+    screening = ScreeningLoader(save_dir=tmp_path / "patient_files")
+    screening.append_register(synthetic_history(50).assign(Location="Seed lab"), allow_duplicates=True)
+    return tmp_path
+
+
+def test_register_endpoints(data_dir: Path) -> None:
+    """Rows are appended (one or a validated batch), queried and deleted, and every change is stored."""
+    async def scenario(server: HttpServer) -> None:
+        assert await call(server, "GET", "/health") == (200, {"status": "ok"})
+
+        status, created = await call(server, "POST", "/registers", ROW)
+        assert status == 201 and created["ids"] == [50] and created["duplicates"] == 0
+
+        # The same test again is skipped as a duplicate
+        status, created = await call(server, "POST", "/registers", ROW)
+        assert status == 201 and created["ids"] == [] and created["duplicates"] == 1
+
+        # One invalid row rejects the whole batch
+        batch = [{**ROW, "Location": "Batch lab"}, {**ROW, "Result": "Not a result", "Location": "Batch lab"}]
+        status, error = await call(server, "POST", "/registers/batch", {"rows": batch})
+        assert status == 422 and len(error["details"]) == 1
+        batch[1] = {**ROW, "Test_date": "2024-05-02", "Location": "Batch lab"}
+        status, created = await call(server, "POST", "/registers/batch", {"rows": batch})
+        assert status == 201 and created["ids"] == [51, 52]
+
+        status, page = await call(server, "GET", "/registers?q=batch+lab")
+        assert status == 200 and page["total"] == 2
+        assert sorted(row["Row_id"] for row in page["rows"]) == [51, 52]
+        assert {row["Test_date"] for row in page["rows"]} == {"2024-05-01", "2024-05-02"}
+
+        status, page = await call(server, "GET", "/registers?start=2024-05-01&end=2024-05-01&sti=HIV")
+        assert status == 200
+        assert sorted(row["Row_id"] for row in page["rows"] if row["Location"] != "Seed lab") == [50, 51]
+
+        status, deleted = await call(server, "DELETE", "/registers/50")
+        assert status == 200 and deleted["deleted"] == [50]
+        status, deleted = await call(server, "DELETE", "/registers", {"ids": [51, 52, 999]})
+        assert status == 200 and deleted["deleted"] == [51, 52]
+
+        status, page = await call(server, "GET", "/registers?limit=10&offset=45")
+        assert status == 200 and page["total"] == 50 and len(page["rows"]) == 5
+
+    serve(data_dir, scenario)
+
+    stored = ScreeningLoader(save_dir=data_dir / "patient_files")
+    stored.load_patient_history()
+    assert sorted(stored.patient_history.index) == list(range(50))
+
+
+def test_request_errors(data_dir: Path) -> None:
+    """Bad requests get a JSON error with the right status and change nothing."""
+    async def scenario(server: HttpServer) -> None:
+        assert (await call(server, "GET", "/nowhere"))[0] == 404
+        assert (await call(server, "PUT", "/registers"))[0] == 405
+        assert (await call(server, "POST", "/registers", raw=b"{not json"))[0] == 400
+        assert (await call(server, "POST", "/registers/batch", {"rows": "nope"}))[0] == 400
+        assert (await call(server, "DELETE", "/registers/abc"))[0] == 400
+        assert (await call(server, "GET", "/registers?start=not-a-date"))[0] == 400
+        assert (await call(server, "GET", "/registers?limit=many"))[0] == 400
+
+        status, page = await call(server, "GET", "/registers")
+        assert status == 200 and page["total"] == 50
+
+    serve(data_dir, scenario)
@@ -0,0 +1,38 @@
+"""Tests of the headless command-line entry point (app_cli)."""
+import json
+import logging
+from pathlib import Path
+
+import pytest
+
+import app_cli
+from app_cli import build_stores, synthetic_history
+from ScreeningLoader import ScreeningLoader
+
+
+def test_quiet_console_keeps_info_in_the_log_file(tmp_path: Path) -> None:
+    """Without --verbose only the console is quieted: INFO entries still reach app.log."""
+    screening, _ = build_stores(tmp_path)
+    logger = screening.logger
+    [file_handler] = [handler for handler in logger.handlers if isinstance(handler, logging.FileHandler)]
+    # pytest's capture handlers are stream handlers too
+    [console] = [handler for handler in logger.handlers if type(handler) is logging.StreamHandler]
+
+    logger.info("quiet console marker")
+    file_handler.flush()
+
+    assert logger.isEnabledFor(logging.INFO)
+    assert console.level == logging.WARNING
+    assert "quiet console marker" in Path(file_handler.baseFilename).read_text(encoding="utf-8")
+
+
+def test_benchmark_reports_the_rows_it_stored(tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    """Synthetic rows that repeat one another are all written, and `rows` counts what was stored."""
+    rows = synthetic_history(3000)
+    assert rows.duplicated(subset=list(ScreeningLoader.DUPLICATE_KEY_COLUMNS)).any()
+
+    assert app_cli.main(["--data-dir", str(tmp_path), "benchmark", "--rows", "3000"]) == 0
+
+    report = json.loads(capsys.readouterr().out)
+    # The bulk append plus the one-row append
+    assert report["rows"] == 3001
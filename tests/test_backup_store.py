@@ -0,0 +1,119 @@
+"""Tests of the deduplicated backups (BackupStore)."""
+import threading
+import zlib
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from app_cli import synthetic_history
+from BackupStore import BackupStore
+from FileLock import FileLock
+from ScreeningLoader import ScreeningLoader
+from UserPreferences import UserPreferences
+
+
+@pytest.fixture
+def backups(tmp_path: Path) -> BackupStore:
+    """Return a backup store over a history of 5000 rows and saved preferences."""
+    screening = ScreeningLoader(save_dir=tmp_path / "data" / "patient_files")
+    screening.append_register(synthetic_history(5000), allow_duplicates=True)
+    preferences = UserPreferences(save_dir=tmp_path / "data" / "preference_settings")
+    preferences.set_preferences({"tracked_stis": ["HIV"], "reminder_hour": "08:00", "profile_tags": []})
+    preferences.save_preferences()
+    return BackupStore(tmp_path / "backups", screening, preferences)
+
+
+def _stored_history(save_dir: Path) -> pd.DataFrame:
+    """Load the history of `save_dir`, decoded and sorted by row id."""
+    screening = ScreeningLoader(save_dir=save_dir)
+    screening.load_patient_history()
+    return screening.decode_history(screening.patient_history).sort_index()
+
+
+def test_restore_round_trip(backups: BackupStore) -> None:
+    """Restoring a snapshot brings back the history and preferences it holds, and running stores reload."""
+    screening, preferences = backups.screening, backups.preferences
+    before = _stored_history(screening.save_dir)
+    manifest = backups.snapshot("before the changes")
+    assert backups.verify(manifest["id"]) == []
+
+    screening.delete_ids(screening.patient_history.index[:100])
+    assert screening.update_rows({int(screening.patient_history.index[0]): {"Notes": "changed"}}) == []
+    preferences.set_preferences({"tracked_stis": ["Syphilis"]})
+    preferences.save_preferences()
+    version = screening.version
+
+    backups.restore(manifest["id"])
+
+    pd.testing.assert_frame_equal(_stored_history(screening.save_dir), before)
+    assert screening.refresh() and screening.version > version
+    reloaded = UserPreferences(save_dir=preferences.save_dir)
+    assert reloaded.load_preferences() and reloaded.tracked_stis == ["HIV"]
+    assert not list(screening.save_dir.parent.rglob("*.tmp"))
+
+
+def test_restore_into_another_folder(backups: BackupStore, tmp_path: Path) -> None:
+    """With `into`, the snapshot is rebuilt elsewhere and the live data is left alone."""
+    manifest = backups.snapshot()
+    backups.restore(manifest["id"], into=tmp_path / "copy")
+
+    pd.testing.assert_frame_equal(
+        _stored_history(tmp_path / "copy" / "patient_files"), _stored_history(backups.screening.save_dir)
+    )
+
+
+def test_unchanged_chunks_are_shared(backups: BackupStore) -> None:
+    """A snapshot after a small append only stores the chunks that changed."""
+    first = backups.snapshot()
+    backups.screening.append_register(synthetic_history(10, seed=1).assign(Location="Latest"))
+    second = backups.snapshot()
+
+    assert first["stats"]["new_chunks"] == first["stats"]["chunks"] > 2
+    assert second["stats"]["new_chunks"] < second["stats"]["chunks"] / 2
+    assert second["stats"]["stored_bytes"] < first["stats"]["stored_bytes"] / 2
+
+    # Pruning the first snapshot keeps every chunk the second one uses
+    backups.prune(keep=1)
+    assert backups.verify(second["id"]) == []
+
+
+def test_corrupted_snapshot_replaces_nothing(backups: BackupStore) -> None:
+    """A snapshot with a damaged chunk is reported and leaves the live files as they are."""
+    manifest = backups.snapshot()
+    backups.screening.append_register(synthetic_history(10, seed=1).assign(Location="Kept"))
+    before = _stored_history(backups.screening.save_dir)
+
+    largest = max(manifest["files"].values(), key=lambda entry: entry["size"])
+    digest = largest["chunks"][-1]
+    backups._chunk_path(digest).write_bytes(zlib.compress(b"tampered"))
+
+    assert backups.verify(manifest["id"])
+    with pytest.raises(ValueError):
+        backups.restore(manifest["id"])
+
+    pd.testing.assert_frame_equal(_stored_history(backups.screening.save_dir), before)
+    assert not list(backups.screening.save_dir.glob("*.tmp"))
+
+
+@pytest.mark.parametrize("held", ["backup", "preferences"])
+def test_restore_waits_for_the_locks(backups: BackupStore, held: str) -> None:
+    """A restore waits while a prune holds the backup lock, or a save holds the preferences lock."""
+    manifest = backups.snapshot()
+    backups.preferences.set_preferences({"tracked_stis": ["Syphilis"]})
+    backups.preferences.save_preferences()
+    path = backups.preferences.build_path()
+    changed = path.read_bytes()
+
+    lock_path = (backups.target_dir / BackupStore.LOCK_FILENAME if held == "backup"
+                 else backups.preferences.lock.path)
+    restore = threading.Thread(target=backups.restore, args=(manifest["id"],))
+    with FileLock(lock_path):
+        restore.start()
+        restore.join(timeout=1.0)
+        assert restore.is_alive()
+        assert path.read_bytes() == changed
+
+    restore.join(timeout=60)
+    assert not restore.is_alive()
+    assert path.read_bytes() != changed
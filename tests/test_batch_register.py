@@ -0,0 +1,88 @@
+"""Tests of the batch register page, run headless with Streamlit's AppTest."""
+import sys
+from pathlib import Path
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+from ScreeningLoader import ScreeningLoader
+from UserPreferences import UserPreferences
+
+BATCH_PAGE = "🗂️ Batch Register"
+
+
+def run_app(data_dir: str) -> None:
+    """AppTest entry point: run the app on `data_dir`."""
+    import app_main
+
+    app_main.main(data_dir)
+
+
+@pytest.fixture
+def app(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> AppTest:
+    """Return the app on a configured, empty data folder, showing the batch page."""
+    # AppTest runs the page as `__main__`: put the real one back afterwards, or
+    # processes spawned by later tests would try to run the page script
+    monkeypatch.setitem(sys.modules, "__main__", sys.modules["__main__"])
+    preferences = UserPreferences(save_dir=tmp_path / "preference_settings")
+    preferences.set_preferences({"tracked_stis": ["HIV", "Syphilis"], "reminder_hour": "08:00", "profile_tags": []})
+    preferences.save_preferences()
+
+    at = AppTest.from_function(run_app, args=(str(tmp_path),), default_timeout=60).run()
+    at.sidebar.radio[0].set_value(BATCH_PAGE).run()
+    assert not at.exception
+    return at
+
+
+def queue_rows(at: AppTest, rows: list[dict]) -> None:
+    """Add rows to the batch grid, as the editor would after the user typed them."""
+    at.session_state["batch_editor"] = {"edited_rows": {}, "added_rows": rows, "deleted_rows": []}
+    at.run()
+
+
+def button(at: AppTest, prefix: str):
+    """Return the button whose label starts with `prefix`."""
+    return next(button for button in at.button if button.label.startswith(prefix))
+
+
+ROWS = [
+    {"Test_date": "2024-05-01", "STI": "HIV", "Test_type": "Ag/Ab 4th generation (ELISA)",
+     "Result": "Negative / Non-reactive", "Location": "Batch lab", "Notes": ""},
+    {"Test_date": "2024-05-02", "STI": "HIV", "Test_type": "Ag/Ab 4th generation (ELISA)",
+     "Result": "Negative / Non-reactive", "Location": "Batch lab", "Notes": "second"},
+]
+
+
+def test_queue_survives_navigation(app: AppTest, tmp_path: Path) -> None:
+    """Queued registers are kept when the user visits another page, then committed in one write."""
+    queue_rows(app, ROWS)
+    assert button(app, "💾 Commit").label == "💾 Commit 2 register(s)"
+
+    app.sidebar.radio[0].set_value("📊 Test History").run()
+    app.sidebar.radio[0].set_value(BATCH_PAGE).run()
+
+    assert not app.exception
+    assert len(app.session_state["batch_queue"]) == 2
+    assert button(app, "💾 Commit").label == "💾 Commit 2 register(s)"
+
+    button(app, "💾 Commit").click().run()
+    assert not app.exception
+
+    history = ScreeningLoader(save_dir=tmp_path / "patient_files")
+    history.load_patient_history()
+    shown = history.decode_history(history.patient_history)
+    assert sorted(shown["Notes"].fillna("")) == ["", "second"]
+    assert app.session_state["batch_queue"].empty
+
+
+def test_invalid_batch_is_rejected(app: AppTest, tmp_path: Path) -> None:
+    """A batch with an invalid row is not written, and its rows stay queued."""
+    queue_rows(app, [ROWS[0], {**ROWS[1], "Result": "Not a result"}])
+
+    button(app, "💾 Commit").click().run()
+
+    assert app.error
+    assert len(app.session_state["batch_queue"]) == 2
+    history = ScreeningLoader(save_dir=tmp_path / "patient_files")
+    history.load_patient_history()
+    assert history.patient_history.empty
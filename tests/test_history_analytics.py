@@ -0,0 +1,89 @@
+"""Tests of the testing analytics (HistoryAnalytics) on a small, hand-checked history."""
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from HistoryAnalytics import HistoryAnalytics
+from ScreeningLoader import ScreeningLoader
+from UserPreferences import UserPreferences
+
+ELISA, RAPID = "Ag/Ab 4th generation (ELISA)", "Rapid antibody test"
+ROWS = [
+    # Two HIV tests on the same day are one testing event
+    ("2024-01-01", "HIV", ELISA, "Negative / Non-reactive", "Lab A"),
+    ("2024-01-01", "HIV", RAPID, "Positive / Reactive", "Lab A"),
+    ("2024-04-01", "HIV", ELISA, "Negative / Non-reactive", "Lab B"),
+    ("2024-10-01", "HIV", ELISA, "", "Lab B"),
+    ("2023-06-01", "Syphilis", "VDRL (Venereal Disease Research Laboratory)", "Reactive", "Lab A"),
+    ("2024-06-01", "Syphilis", "RPR (Rapid Plasma Reagin)", "Non-reactive", ""),
+]
+TODAY = "2025-01-01"
+
+
+@pytest.fixture
+def analytics(tmp_path: Path) -> HistoryAnalytics:
+    """Return analytics over ROWS, for a profile with a 180-day recommended interval."""
+    screening = ScreeningLoader(save_dir=tmp_path / "patient_files")
+    rows = pd.DataFrame(ROWS, columns=["Test_date", "STI", "Test_type", "Result", "Location"])
+    screening.append_register(rows.assign(Test_date=pd.to_datetime(rows["Test_date"]), Notes=""))
+    preferences = UserPreferences(save_dir=tmp_path / "preference_settings")
+    preferences.set_preferences({"profile_tags": ["MSM (Men who have sex with men)"]})
+    return HistoryAnalytics(screening, preferences)
+
+
+def test_sti_summary(analytics: HistoryAnalytics) -> None:
+    """Counts, intervals, adherence, overdue flags and positivity per STI."""
+    summary = analytics.sti_summary(today=TODAY)
+
+    assert summary.index.tolist() == ["HIV", "Syphilis"]
+    hiv, syphilis = summary.loc["HIV"], summary.loc["Syphilis"]
+
+    assert (hiv["tests"], hiv["test_days"], hiv["tests_last_year"]) == (4, 3, 2)
+    assert hiv["first_test"] == pd.Timestamp("2024-01-01") and hiv["last_test"] == pd.Timestamp("2024-10-01")
+    assert hiv["days_since_last"] == 92
+    # Intervals of 91 and 183 days
+    assert hiv["mean_interval"] == hiv["median_interval"] == 137
+    assert hiv["recommended_interval"] == 180
+    assert hiv["adherence"] == 0.5 and not hiv["overdue"]
+    # The row without a result is not part of the rate
+    assert hiv["positives"] == 1 and hiv["positivity_rate"] == pytest.approx(1 / 3)
+
+    assert (syphilis["tests"], syphilis["test_days"], syphilis["tests_last_year"]) == (2, 2, 1)
+    assert syphilis["mean_interval"] == 366 and syphilis["adherence"] == 0
+    assert syphilis["days_since_last"] == 214 and syphilis["overdue"]
+    assert syphilis["positivity_rate"] == 0.5
+
+
+def test_positivity_tables_and_monthly_events(analytics: HistoryAnalytics) -> None:
+    """Positivity per test type and location, and testing events per month."""
+    by_type = analytics.positivity_by_test_type().set_index(["STI", "Test_type"])
+    assert by_type.loc[("HIV", ELISA), ["tests", "positives", "positivity_rate"]].tolist() == [3, 0, 0.0]
+    assert by_type.loc[("HIV", RAPID), ["tests", "positives", "positivity_rate"]].tolist() == [1, 1, 1.0]
+
+    by_location = analytics.positivity_by_location().set_index(["STI", "Location"])
+    assert by_location.loc[("HIV", "Lab A"), "positivity_rate"] == 0.5
+    # One of the two Lab B tests has a result
+    assert by_location.loc[("HIV", "Lab B"), ["tests", "positives", "positivity_rate"]].tolist() == [2, 0, 0.0]
+    assert by_location.loc[("Syphilis", "Not specified"), "tests"] == 1
+
+    monthly = analytics.monthly_tests()
+    assert monthly.columns.tolist() == ["HIV", "Syphilis"]
+    assert monthly.index[0] == pd.Timestamp("2023-06-01") and monthly.index[-1] == pd.Timestamp("2024-10-01")
+    assert monthly.loc["2024-01-01", "HIV"] == 1
+    assert monthly.sum().tolist() == [3, 2]
+
+
+def test_prepared_arrays_follow_the_history_version(analytics: HistoryAnalytics) -> None:
+    """The prepared arrays are shared until the history changes."""
+    prepared = analytics.prepared()
+    assert HistoryAnalytics(analytics.screening, analytics.preferences).prepared() is prepared
+
+    analytics.screening.append_register(pd.DataFrame({
+        "Test_date": [pd.Timestamp("2024-12-01")], "STI": ["HIV"], "Test_type": [ELISA],
+        "Result": ["Positive / Reactive"], "Location": ["Lab C"], "Notes": [""],
+    }))
+
+    assert analytics.prepared() is not prepared
+    hiv = analytics.sti_summary(today=TODAY).loc["HIV"]
+    assert (hiv["tests"], hiv["positives"], hiv["days_since_last"]) == (5, 2, 31)
@@ -0,0 +1,98 @@
+"""Tests of the full-text search over Location and Notes (HistorySearchIndex)."""
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from app_cli import synthetic_history
+from HistorySearchIndex import HistorySearchIndex
+from ScreeningLoader import ScreeningLoader
+
+TEXTS = [
+    ("Hôpital Bichat", "PrEP checkpoint"),
+    ("Hopital Bichat", "prep"),
+    ("Checkpoint Paris", "preparation for the visit"),
+    ("Home test", ""),
+    ("CeGIDD Bichat", "PrEP follow-up, PrEP renewal"),
+]
+
+
+@pytest.fixture
+def screening(history_dir: Path) -> ScreeningLoader:
+    """Return a store holding one row per entry of TEXTS (row ids 0 to 4)."""
+    screening = ScreeningLoader(save_dir=history_dir)
+    rows = synthetic_history(len(TEXTS)).assign(
+        Location=[location for location, _ in TEXTS], Notes=[notes for _, notes in TEXTS],
+    )
+    screening.append_register(rows, allow_duplicates=True)
+    return screening
+
+
+def _ids(results: list[tuple[int, float]]) -> list[int]:
+    """Return the row ids of search results, in rank order."""
+    return [row_id for row_id, _ in results]
+
+
+def test_search_matches_word_prefixes_without_accents(screening: ScreeningLoader) -> None:
+    """Every query word must prefix-match a word of the row, ignoring case and accents."""
+    assert sorted(_ids(screening.search("hop bich"))) == [0, 1]
+    assert sorted(_ids(screening.search("HÔPITAL"))) == [0, 1]
+    assert _ids(screening.search("bichat checkpoint")) == [0]
+    assert screening.search("bichat paris") == []
+    assert screening.search("  ") == []
+
+
+def test_search_ranking(screening: ScreeningLoader) -> None:
+    """Repeated words score higher, prefixes score less than the exact word, and `limit` keeps the best rows."""
+    results = screening.search("prep")
+    scores = dict(results)
+
+    assert sorted(scores) == [0, 1, 2, 4]
+    assert [score for _, score in results] == sorted(scores.values(), reverse=True)
+    # PrEP twice in the notes; equal scores rank the latest row first
+    assert scores[4] > scores[1] == scores[0]
+    assert _ids(results).index(1) < _ids(results).index(0)
+
+    [(_, exact)] = screening.search("preparation")
+    [(_, prefix)] = screening.search("prepar")
+    assert prefix == pytest.approx(HistorySearchIndex.PREFIX_WEIGHT * exact)
+
+    assert screening.search("prep", limit=2) == results[:2]
+    assert sorted(_ids(screening.search("prep", within=[1, 2, 3]))) == [1, 2]
+
+
+def test_journal_is_replayed_by_other_sessions(screening: ScreeningLoader, caplog: pytest.LogCaptureFixture) -> None:
+    """Changes made after the index was built are journaled, and a new process replays them without a rebuild."""
+    assert _ids(screening.search("checkpoint paris")) == [2]
+
+    # Another session changes the history
+    other = ScreeningLoader(save_dir=screening.save_dir)
+    other.delete_ids([2])
+    other.append_register(synthetic_history(1, seed=1).assign(Location="Checkpoint Paris", Notes="new visit"))
+    assert other.update_rows({3: {"Notes": "Checkpoint reminder"}}) == []
+    assert (screening.save_dir / HistorySearchIndex.JOURNAL_FILENAME).read_text(encoding="utf-8").count("\n") == 3
+
+    # As in a new process: only the files are left
+    HistorySearchIndex._CACHE.clear()
+    fresh = ScreeningLoader(save_dir=screening.save_dir)
+    caplog.clear()
+    with caplog.at_level("INFO", logger="STITracker"):
+        assert _ids(fresh.search("checkpoint paris")) == [5]
+        assert sorted(_ids(fresh.search("checkpoint"))) == [0, 3, 5]
+    assert "rebuilding" not in caplog.text
+
+    # The replayed index answers like one rebuilt from the history
+    rebuilt = HistorySearchIndex(save_dir=screening.save_dir, persistent=False)
+    rebuilt.rebuild(fresh.patient_history, fresh.version)
+    for query in ("checkpoint", "prep", "bichat", "visit"):
+        assert fresh.search(query) == rebuilt.search(query)
+
+
+def test_search_follows_the_history_version(screening: ScreeningLoader) -> None:
+    """A session searching after its own writes sees them at once."""
+    screening.search("bichat")
+    screening.append_register(synthetic_history(1, seed=2).assign(Location="Bichat annex", Notes=""))
+    screening.delete_ids([0])
+
+    assert sorted(_ids(screening.search("bichat"))) == [1, 4, 5]
+    assert pd.Index(_ids(screening.search("bichat"))).isin(screening.patient_history.index).all()
@@ -0,0 +1,109 @@
+"""Tests of the retention policy (RetentionEngine): log rolling and the I/O budget."""
+import gzip
+import logging
+import logging.handlers
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import RetentionEngine as retention
+from RetentionEngine import RetentionEngine
+from ScreeningLoader import ScreeningLoader
+
+
+def test_roll_log_keeps_entries_written_around_the_roll(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Entries before the roll go to the archive, and entries written during or after it to a new app.log."""
+    engine = RetentionEngine(ScreeningLoader(save_dir=tmp_path / "patient_files"), log_dir=tmp_path / "logs",
+                             max_log_bytes=1)
+    engine.log_dir.mkdir()
+    handler = logging.handlers.WatchedFileHandler(engine.log_path, encoding="utf-8")
+    writer = logging.getLogger("test_roll_log")
+    writer.addHandler(handler)
+    writer.propagate = False
+    copy = shutil.copyfileobj
+
+    def copy_while_logging(source, target) -> None:
+        copy(source, target)
+        # Another session logs while the archive is being written
+        writer.warning("during the roll")
+
+    monkeypatch.setattr(retention.shutil, "copyfileobj", copy_while_logging)
+    try:
+        writer.warning("before the roll")
+        assert engine.roll_log() > 0
+        writer.warning("after the roll")
+    finally:
+        writer.removeHandler(handler)
+        handler.close()
+
+    [(_, archive)] = engine.archives()
+    assert gzip.decompress(archive.read_bytes()).decode() == "before the roll\n"
+    assert engine.log_path.read_text(encoding="utf-8") == "during the roll\nafter the roll\n"
+    assert not list(engine.log_dir.glob("*.rolling"))
+
+
+def _fragment(screening: ScreeningLoader, years: list[int]) -> None:
+    """Give the partitions of `years` a change log, by deleting one row of each."""
+    dates = screening.decode_history(screening.patient_history)["Test_date"]
+    screening.delete_ids([int(dates[dates.dt.year == year].index[0]) for year in years])
+
+
+def test_run_stops_at_its_io_budget(seeded: ScreeningLoader, tmp_path: Path) -> None:
+    """A run compacts partitions until its budget is spent, and the next runs pick up the rest."""
+    def stored() -> pd.DataFrame:
+        reloaded = ScreeningLoader(save_dir=seeded.save_dir)
+        reloaded.load_patient_history()
+        return reloaded.decode_history(reloaded.patient_history).sort_index()
+
+    _fragment(seeded, [2016, 2018, 2020, 2022])
+    before = stored()
+    engine = RetentionEngine(seeded, log_dir=tmp_path / "logs", min_compact_log_bytes=1)
+
+    def candidates() -> list[str]:
+        return seeded.compaction_candidates(engine.min_compact_log_bytes, engine.min_compact_unsorted_rows)
+
+    assert len(candidates()) == 4
+
+    # The first step always runs, even over budget
+    report = engine.run(io_budget_bytes=1)
+    assert len(report["compacted"]) == 1 and not report["complete"]
+    assert report["io_bytes"] > 1
+    assert len(candidates()) == 3
+
+    budget = report["io_bytes"]
+    runs = 1
+    while not report["complete"]:
+        report = engine.run(io_budget_bytes=budget)
+        assert report["io_bytes"] <= budget or len(report["compacted"]) == 1
+        runs += 1
+    assert runs > 2
+    assert candidates() == []
+    assert not list(seeded.save_dir.glob("patient_history.*.log.jsonl"))
+
+    pd.testing.assert_frame_equal(stored(), before)
+
+
+def test_unlimited_run_compacts_everything(seeded: ScreeningLoader, tmp_path: Path) -> None:
+    """Without a budget one run compacts every candidate."""
+    _fragment(seeded, [2016, 2018, 2020])
+    engine = RetentionEngine(seeded, log_dir=tmp_path / "logs", min_compact_log_bytes=1, io_budget_bytes=None)
+
+    report = engine.run()
+
+    assert report["complete"] and sorted(report["compacted"]) == ["2016", "2018", "2020"]
+    assert engine.run()["compacted"] == []
+
+
+def test_prune_archives_by_age_and_count(seeded: ScreeningLoader, tmp_path: Path) -> None:
+    """Archives past the age limit, then the oldest beyond the count limit, are deleted."""
+    engine = RetentionEngine(seeded, log_dir=tmp_path / "logs", max_log_age_days=30, max_log_archives=2)
+    engine.log_dir.mkdir()
+    now = datetime(2025, 3, 1)
+    for stamp in ("20250101-000000", "20250210-000000", "20250220-000000", "20250225-000000"):
+        (engine.log_dir / f"app.log.{stamp}.gz").write_bytes(gzip.compress(b"entry\n"))
+
+    assert engine.prune_archives(now=now) == 2
+    assert [rolled_at for rolled_at, _ in engine.archives()] == [datetime(2025, 2, 20), datetime(2025, 2, 25)]
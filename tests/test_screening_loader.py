@@ -0,0 +1,318 @@
+"""Tests of the partitioned history store (ScreeningLoader)."""
+import multiprocessing
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from app_cli import synthetic_history
+from Config_App import history_code_tables, patient_history_id_column
+from ScreeningLoader import ScreeningLoader
+
+# Writes per worker process in the concurrency test
+WRITES_PER_WORKER = 15
+
+
+def _append_worker(save_dir: Path, worker: int) -> None:
+    """Append one row at a time, each with a distinct location."""
+    screening = ScreeningLoader(save_dir=save_dir)
+    rows = synthetic_history(WRITES_PER_WORKER, seed=worker)
+    for position in range(WRITES_PER_WORKER):
+        screening.append_register(rows.iloc[[position]].assign(Location=f"Worker {worker} row {position}"))
+
+
+def _delete_worker(save_dir: Path, row_ids: list[int]) -> None:
+    """Delete rows one at a time."""
+    screening = ScreeningLoader(save_dir=save_dir)
+    for row_id in row_ids:
+        screening.delete_ids([row_id])
+
+
+def _update_worker(save_dir: Path, row_ids: list[int]) -> None:
+    """Correct the notes of rows one at a time."""
+    screening = ScreeningLoader(save_dir=save_dir)
+    for row_id in row_ids:
+        assert screening.update_rows({row_id: {"Notes": f"Updated {row_id}"}}) == []
+
+
+def _year(screening: ScreeningLoader, row_id: int) -> int:
+    """Return the test year of a row."""
+    return screening.decode_history(screening.patient_history.loc[[row_id]])["Test_date"].iloc[0].year
+
+
+def test_processes_share_one_store(seeded: ScreeningLoader) -> None:
+    """Appends, deletions and corrections from several processes are all kept."""
+    ids = seeded.patient_history.index.tolist()
+    deleted, updated = ids[:WRITES_PER_WORKER], ids[WRITES_PER_WORKER:2 * WRITES_PER_WORKER]
+
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=_append_worker, args=(seeded.save_dir, worker)) for worker in range(3)
+    ] + [
+        context.Process(target=_delete_worker, args=(seeded.save_dir, deleted)),
+        context.Process(target=_update_worker, args=(seeded.save_dir, updated)),
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=120)
+    assert [worker.exitcode for worker in workers] == [0] * len(workers)
+
+    history = ScreeningLoader(save_dir=seeded.save_dir)
+    history.load_patient_history()
+    shown = history.decode_history(history.patient_history)
+
+    assert len(shown) == len(ids) - len(deleted) + 3 * WRITES_PER_WORKER
+    assert shown.index.is_unique
+    assert not shown.index.isin(deleted).any()
+    assert (shown.loc[updated, "Notes"] == [f"Updated {row_id}" for row_id in updated]).all()
+    assert shown["Location"].str.startswith("Worker ").sum() == 3 * WRITES_PER_WORKER
+
+    # The first session catches up with the others on refresh
+    assert seeded.refresh()
+    assert seeded.patient_history.index.sort_values().equals(history.patient_history.index.sort_values())
+
+
+def test_single_file_history_is_migrated(history_dir: Path) -> None:
+    """A history in the single-file layout is rewritten as partitions, keeping its rows."""
+    history_dir.mkdir(parents=True)
+    legacy = synthetic_history(50).drop(columns="Entry_ts")
+    legacy["Test_date"] = legacy["Test_date"].dt.strftime("%Y-%m-%d")
+    legacy.loc[len(legacy)] = ["not a date", "HIV", legacy.at[0, "Test_type"], legacy.at[0, "Result"], "01234", ""]
+    legacy_path = history_dir / ScreeningLoader._FILENAME
+    legacy.to_csv(legacy_path, index=False)
+    original = legacy_path.read_bytes()
+
+    screening = ScreeningLoader(save_dir=history_dir)
+    screening.load_patient_history()
+
+    assert not legacy_path.exists()
+    # The original file is always kept
+    assert legacy_path.with_name(f"{legacy_path.name}.bak").read_bytes() == original
+    assert screening.read_meta()["partitions"]
+
+    reloaded = ScreeningLoader(save_dir=history_dir)
+    reloaded.load_patient_history()
+    shown = reloaded.decode_history(reloaded.patient_history).sort_index()
+
+    assert shown.index.tolist() == list(range(len(legacy)))
+    assert (shown["Test_date"].iloc[:-1].dt.strftime("%Y-%m-%d") == legacy["Test_date"].iloc[:-1]).all()
+    assert pd.isna(shown["Test_date"].iloc[-1])
+    assert shown["Location"].iloc[-1] == "01234"
+
+
+def test_migration_keeps_the_original_file(history_dir: Path) -> None:
+    """The single-file history is backed up even when every date parses."""
+    history_dir.mkdir(parents=True)
+    legacy_path = history_dir / ScreeningLoader._FILENAME
+    synthetic_history(10).drop(columns="Entry_ts").to_csv(legacy_path, index=False)
+    original = legacy_path.read_bytes()
+
+    ScreeningLoader(save_dir=history_dir).load_patient_history()
+
+    assert not legacy_path.exists()
+    assert legacy_path.with_name(f"{legacy_path.name}.bak").read_bytes() == original
+
+
+def test_update_moves_row_to_its_new_partition(seeded: ScreeningLoader) -> None:
+    """Changing a test date to another year moves the row to that year's partition."""
+    row_id = next(row_id for row_id in seeded.patient_history.index if _year(seeded, row_id) == 2016)
+
+    assert seeded.update_rows({row_id: {"Test_date": "2023-06-01", "Notes": "moved"}}) == []
+    assert _year(seeded, row_id) == 2023
+
+    reloaded = ScreeningLoader(save_dir=seeded.save_dir)
+    reloaded.load_patient_history()
+
+    assert reloaded.patient_history.index.is_unique
+    assert len(reloaded.patient_history) == len(seeded.patient_history)
+    assert _year(reloaded, row_id) == 2023
+    assert reloaded.decode_history(reloaded.patient_history.loc[[row_id]])["Notes"].iloc[0] == "moved"
+    assert row_id in reloaded.load_range("2023-01-01", "2023-12-31").index
+    assert row_id not in reloaded.load_range("2016-01-01", "2016-12-31").index
+    assert reloaded.read_meta()["partitions"]["2016"]["rows"] == (
+        reloaded.load_range("2016-01-01", "2016-12-31").shape[0]
+    )
+
+
+def test_failed_update_leaves_memory_unchanged(seeded: ScreeningLoader, monkeypatch: pytest.MonkeyPatch) -> None:
+    """A correction that cannot be written is not applied to the in-memory history."""
+    before = seeded.patient_history.copy()
+    version = seeded.version
+    row_id = int(before.index[0])
+
+    def failing_commit(*args, **kwargs) -> None:
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(seeded, "_commit", failing_commit)
+    with pytest.raises(OSError):
+        seeded.update_rows({row_id: {"Notes": "never saved"}})
+
+    assert seeded.version == version
+    pd.testing.assert_frame_equal(seeded.patient_history, before)
+
+
+def test_writes_leave_snapshots_unchanged(seeded: ScreeningLoader) -> None:
+    """Frames handed out by `snapshot` are never modified by later writes."""
+    history, version = seeded.snapshot()
+    before = history.copy()
+    ids = history.index
+
+    assert seeded.update_rows({int(ids[0]): {"Test_date": "2024-12-30", "Notes": "moved"}}) == []
+    seeded.append_register(synthetic_history(5, seed=1))
+    seeded.delete_ids(ids[1:3])
+
+    assert seeded.version > version
+    assert seeded.patient_history is not history
+    pd.testing.assert_frame_equal(history, before)
+
+    # Aligning categories for a concatenation copies the frames it changes
+    extra = before.iloc[:1].assign(Location="Elsewhere")
+    extra["STI"] = extra["STI"].cat.add_categories(["Unknown STI"])
+    extra.loc[:, "STI"] = "Unknown STI"
+    combined = ScreeningLoader._concat([history, extra])
+
+    assert "Unknown STI" in combined["STI"].cat.categories
+    pd.testing.assert_frame_equal(history, before)
+
+
+def test_append_to_partition_created_by_a_correction(history_dir: Path) -> None:
+    """Rows appended to a partition that only exists in its change log get a CSV with a header."""
+    screening = ScreeningLoader(save_dir=history_dir)
+    screening.append_register(synthetic_history(1).assign(Test_date=pd.Timestamp("2024-03-01")))
+    assert screening.update_rows({0: {"Test_date": "2019-06-01"}}) == []
+    assert not screening.partition_path("2019").exists()
+    screening.append_register(synthetic_history(1, seed=1).assign(Test_date=pd.Timestamp("2019-07-01")))
+
+    reloaded = ScreeningLoader(save_dir=history_dir)
+    reloaded.load_patient_history()
+    shown = reloaded.decode_history(reloaded.patient_history).sort_index()
+
+    assert shown.index.tolist() == [0, 1]
+    assert shown["Test_date"].dt.strftime("%Y-%m-%d").tolist() == ["2019-06-01", "2019-07-01"]
+
+
+def test_compact_folds_change_logs(seeded: ScreeningLoader) -> None:
+    """Compaction keeps the rows and ids, sorts the files and removes the change logs."""
+    ids = seeded.patient_history.index
+    seeded.delete_ids(ids[:5])
+    assert seeded.update_rows({int(ids[5]): {"Location": "Compacted"}}) == []
+    seeded.append_register(synthetic_history(10, seed=1).assign(Location="Late entry"))
+    assert list(seeded.save_dir.glob("patient_history.*.log.jsonl"))
+
+    def stored() -> tuple[ScreeningLoader, pd.DataFrame]:
+        reloaded = ScreeningLoader(save_dir=seeded.save_dir)
+        reloaded.load_patient_history()
+        return reloaded, reloaded.decode_history(reloaded.patient_history).sort_index()
+
+    before = stored()[1]
+    assert seeded.compact()
+    reloaded, after = stored()
+
+    assert not list(seeded.save_dir.glob("patient_history.*.log.jsonl"))
+    assert len(after) == len(seeded.patient_history)
+
+    pd.testing.assert_frame_equal(after, before, check_like=True)
+    for name in reloaded.read_meta()["partitions"]:
+        written = pd.read_csv(reloaded.partition_path(name), dtype=ScreeningLoader.CSV_DTYPES)
+        assert written["Test_date"].is_monotonic_increasing
+        assert written.set_index(patient_history_id_column).index.isin(after.index).all()
+
+
+def test_blank_values_are_stored_as_missing(history_dir: Path) -> None:
+    """An empty test type or result is missing in memory, as it is once read back from the files."""
+    screening = ScreeningLoader(save_dir=history_dir)
+    screening.append_register(synthetic_history(2).assign(Test_type=["", "Other / Don’t know"], Result=""))
+
+    reloaded = ScreeningLoader(save_dir=history_dir)
+    reloaded.load_patient_history()
+
+    assert screening.patient_history["Result"].isna().all()
+    assert "" not in screening.patient_history["Test_type"].cat.categories
+    columns = list(history_code_tables)
+    pd.testing.assert_frame_equal(
+        reloaded.patient_history.sort_index()[columns], screening.patient_history.sort_index()[columns]
+    )
+    # Duplicate checks agree between the writing session and the others
+    assert (ScreeningLoader.duplicate_keys(reloaded.patient_history.sort_index())
+            == ScreeningLoader.duplicate_keys(screening.patient_history.sort_index())).all()
+
+
+def test_duplicate_rows_are_skipped(history_dir: Path) -> None:
+    """Rows repeating a stored row, or an earlier row of the same batch, are not appended."""
+    screening = ScreeningLoader(save_dir=history_dir)
+    rows = synthetic_history(10).assign(Location=[f"Lab {position}" for position in range(10)])
+    assert screening.append_register(rows) == 10
+
+    # Locations match trimmed and case-insensitively; notes are not part of the key
+    again = rows.iloc[:3].assign(Location=lambda frame: " " + frame["Location"].str.upper(), Notes="resubmitted")
+    assert screening.append_register(again) == 0
+    assert screening.append_register(pd.concat([rows.iloc[[0]].assign(Location="New lab")] * 2)) == 1
+    # A missing location is the same as an empty one
+    assert screening.append_register(rows.iloc[[1]].assign(Location="")) == 1
+    assert screening.append_register(rows.iloc[[1]].assign(Location=None)) == 0
+
+    assert screening.append_register(rows.iloc[:2], allow_duplicates=True) == 2
+    assert len(screening.patient_history) == 14
+    assert screening.find_duplicates().tolist() == [12, 13]
+
+
+def test_duplicate_check_follows_other_sessions(seeded: ScreeningLoader) -> None:
+    """Rows deleted or corrected by another session no longer block an append."""
+    row_id = int(seeded.patient_history.index[0])
+    row = seeded.decode_history(seeded.patient_history.loc[[row_id]])
+    assert seeded.append_register(row) == 0
+
+    other = ScreeningLoader(save_dir=seeded.save_dir)
+    other.delete_ids([row_id])
+    assert seeded.append_register(row) == 1
+
+    new_id = int(seeded.patient_history.index.max())
+    assert other.update_rows({new_id: {"Location": "Corrected lab"}}) == []
+    assert seeded.append_register(row) == 1
+    assert seeded.append_register(row.assign(Location="corrected LAB")) == 0
+
+
+def test_dedupe_keeps_the_first_row(seeded: ScreeningLoader) -> None:
+    """Stored duplicates are deleted, keeping the lowest row id of each key."""
+    copies = seeded.decode_history(seeded.patient_history.iloc[:5])
+    seeded.append_register(copies, allow_duplicates=True)
+    first = seeded.patient_history.index[:5].tolist()
+    duplicates = seeded.find_duplicates()
+
+    assert len(duplicates) >= 5 and not duplicates.isin(first).any()
+    assert seeded.dedupe() == len(duplicates)
+    assert seeded.find_duplicates().empty
+    assert seeded.patient_history.index.isin(first).sum() == 5
+
+
+def test_facets_count_the_history(seeded: ScreeningLoader) -> None:
+    """Facets hold the value counts and date bounds of the history, and are cached per version."""
+    shown = seeded.decode_history(seeded.patient_history)
+    facets = seeded.facets()
+
+    assert facets["rows"] == len(shown)
+    for column in ScreeningLoader.FACET_COLUMNS:
+        assert facets[column] == dict(sorted(shown[column].value_counts().items()))
+    assert facets["first_test"] == shown["Test_date"].min().date()
+    assert facets["last_test"] == shown["Test_date"].max().date()
+    # Every session of the process shares them until the history changes
+    assert ScreeningLoader(save_dir=seeded.save_dir).facets() is facets
+
+    seeded.append_register(synthetic_history(1).assign(
+        Test_date=pd.Timestamp("2030-01-01"), STI="HIV", Result="", Location="Future lab",
+    ))
+    updated = seeded.facets()
+
+    assert updated is not facets
+    assert updated["STI"]["HIV"] == facets["STI"].get("HIV", 0) + 1
+    assert updated["Result"] == facets["Result"]
+    assert updated["last_test"] == pd.Timestamp("2030-01-01").date()
+
+
+def test_facets_of_an_empty_history(history_dir: Path) -> None:
+    """An empty history has no values and no date bounds."""
+    facets = ScreeningLoader(save_dir=history_dir).facets()
+
+    assert facets["rows"] == 0 and facets["STI"] == {}
+    assert facets["first_test"] is None and facets["last_test"] is None
@@ -0,0 +1,135 @@
+"""Tests of the encrypted storage (StorageCipher) through the history store and the CLI."""
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("cryptography")
+
+import app_cli
+from app_cli import build_stores, synthetic_history
+from ScreeningLoader import ScreeningLoader
+from StorageCipher import EncryptionError, StorageCipher
+
+PASSPHRASE = "correct horse battery staple"
+
+
+@pytest.fixture
+def encrypted_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Return a data folder holding an encrypted history of 300 rows and encrypted preferences."""
+    monkeypatch.setenv(StorageCipher.PASSPHRASE_ENV, PASSPHRASE)
+    screening, preferences = build_stores(tmp_path)
+    screening.append_register(synthetic_history(300), allow_duplicates=True)
+    preferences.set_preferences({"tracked_stis": ["HIV", "Syphilis"], "reminder_hour": "09:00", "profile_tags": []})
+    assert preferences.save_preferences()
+    return tmp_path
+
+
+def _stored_history(data_dir: Path) -> pd.DataFrame:
+    """Load the history of `data_dir` with the current environment, decoded and sorted by row id."""
+    screening, _ = build_stores(data_dir)
+    screening.load_patient_history()
+    return screening.decode_history(screening.patient_history).sort_index()
+
+
+def test_files_are_encrypted_at_rest(encrypted_dir: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Partitions and preferences are encrypted, and reading them needs the passphrase."""
+    screening, preferences = build_stores(encrypted_dir)
+
+    assert screening.encrypted_files()
+    assert StorageCipher.is_encrypted(preferences.build_path())
+    assert len(_stored_history(encrypted_dir)) == 300
+
+    monkeypatch.delenv(StorageCipher.PASSPHRASE_ENV)
+    with pytest.raises(EncryptionError):
+        _stored_history(encrypted_dir)
+
+
+def test_decrypt_round_trip(encrypted_dir: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """`decrypt` rewrites every file in plain text, then a plain session reads the same history."""
+    before = _stored_history(encrypted_dir)
+
+    assert app_cli.main(["--data-dir", str(encrypted_dir), "decrypt"]) == 0
+
+    monkeypatch.delenv(StorageCipher.PASSPHRASE_ENV)
+    screening, preferences = build_stores(encrypted_dir)
+    assert screening.encrypted_files() == []
+    assert not screening.read_meta()["encrypted"]
+    assert not StorageCipher.is_encrypted(preferences.build_path())
+    assert not list(encrypted_dir.rglob(StorageCipher.KEY_FILENAME))
+    assert preferences.load_preferences() and preferences.reminder_hour == "09:00"
+    pd.testing.assert_frame_equal(_stored_history(encrypted_dir), before)
+
+    # Encrypting again starts over with the new passphrase
+    monkeypatch.setenv(StorageCipher.PASSPHRASE_ENV, "another passphrase")
+    assert app_cli.main(["--data-dir", str(encrypted_dir), "encrypt"]) == 0
+    assert build_stores(encrypted_dir)[0].encrypted_files()
+    pd.testing.assert_frame_equal(_stored_history(encrypted_dir), before)
+
+
+def test_failed_decrypt_keeps_data_and_keys(encrypted_dir: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """A write failing halfway through `decrypt` loses no row and keeps the key files."""
+    before = _stored_history(encrypted_dir)
+    write_partition = ScreeningLoader._write_partition
+    calls = []
+
+    def failing_write(self: ScreeningLoader, meta: dict, name: str, rows: pd.DataFrame) -> None:
+        calls.append(name)
+        if len(calls) == 3:
+            raise OSError("No space left on device")
+        write_partition(self, meta, name, rows)
+
+    monkeypatch.setattr(ScreeningLoader, "_write_partition", failing_write)
+
+    assert app_cli.main(["--data-dir", str(encrypted_dir), "decrypt"]) == 1
+
+    monkeypatch.undo()
+    monkeypatch.setenv(StorageCipher.PASSPHRASE_ENV, PASSPHRASE)
+    assert (encrypted_dir / "patient_files" / StorageCipher.KEY_FILENAME).exists()
+    assert (encrypted_dir / "preference_settings" / StorageCipher.KEY_FILENAME).exists()
+    pd.testing.assert_frame_equal(_stored_history(encrypted_dir), before)
+
+    # A second attempt completes
+    assert app_cli.main(["--data-dir", str(encrypted_dir), "decrypt"]) == 0
+    monkeypatch.delenv(StorageCipher.PASSPHRASE_ENV)
+    pd.testing.assert_frame_equal(_stored_history(encrypted_dir), before)
+
+
+def test_truncated_file_is_rejected(encrypted_dir: Path) -> None:
+    """Records cut off the end of an encrypted partition are reported, not silently dropped."""
+    screening, _ = build_stores(encrypted_dir)
+    name = max(screening.read_meta()["partitions"], key=lambda name: screening.read_meta()["partitions"][name]["rows"])
+    path = screening.partition_path(name)
+    data = path.read_bytes()
+    # Drop the final record (its length prefix, nonce and tag at least)
+    path.write_bytes(data[:len(data) - 40])
+
+    with pytest.raises(EncryptionError):
+        _stored_history(encrypted_dir)
+
+
+def test_interrupted_append_is_skipped(encrypted_dir: Path, caplog: pytest.LogCaptureFixture) -> None:
+    """Complete records left by an append that never wrote its final record are ignored, then dropped."""
+    before = _stored_history(encrypted_dir)
+    screening, _ = build_stores(encrypted_dir)
+    year = min(screening.read_meta()["partitions"])
+    path = screening.partition_path(year)
+
+    # An append that wrote two full records, then stopped before its final record
+    writer = screening.cipher._open_writer(path, append=True)
+    writer.write(b"1,garbage" * StorageCipher.CHUNK_BYTES)
+    writer._file.close()
+
+    with caplog.at_level("WARNING", logger="STITracker"):
+        pd.testing.assert_frame_equal(_stored_history(encrypted_dir), before)
+    assert "interrupted append" in caplog.text
+
+    # The next append to that partition drops the leftover records
+    size = path.stat().st_size
+    screening.append_register(
+        synthetic_history(1, seed=1).assign(Test_date=pd.Timestamp(f"{year}-06-15"), Location="After the crash")
+    )
+    assert path.stat().st_size < size
+    after = _stored_history(encrypted_dir)
+    assert len(after) == len(before) + 1
+    assert (after["Location"] == "After the crash").sum() == 1
@@ -0,0 +1,79 @@
+"""Tests of the preferences store (UserPreferences): versioning and the stat-keyed cache."""
+from pathlib import Path
+
+import pytest
+
+from UserPreferences import UserPreferences
+
+PREFERENCES = {"tracked_stis": ["HIV", "Syphilis"], "reminder_hour": "08:00", "profile_tags": ["PrEP user"]}
+
+
+@pytest.fixture
+def save_dir(tmp_path: Path) -> Path:
+    """Return a preferences folder holding saved PREFERENCES (version 1)."""
+    preferences = UserPreferences(save_dir=tmp_path / "preference_settings")
+    preferences.set_preferences(PREFERENCES)
+    assert preferences.save_preferences()
+    return preferences.save_dir
+
+
+def test_unchanged_preferences_are_not_rewritten(save_dir: Path) -> None:
+    """Saving the same content leaves the file and its version alone; a change bumps the version."""
+    preferences = UserPreferences(save_dir=save_dir)
+    assert preferences.load_preferences() and preferences.preferences_version == 1
+    path = preferences.build_path()
+    before = path.stat()
+
+    assert not preferences.save_preferences()
+    assert (path.stat().st_ino, path.stat().st_mtime_ns) == (before.st_ino, before.st_mtime_ns)
+    assert preferences.preferences_version == 1
+
+    preferences.set_preferences({"reminder_hour": "09:30"})
+    assert preferences.save_preferences()
+    assert preferences.preferences_version == 2
+
+    # Back to the first content: still a new version
+    preferences.set_preferences({"reminder_hour": "08:00"})
+    assert preferences.save_preferences()
+    assert preferences.preferences_version == 3
+
+
+def test_loads_are_served_from_the_cache_until_the_file_changes(
+    save_dir: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """An unchanged file is not parsed again, and a write from another session is picked up on the next load."""
+    UserPreferences(save_dir=save_dir).load_preferences()
+    opened = []
+    open_file = UserPreferences.open_file
+
+    def counting_open(self: UserPreferences, path: Path, mode: str = "r"):
+        opened.append(mode)
+        return open_file(self, path, mode)
+
+    monkeypatch.setattr(UserPreferences, "open_file", counting_open)
+
+    first, second = UserPreferences(save_dir=save_dir), UserPreferences(save_dir=save_dir)
+    assert first.load_preferences() and second.load_preferences()
+    assert opened == []
+    assert first.to_dict() == PREFERENCES
+
+    # Sessions get their own copies of the cached lists
+    first.tracked_stis.append("Gonorrhea")
+    assert second.tracked_stis == PREFERENCES["tracked_stis"]
+
+    # Another session of this process saves: it leaves its content in the cache
+    other = UserPreferences(save_dir=save_dir)
+    other.set_preferences({"tracked_stis": ["Chlamydia"]})
+    assert other.save_preferences()
+
+    assert second.load_preferences()
+    assert second.tracked_stis == ["Chlamydia"] and second.preferences_version == 2
+    assert opened == ["w"]
+
+    # Another process rewrites the file: the new signature makes the next load parse it
+    path = second.build_path()
+    path.write_text(path.read_text(encoding="utf-8").replace("Chlamydia", "Syphilis"), encoding="utf-8")
+
+    assert second.load_preferences()
+    assert second.tracked_stis == ["Syphilis"]
+    assert opened == ["w", "r"]